@@ -0,0 +1,155 @@
+"""Кэш результатов analyze_chart по содержимому.
+
+Ключ — хэш байтов картинки (или для автографиков — пара + время последней
+свечи) вместе с моделью и версией промпта. Записи живут TTL секунд,
+вытесняются по LRU и сохраняются на диск, чтобы пережить перезапуск.
+Одинаковые запросы, пришедшие одновременно, ждут один общий вызов.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+
+class AnalysisCache:
+    """TTL + LRU кэш с сохранением в JSON"""
+
+    def __init__(self, path: str, *, ttl: float = 600.0, max_entries: int = 1000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._persist_task: asyncio.Task | None = None
+        self._persist_writing = False  # отложенная запись уже ушла в поток
+
+    # --- ключи ---
+
+    @staticmethod
+    def image_key(image_bytes: bytes, model: str, prompt_version: str) -> str:
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        return f"img:{digest}:{model}:{prompt_version}"
+
+    @staticmethod
+    def chart_key(symbol: str, timeframe: str, last_candle_ms: int, model: str, prompt_version: str) -> str:
+        return f"chart:{symbol}:{timeframe}:{last_candle_ms}:{model}:{prompt_version}"
+
+    # --- доступ ---
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value) -> None:
+        self._entries[key] = (time.time() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self.schedule_persist()
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[object]],
+        cacheable: Callable[[object], bool] = lambda value: True,
+    ):
+        """Вернуть значение из кэша или вычислить его (один вызов на ключ)"""
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.hits += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+            if cacheable(value):
+                self.put(key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим; гасим "never retrieved"
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    # --- сохранение ---
+
+    def load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[analysis-cache] failed to load {self.path}: {e}")
+            return
+        now = time.time()
+        for key, expires_at, value in data:
+            if expires_at > now:
+                self._entries[key] = (expires_at, value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _write(self, snapshot: list) -> None:
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _snapshot(self) -> list:
+        now = time.time()
+        return [[key, expires_at, value] for key, (expires_at, value) in self._entries.items() if expires_at > now]
+
+    async def _persist(self) -> None:
+        try:
+            await asyncio.sleep(1)
+            self._persist_writing = True
+            await asyncio.to_thread(self._write, self._snapshot())
+        except Exception as e:
+            print(f"[analysis-cache] failed to persist: {e}")
+        finally:
+            self._persist_writing = False
+            self._persist_task = None
+
+    def schedule_persist(self) -> None:
+        if self._persist_task is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(self._snapshot())
+            return
+        self._persist_task = loop.create_task(self._persist())
+
+    async def flush(self) -> None:
+        """Дождаться отложенной записи (если она уже пишет файл) и сохранить кэш"""
+        task = self._persist_task
+        if task is not None:
+            if not self._persist_writing:
+                task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            self._persist_task = None
+        await asyncio.to_thread(self._write, self._snapshot())
@@ -0,0 +1,79 @@
+"""Бенчмарк рендера графика: mplfinance с нуля vs переиспользуемая заготовка.
+
+Каждый вариант (рендерер × число свечей) меряется в отдельном процессе,
+чтобы пиковый RSS не смешивался: renders/sec по всему пути (рисование +
+кодирование PNG), отдельно время рисования, и ru_maxrss процесса.
+
+Запуск: python benchmarks/bench_chart_render.py [кадров]
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def make_frames(n: int, count: int):
+    """Скользящее окно по синтетической истории: каждый кадр — новые данные"""
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(11)
+    total = n + count
+    close = 150 + np.cumsum(rng.normal(0, 0.6, total))
+    open_ = np.r_[close[0], close[:-1]]
+    spread = np.abs(rng.normal(0, 0.4, total))
+    index = pd.date_range("2024-01-01", periods=total, freq="5min", name="datetime")
+    full = pd.DataFrame({
+        "open": open_, "high": np.maximum(open_, close) + spread, "low": np.minimum(open_, close) - spread,
+        "close": close, "volume": rng.uniform(1e3, 1e5, total),
+    }, index=index)
+    return [full.iloc[i:i + n] for i in range(count)]
+
+
+def child(renderer: str, n: int, count: int) -> dict:
+    import matplotlib
+    matplotlib.use("Agg")
+    from chart_render import render_chart
+    from image_encoding import ImageSpec
+
+    spec = ImageSpec("png")
+    frames = make_frames(n, count + 1)
+    render_chart(frames[0], "BENCH", "BENCH - 5m", spec, spec, renderer=renderer)  # прогрев
+    draw = 0.0
+    started = time.perf_counter()
+    for df in frames[1:]:
+        draw += render_chart(df, "BENCH", "BENCH - 5m", spec, spec, renderer=renderer).render_seconds
+    elapsed = time.perf_counter() - started
+    return {
+        "renders_per_sec": count / elapsed,
+        "draw_ms": draw / count * 1000,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        print(json.dumps(child(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))))
+        return
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(f"{'candles':>7} {'renderer':>8} {'renders/s':>10} {'draw ms':>8} {'peak RSS MB':>12}")
+    for n in (200, 1000):
+        results = {}
+        for renderer in ("mpf", "fast"):
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", renderer, str(n), str(count)],
+                check=True, capture_output=True, text=True,
+            )
+            r = results[renderer] = json.loads(out.stdout.strip().splitlines()[-1])
+            print(f"{n:>7} {renderer:>8} {r['renders_per_sec']:10.2f} {r['draw_ms']:8.1f} {r['peak_rss_mb']:12.1f}")
+        speedup = results["fast"]["renders_per_sec"] / results["mpf"]["renders_per_sec"]
+        print(f"{'':>7} {'x':>8} {speedup:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
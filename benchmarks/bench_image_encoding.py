@@ -0,0 +1,103 @@
+"""Размер и скорость кодирования графика в разных форматах.
+
+Для каждой спецификации (формат:макс_сторона:качество) печатает байты,
+размер base64-полезной нагрузки, время кодирования и PSNR относительно
+исходного растра. С флагом --gemini каждый вариант дополнительно уходит
+в модель (нужны те же переменные окружения, что и боту): видно полную
+задержку запроса и совпадает ли сигнал с эталонным PNG.
+
+Запуск: python benchmarks/bench_image_encoding.py [--gemini] [спецификации...]
+"""
+import asyncio
+import base64
+import io
+import os
+import sys
+import time
+
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+from PIL import Image  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chart_render import render_chart  # noqa: E402
+from image_encoding import ImageSpec, encode_image  # noqa: E402
+
+SPECS = ["png", "png8::64", "png8:1280:32", "jpeg::90", "jpeg:1280:85", "jpeg:1024:80", "webp:1280:80", "webp:1024:70", "jpeg:768:80"]
+
+
+def make_frame(n: int = 200) -> pd.DataFrame:
+    rng = np.random.default_rng(7)
+    close = 150 + np.cumsum(rng.normal(0, 0.6, n))
+    open_ = np.r_[close[0], close[:-1]]
+    spread = np.abs(rng.normal(0, 0.4, n))
+    index = pd.date_range("2024-01-01", periods=n, freq="5min", name="datetime")
+    return pd.DataFrame({
+        "open": open_, "high": np.maximum(open_, close) + spread, "low": np.minimum(open_, close) - spread,
+        "close": close, "volume": rng.uniform(1e3, 1e5, n),
+    }, index=index)
+
+
+def psnr(reference: Image.Image, encoded: bytes) -> float:
+    """PSNR декодированного варианта против эталона, приведенного к тому же размеру"""
+    decoded = Image.open(io.BytesIO(encoded)).convert("RGB")
+    ref = reference.resize(decoded.size, Image.LANCZOS) if decoded.size != reference.size else reference
+    mse = np.mean((np.asarray(ref, dtype=np.float64) - np.asarray(decoded, dtype=np.float64)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+async def ask_gemini(variants):
+    """Отправить каждый вариант в модель тем же путем, что и бот"""
+    import bot
+    from signal_parser import parse_signal
+
+    await bot.render_pool.start()
+    try:
+        for spec, encoded in variants:
+            started = time.perf_counter()
+            raw = await bot._call_google(
+                encoded.data, bot.prompt_manager, bot.GOOGLE_MODEL,
+                bot.google_generation_config(bot.ANALYSIS_MODE), mime_type=encoded.mime_type,
+            )
+            parsed = parse_signal(raw)
+            print(f"{spec:>14}: {time.perf_counter() - started:5.1f} s  {parsed.signal:<8} SL {parsed.stop_loss} TP {parsed.tp_price}")
+    finally:
+        await bot.render_pool.shutdown()
+        await bot.http_client.close()
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    specs = [ImageSpec.parse(s) for s in (args or SPECS)]
+    reference_spec = ImageSpec("png")
+
+    # Эталон — растр бота без потерь (PNG), декодированный обратно
+    images = render_chart(make_frame(), "BENCH", "BENCH - 5m", reference_spec, reference_spec)
+    reference = Image.open(io.BytesIO(images.display.data)).convert("RGB")
+    print(f"raster {reference.size[0]}x{reference.size[1]}, draw {images.render_seconds * 1000:.0f} ms\n")
+
+    print(f"{'spec':>14} {'size':>10} {'KB':>8} {'base64 KB':>10} {'encode ms':>10} {'PSNR dB':>8}")
+    variants = []
+    for spec in specs:
+        timings = []
+        for _ in range(5):
+            started = time.perf_counter()
+            encoded = encode_image(reference, spec)
+            timings.append(time.perf_counter() - started)
+        variants.append((str(spec), encoded))
+        b64 = len(base64.b64encode(encoded.data))
+        print(
+            f"{str(spec):>14} {encoded.width:>4}x{encoded.height:<5} {len(encoded) / 1024:8.1f} {b64 / 1024:10.1f} "
+            f"{min(timings) * 1000:10.1f} {psnr(reference, encoded.data):8.1f}"
+        )
+
+    if "--gemini" in sys.argv:
+        print()
+        asyncio.run(ask_gemini(variants))
+
+
+if __name__ == "__main__":
+    main()
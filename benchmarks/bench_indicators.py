@@ -0,0 +1,106 @@
+"""Бенчмарк индикаторов: pandas по символу vs векторный numpy по символу и пачкой.
+
+Считает EMA20/50/200, RSI14, ATR14, BB20 и VWAP дня по всем свечам
+для многих символов; отдельно — шаг IndicatorEngine на одну новую свечу
+против полного пересчета окна (как было бы без инкрементального состояния).
+
+Запуск: python benchmarks/bench_indicators.py [символов] [свечей]
+"""
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import indicators as ind  # noqa: E402
+
+
+def make_market(symbols: int, n: int):
+    rng = np.random.default_rng(5)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.003, (symbols, n)), axis=1))
+    open_ = np.concatenate([close[:, :1], close[:, :-1]], axis=1)
+    spread = np.abs(rng.normal(0, 0.002, (symbols, n))) * close
+    high = np.maximum(open_, close) + spread
+    low = np.minimum(open_, close) - spread
+    volume = rng.uniform(1e3, 1e5, (symbols, n))
+    ts = 1_700_000_000_000 + np.arange(n, dtype=np.int64) * 300_000
+    return ts, open_, high, low, close, volume
+
+
+def pandas_symbol(ts, high, low, close, volume) -> dict:
+    """Типичная реализация на pandas: ewm/rolling/groupby по одному символу"""
+    c, h, l, v = pd.Series(close), pd.Series(high), pd.Series(low), pd.Series(volume)
+    out = {f"ema{span}": c.ewm(span=span, adjust=False).mean() for span in ind.EMA_SPANS}
+    delta = c.diff().fillna(0)
+    gain = delta.clip(lower=0).ewm(alpha=1 / ind.RSI_PERIOD, adjust=False).mean()
+    loss = (-delta).clip(lower=0).ewm(alpha=1 / ind.RSI_PERIOD, adjust=False).mean()
+    out["rsi"] = 100 * gain / (gain + loss)
+    prev = c.shift(1).fillna(c.iloc[0])
+    tr = pd.concat([h - l, (h - prev).abs(), (l - prev).abs()], axis=1).max(axis=1)
+    out["atr"] = tr.ewm(alpha=1 / ind.ATR_PERIOD, adjust=False).mean()
+    mid, std = c.rolling(ind.BB_PERIOD).mean(), c.rolling(ind.BB_PERIOD).std(ddof=0)
+    out["bb_lower"], out["bb_upper"] = mid - ind.BB_WIDTH * std, mid + ind.BB_WIDTH * std
+    day = pd.Series(ts // ind.DAY_MS)
+    pv = (h + l + c) / 3 * v
+    out["vwap"] = pv.groupby(day).cumsum() / v.groupby(day).cumsum()
+    return out
+
+
+def numpy_all(ts, high, low, close, volume) -> dict:
+    """Те же ряды векторными функциями; работает и для (n,), и для (symbols, n)"""
+    out = {f"ema{span}": ind.ema(close, span) for span in ind.EMA_SPANS}
+    out["rsi"] = ind.rsi(close)
+    out["atr"] = ind.atr(high, low, close)
+    out["bb_lower"], _, out["bb_upper"] = ind.bollinger(close)
+    out["vwap"] = ind.vwap(ts, high, low, close, volume)
+    return out
+
+
+def main():
+    symbols = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    ts, open_, high, low, close, volume = make_market(symbols, n)
+
+    # Сверка с pandas по первому символу
+    ref = pandas_symbol(ts, high[0], low[0], close[0], volume[0])
+    got = numpy_all(ts, high, low, close, volume)
+    worst = max(np.nanmax(np.abs(ref[name].to_numpy() - got[name][0])) for name in ref)
+    print(f"{symbols} symbols x {n} candles, max |pandas - numpy| = {worst:.2e}")
+
+    t_pandas = min(timeit.repeat(
+        lambda: [pandas_symbol(ts, high[i], low[i], close[i], volume[i]) for i in range(symbols)],
+        number=1, repeat=3))
+    t_numpy = min(timeit.repeat(
+        lambda: [numpy_all(ts, high[i], low[i], close[i], volume[i]) for i in range(symbols)],
+        number=1, repeat=3))
+    t_batch = min(timeit.repeat(lambda: numpy_all(ts, high, low, close, volume), number=1, repeat=3))
+    candles = symbols * n
+    for name, t in (("pandas per symbol", t_pandas), ("numpy per symbol", t_numpy), ("numpy batch", t_batch)):
+        print(f"  {name:<18} {t * 1000:8.1f} ms | {candles / t / 1e6:6.1f} M candles/s | x{t_pandas / t:.1f}")
+
+    # Новая свеча в окне 500: сводка с шагом состояния vs сводка с полным пересчетом
+    window = 500
+    ohlcv = np.stack([open_[0], high[0], low[0], close[0], volume[0]], axis=1)
+    engine = ind.IndicatorEngine()
+    engine.snapshot("BENCH", "5", ts[:window], ohlcv[:window])
+    steps = min(2000, n - window)
+    started = timeit.default_timer()
+    for i in range(1, steps + 1):
+        engine.snapshot("BENCH", "5", ts[i:i + window], ohlcv[i:i + window])
+    t_step = (timeit.default_timer() - started) / steps
+    runs = 200
+    last_ts, last_ohlcv = ts[steps:steps + window], ohlcv[steps:steps + window]
+    t_full = min(timeit.repeat(
+        lambda: ind.IndicatorEngine().snapshot("BENCH", "5", last_ts, last_ohlcv), number=runs, repeat=3)) / runs
+    state = ind.recursive_state(last_ts, last_ohlcv, -1)
+    t_state = min(timeit.repeat(lambda: state.step(int(last_ts[-1]), last_ohlcv[-1]), number=runs, repeat=3)) / runs
+    print(f"  new candle (window {window}): snapshot incremental {t_step * 1e6:7.1f} us | "
+          f"full recompute {t_full * 1e6:7.1f} us | state step alone {t_state * 1e6:5.1f} us "
+          f"({engine.incremental_updates} incremental / {engine.full_updates} full)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Микробенчмарк разбора ответа Bybit kline: старый построчный путь vs векторный.
+
+Запуск: python benchmarks/bench_klines.py
+"""
+import os
+import random
+import sys
+import timeit
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kline_cache import COLUMNS, parse_bybit_klines  # noqa: E402
+
+
+def make_klines(n: int) -> list[list[str]]:
+    """Синтетический result.list в формате Bybit (от новых к старым)"""
+    start = 1_700_000_000_000
+    price = 150.0
+    rows = []
+    for i in range(n):
+        price += random.uniform(-1, 1)
+        o, c = price, price + random.uniform(-0.5, 0.5)
+        rows.append([
+            str(start + i * 300_000), f"{o:.4f}", f"{max(o, c) + 0.2:.4f}",
+            f"{min(o, c) - 0.2:.4f}", f"{c:.4f}", f"{random.uniform(1e3, 1e5):.2f}", "0",
+        ])
+    return rows[::-1]
+
+
+def legacy_frame(klines: list) -> pd.DataFrame:
+    """Путь до векторизации: список словарей + float() на каждое значение"""
+    df_data = []
+    for kline in reversed(klines):
+        df_data.append({
+            'timestamp': int(kline[0]),
+            'open': float(kline[1]),
+            'high': float(kline[2]),
+            'low': float(kline[3]),
+            'close': float(kline[4]),
+            'volume': float(kline[5])
+        })
+    df = pd.DataFrame(df_data)
+    df['datetime'] = pd.to_datetime(df['timestamp'], unit='ms')
+    df.set_index('datetime', inplace=True)
+    return df[COLUMNS]
+
+
+def vectorized_frame(klines: list) -> pd.DataFrame:
+    timestamps, ohlcv = parse_bybit_klines(klines)
+    index = pd.DatetimeIndex(timestamps.view('datetime64[ms]'), name='datetime')
+    return pd.DataFrame(ohlcv, index=index, columns=COLUMNS, copy=False)
+
+
+def main():
+    for n in (200, 1000):
+        klines = make_klines(n)
+        old, new = legacy_frame(klines), vectorized_frame(klines)
+        assert (old.values == new.values).all() and (old.index == new.index).all()
+        runs = 200
+        t_old = min(timeit.repeat(lambda: legacy_frame(klines), number=runs, repeat=3)) / runs
+        t_new = min(timeit.repeat(lambda: vectorized_frame(klines), number=runs, repeat=3)) / runs
+        print(f"{n:>5} candles: legacy {t_old * 1e6:8.1f} us | vectorized {t_new * 1e6:8.1f} us | x{t_old / t_new:.1f}")
+
+
+if __name__ == "__main__":
+    main()
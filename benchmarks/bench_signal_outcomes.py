@@ -0,0 +1,110 @@
+"""Бенчмарк оценки исходов сигналов: цикл по сигналам vs векторный проход.
+
+Синтетические серии свечей по нескольким символам и десятки тысяч
+сигналов BUY/SELL с риском 0.4–3% и тейком 2R; исходы сверяются
+с наивным циклом (на подвыборке), плюс время сводной статистики.
+
+Запуск: python benchmarks/bench_signal_outcomes.py [сигналов] [горизонт]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from signal_outcomes import (  # noqa: E402
+    EXPIRED, PENDING, STOP_LOSS, TAKE_PROFIT, outcome_stats, resolve_outcomes,
+)
+
+SYMBOLS = 20
+CANDLES = 20_000
+
+
+def make_series(seed: int):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.003, CANDLES)))
+    open_ = np.r_[close[0], close[:-1]]
+    spread = np.abs(rng.normal(0, 0.002, CANDLES)) * close
+    ts = 1_700_000_000_000 + np.arange(CANDLES, dtype=np.int64) * 300_000
+    return ts, np.maximum(open_, close) + spread, np.minimum(open_, close) - spread, close
+
+
+def make_signals(ts, close, count: int, seed: int):
+    rng = np.random.default_rng(seed)
+    at = np.sort(rng.integers(0, len(ts), count))
+    side = rng.choice([-1.0, 1.0], count)
+    entry = close[at]
+    risk = entry * rng.uniform(0.004, 0.03, count)
+    return ts[at], side, entry, entry - side * risk, entry + side * 2 * risk, rng.integers(1, 11, count)
+
+
+def naive(entry_ts, side, entry, stop, take, ts, high, low, close, horizon):
+    """Цикл по сигналам и свечам — как без векторизации"""
+    outcome = np.zeros(len(entry_ts), dtype=np.int8)
+    exit_index = np.full(len(entry_ts), -1, dtype=np.int64)
+    for i in range(len(entry_ts)):
+        start = int(np.searchsorted(ts, entry_ts[i], side="right"))
+        for j in range(start, min(start + horizon, len(ts))):
+            long = side[i] > 0
+            hit_stop = low[j] <= stop[i] if long else high[j] >= stop[i]
+            hit_take = high[j] >= take[i] if long else low[j] <= take[i]
+            if hit_stop or hit_take:
+                outcome[i], exit_index[i] = (STOP_LOSS if hit_stop else TAKE_PROFIT), j
+                break
+        else:
+            if start + horizon <= len(ts):
+                outcome[i], exit_index[i] = EXPIRED, start + horizon - 1
+    return outcome, exit_index
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    horizon = int(sys.argv[2]) if len(sys.argv) > 2 else 48
+    per_symbol = total // SYMBOLS
+    market = [make_series(i) for i in range(SYMBOLS)]
+    signals = [make_signals(ts, close, per_symbol, 100 + i) for i, (ts, _, _, close) in enumerate(market)]
+
+    started = time.perf_counter()
+    results = [
+        resolve_outcomes(*signal[:5], ts, high, low, close, horizon)
+        for signal, (ts, high, low, close) in zip(signals, market)
+    ]
+    t_vector = time.perf_counter() - started
+
+    # Наивный цикл на части сигналов первого символа, время экстраполируем
+    sample = 2000
+    ts, high, low, close = market[0]
+    head = [column[:sample] for column in signals[0][:5]]
+    started = time.perf_counter()
+    expected, expected_exit = naive(*head, ts, high, low, close, horizon)
+    t_naive = (time.perf_counter() - started) / sample * per_symbol * SYMBOLS
+    assert (expected == results[0][0][:sample]).all(), "vectorized outcomes differ from the loop"
+    assert (expected_exit == results[0][1][:sample]).all(), "vectorized exit candles differ from the loop"
+
+    frame = pd.concat([
+        pd.DataFrame({
+            "symbol": f"SYM{i}", "timeframe": "5", "ts": signal[0], "side": signal[1], "entry": signal[2],
+            "stop": signal[3], "take": signal[4], "strength": signal[5],
+            "outcome": outcome, "exit_ts": np.where(exit_index >= 0, market[i][0][exit_index], 0), "r": r,
+        })
+        for i, (signal, (outcome, exit_index, r)) in enumerate(zip(signals, results))
+    ], ignore_index=True)
+    started = time.perf_counter()
+    stats = outcome_stats(frame, window=50)
+    t_stats = time.perf_counter() - started
+
+    outcomes = np.concatenate([outcome for outcome, _, _ in results])
+    counts = {name: int((outcomes == code).sum()) for name, code in
+              (("tp", TAKE_PROFIT), ("sl", STOP_LOSS), ("expired", EXPIRED), ("pending", PENDING))}
+    signals_total = per_symbol * SYMBOLS
+    print(f"{signals_total} signals over {SYMBOLS} x {CANDLES} candles, horizon {horizon}: {counts}")
+    print(f"  loop (extrapolated) {t_naive * 1000:9.1f} ms")
+    print(f"  vectorized          {t_vector * 1000:9.1f} ms | {signals_total / t_vector / 1e6:.2f} M signals/s | x{t_naive / t_vector:.0f}")
+    print(f"  stats ({len(stats)} groups)   {t_stats * 1000:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Регрессия и бенчмарк разбора ответа модели: старый parse_trading_signal vs parse_signal.
+
+Корпус — ответы в формате, который запрашивает промпт analyze_chart
+(benchmarks/signal_corpus.json; новые реальные ответы стоит дописывать туда).
+Сверяет результаты со старой реализацией, прогоняет случайные мутации
+(fuzz) и меряет скорость.
+
+Запуск: python benchmarks/bench_signal_parser.py
+"""
+import json
+import os
+import random
+import re
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from signal_parser import parse_signal  # noqa: E402
+
+
+def legacy_parse(text: str):
+    """Старый parse_trading_signal + extract_strength (до однопроходного парсера)"""
+    signal = "NO_TRADE"
+    for pattern in [r"^\s*1\.\s*Сигнал:\s*(Buy|Sell|No Trade)\b", r"^\s*1\.\s*\*\*Сигнал:\*\*\s*(Buy|Sell|No Trade)\b",
+                    r"Сигнал:\s*(Buy|Sell|No Trade)\b", r"\*\*Сигнал:\*\*\s*(Buy|Sell|No Trade)\b"]:
+        m = re.search(pattern, text, flags=re.IGNORECASE | re.MULTILINE)
+        if m:
+            # Старый код возвращал "NO TRADE" с пробелом; приводим к NO_TRADE для сравнения
+            signal = m.group(1).upper().replace(" ", "_")
+            break
+    reason = ""
+    for pattern in [r"^\s*2\.\s*Причина:\s*(.*?)(?=\n\s*[3-5]\.|$)", r"^\s*2\.\s*\*\*Причина:\*\*\s*(.*?)(?=\n\s*[3-5]\.|$)",
+                    r"Причина:\s*(.*?)(?=\n\s*[3-5]\.|$)", r"\*\*Причина:\*\*\s*(.*?)(?=\n\s*[3-5]\.|$)"]:
+        m = re.search(pattern, text, flags=re.IGNORECASE | re.MULTILINE | re.DOTALL)
+        if m:
+            reason = m.group(1).strip()
+            break
+    stop_loss = "-"
+    for pattern in [r"^\s*3\.\s*Stop Loss \(SL\):\s*(.*?)(?=\n\s*[4-5]\.|$)", r"Stop Loss \(SL\):\s*(.*?)(?=\n\s*[4-5]\.|$)",
+                    r"Stop Loss:\s*(.*?)(?=\n\s*[4-5]\.|$)", r"SL:\s*(.*?)(?=\n\s*[4-5]\.|$)"]:
+        m = re.search(pattern, text, flags=re.IGNORECASE | re.MULTILINE | re.DOTALL)
+        if m:
+            stop_loss = m.group(1).strip()
+            break
+    take_profit = "-"
+    for pattern in [r"^\s*4\.\s*Take Profit \(TP\):\s*(.*?)(?=\n\s*5\.|$)", r"Take Profit \(TP\):\s*(.*?)(?=\n\s*5\.|$)",
+                    r"Take Profit:\s*(.*?)(?=\n\s*5\.|$)", r"TP:\s*(.*?)(?=\n\s*5\.|$)"]:
+        m = re.search(pattern, text, flags=re.IGNORECASE | re.MULTILINE | re.DOTALL)
+        if m:
+            take_profit = m.group(1).strip()
+            break
+    comment = ""
+    for pattern in [r"^\s*5\.\s*Комментарий:\s*(.*?)$", r"Комментарий:\s*(.*?)$", r"\*\*Комментарий:\*\*\s*(.*?)$"]:
+        m = re.search(pattern, text, flags=re.IGNORECASE | re.MULTILINE | re.DOTALL)
+        if m:
+            comment = m.group(1).strip()
+            break
+    if not reason:
+        for line in text.splitlines():
+            line = line.strip()
+            if line and not re.match(r"^\s*[1-5]\.\s*(Сигнал|Причина|Stop Loss|Take Profit|Комментарий):\s*", line, flags=re.IGNORECASE):
+                if not re.match(r"^\s*\*\*.*\*\*:\s*", line):
+                    reason = line
+                    break
+    if not reason:
+        reason = text.strip()
+    full_reason = reason
+    if comment and comment != reason and comment not in reason:
+        full_reason = f"{reason} | {comment}"
+    strength = None
+    for source in (full_reason[:300], text):
+        m = re.search(r"(?:Сила|Strength)\s*([0-9]{1,2})\s*/\s*10", source, re.IGNORECASE)
+        if m:
+            strength = int(m.group(1))
+            break
+    return signal, stop_loss, take_profit, full_reason[:300], strength
+
+
+def new_parse(text: str):
+    parsed = parse_signal(text)
+    return parsed.signal, parsed.stop_loss, parsed.take_profit, parsed.full_reason[:300], parsed.strength
+
+
+def mutate(text: str, rng: random.Random) -> str:
+    """Случайная порча ответа: markdown, потерянные строки, обрезка, мусор"""
+    lines = text.splitlines()
+    op = rng.randrange(6)
+    if op == 0 and lines:
+        lines.pop(rng.randrange(len(lines)))
+    elif op == 1:
+        lines = [re.sub(r"^(\s*\d\.\s*)([^:]+):", r"\1**\2:**", line) for line in lines]
+    elif op == 2:
+        rng.shuffle(lines)
+    elif op == 3:
+        return text[:rng.randrange(len(text) + 1)]
+    elif op == 4:
+        lines.insert(rng.randrange(len(lines) + 1), "".join(rng.choice("SLTP:.*12 \n") for _ in range(20)))
+    else:
+        return text.replace("\n", " ")
+    return "\n".join(lines)
+
+
+def main():
+    with open(os.path.join(ROOT, "benchmarks", "signal_corpus.json"), encoding="utf-8") as f:
+        corpus = json.load(f)
+
+    mismatches = 0
+    for text in corpus:
+        old, new = legacy_parse(text), new_parse(text)
+        if old != new:
+            mismatches += 1
+            print(f"DIFF {text[:60]!r}\n  old: {old}\n  new: {new}")
+    print(f"corpus: {len(corpus)} samples, {mismatches} differ from legacy")
+
+    rng = random.Random(42)
+    recovered = lost = 0
+    for i in range(5000):
+        text = mutate(rng.choice(corpus), rng)
+        parsed = parse_signal(text)
+        assert parsed.signal in ("BUY", "SELL", "NO_TRADE")
+        legacy_signal = legacy_parse(text)[0]
+        if parsed.signal != legacy_signal:
+            # Расхождение допустимо только в сторону более терпимого разбора
+            recovered += legacy_signal == "NO_TRADE"
+            lost += legacy_signal != "NO_TRADE"
+    print(f"fuzz: 5000 mutated samples, signal recovered where legacy failed: {recovered}, lost: {lost}")
+    assert lost == 0
+
+    runs = 200
+    t_old = min(timeit.repeat(lambda: [legacy_parse(t) for t in corpus], number=runs, repeat=3)) / runs / len(corpus)
+    t_new = min(timeit.repeat(lambda: [new_parse(t) for t in corpus], number=runs, repeat=3)) / runs / len(corpus)
+    print(f"per response: legacy {t_old * 1e6:.1f} us | single-pass {t_new * 1e6:.1f} us | x{t_old / t_new:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,468 @@
+"""Офлайн-прогон автоанализа: свечи → индикаторы → график → AI → разбор → рассылка.
+
+Работает настоящий конвейер bot.run_analysis_job (кэш свечей, фильтр,
+пул рендеринга, кэш анализов, промпт, маршруты, HTTP-клиент, очередь
+отправки), а внешние сервисы подменены:
+- Bybit — серии свечей (синтетические или записанные ответы result.list)
+  отдаются по виртуальным часам, одна свеча за шаг;
+- Gemini — локальный aiohttp-сервер generateContent/cachedContents
+  с заданной задержкой и детерминированными ответами;
+- Telegram — фейковые send_photo/send_message с задержкой.
+
+Отчет: перцентили по этапам (из спанов трассировки), проходы в секунду,
+ускорение относительно реального времени, пиковый RSS. --save пишет
+результат в JSON, --baseline сравнивает с ним и завершает с кодом 1 при
+регрессии p95 или пропускной способности больше --tolerance.
+
+Запуск:
+  python benchmarks/replay.py --symbols 4 --steps 200
+  python benchmarks/replay.py --klines SOLUSDT.json --save baseline.json
+  python benchmarks/replay.py --baseline baseline.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+STAGES = ("auto_analysis", "klines", "indicators", "render", "analyze", "gemini", "parse", "broadcast")
+
+
+# --- свечи ---
+
+def synthetic_series(count: int, seed: int, interval_ms: int):
+    """Случайное блуждание с режимами волатильности: (ts, ohlcv)"""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    vol = 0.002 * np.exp(np.cumsum(rng.normal(0, 0.05, count)).clip(-1.5, 1.5))
+    close = 100 * (1 + seed % 7) * np.exp(np.cumsum(rng.normal(0, 1, count) * vol))
+    open_ = np.r_[close[0], close[:-1]]
+    spread = np.abs(rng.normal(0, 1, count)) * vol * close
+    ohlcv = np.stack([
+        open_, np.maximum(open_, close) + spread, np.minimum(open_, close) - spread,
+        close, rng.uniform(1e3, 1e5, count) * (1 + 20 * vol),
+    ], axis=1)
+    start = (int(time.time() * 1000) // interval_ms - count) * interval_ms
+    return start + np.arange(count, dtype=np.int64) * interval_ms, ohlcv
+
+
+def recorded_series(path: str):
+    """Записанный ответ Bybit: JSON целиком ({"result": {"list": ...}}) или только list"""
+    from kline_cache import parse_bybit_klines
+
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    rows = data["result"]["list"] if isinstance(data, dict) else data
+    return parse_bybit_klines([[str(value) for value in row] for row in rows])
+
+
+class VirtualClock:
+    """Часы для kline_cache: время идет шагами по свечам, а не по стене"""
+
+    def __init__(self, now: float):
+        self.now = now
+        self.started = time.monotonic()
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.started + self.now
+
+
+def resample(ts, ohlcv, step_ms: int):
+    """Свечи старшего интервала из базовых; последняя — незакрытая, как у Bybit"""
+    import numpy as np
+
+    bucket = ts // step_ms
+    first = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    last = np.r_[first[1:], len(ts)] - 1
+    return bucket[first] * step_ms, np.stack([
+        ohlcv[first, 0], np.maximum.reduceat(ohlcv[:, 1], first), np.minimum.reduceat(ohlcv[:, 2], first),
+        ohlcv[last, 3], np.add.reduceat(ohlcv[:, 4], first),
+    ], axis=1)
+
+
+class FakeBybit:
+    """fetch(symbol, interval, limit, start) поверх серий; видно свечи до текущей включительно.
+    Старшие интервалы собираются из базовых свечей, младшие отдаются базовыми."""
+
+    def __init__(self, series: dict, latency: float, interval_ms: int):
+        self.series = series
+        self.latency = latency
+        self.interval_ms = interval_ms
+        self.cursor = 0
+        self.calls = 0
+
+    async def fetch(self, symbol: str, interval: str, limit: int, start: int | None = None):
+        from kline_cache import INTERVAL_MS
+
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        ts, ohlcv = self.series[symbol]
+        end = min(self.cursor + 1, len(ts))
+        if INTERVAL_MS.get(interval, 0) > self.interval_ms:
+            ts, ohlcv = resample(ts[:end], ohlcv[:end], INTERVAL_MS[interval])
+            end = len(ts)
+        if start is None:
+            begin = max(0, end - limit)
+        else:
+            begin = int(ts.searchsorted(start))
+            end = min(end, begin + limit)
+        return (ts[begin:end], ohlcv[begin:end]) if end > begin else None
+
+
+# --- Gemini ---
+
+class GeminiStub:
+    """Локальный generateContent: задержка ~latency (логнормальная), сигнал — по сиду и номеру запроса"""
+
+    def __init__(self, latency: float, seed: int, mode: str):
+        self.latency = latency
+        self.mode = mode
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.images = 0
+        self.runner = None
+        self.base = ""
+
+    def _answer(self, text: str) -> str:
+        match = re.search(r"цена ([\d.]+)", text)
+        price = float(match.group(1)) if match else 100.0
+        signal = self.rng.choices(("BUY", "SELL", "NO_TRADE"), (0.2, 0.2, 0.6))[0]
+        sl = {"BUY": price * 0.99, "SELL": price * 1.01}.get(signal)
+        tp = {"BUY": price * 1.02, "SELL": price * 0.98}.get(signal)
+        strength = self.rng.randint(3, 9)
+        if self.mode == "json":
+            return json.dumps({
+                "signal": signal, "reason": "Реплей: синтетический ответ", "stop_loss": sl and round(sl, 4),
+                "take_profit": tp and round(tp, 4), "strength": strength, "comment": "",
+            }, ensure_ascii=False)
+        return (
+            f"СИГНАЛ: {signal}\nSTOP LOSS: {f'{sl:.4f}' if sl else '-'}\n"
+            f"TAKE PROFIT: {f'{tp:.4f}' if tp else '-'}\nПРИЧИНА: Реплей: синтетический ответ, Сила {strength}/10"
+        )
+
+    async def _generate(self, request):
+        from aiohttp import web
+
+        body = await request.json()
+        self.requests += 1
+        await asyncio.sleep(self.rng.lognormvariate(math.log(self.latency), 0.3) if self.latency > 0 else 0)
+        parts = body["contents"][0]["parts"]
+        self.images += sum("inline_data" in part for part in parts)
+        text = " ".join(part.get("text", "") for part in parts)
+        usage = {"promptTokenCount": 1800, "candidatesTokenCount": 120}
+        if "cachedContent" in body:
+            usage["cachedContentTokenCount"] = 1500
+        return web.json_response({
+            "candidates": [{"content": {"parts": [{"text": self._answer(text)}]}}],
+            "usageMetadata": usage,
+        })
+
+    async def _cache(self, request):
+        from aiohttp import web
+
+        await request.json()
+        return web.json_response({"name": "cachedContents/replay", "usageMetadata": {"totalTokenCount": 1500}})
+
+    async def start(self) -> None:
+        from aiohttp import web
+
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1beta/models/{model}", self._generate)
+        app.router.add_post("/v1beta/cachedContents", self._cache)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base = f"http://127.0.0.1:{port}"
+
+    async def stop(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+# --- Telegram ---
+
+class FakeTelegram:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.photos = 0
+        self.messages = 0
+
+    async def send_photo(self, chat_id, photo, caption=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.photos += 1
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=f"replay-{self.photos}")])
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.messages += 1
+        return SimpleNamespace(photo=None)
+
+    async def get_me(self):
+        return SimpleNamespace(username="replay")
+
+
+# --- прогон ---
+
+def percentiles(values: list[float]) -> dict:
+    import numpy as np
+
+    if not values:
+        return {"count": 0}
+    data = np.asarray(values) * 1000
+    return {
+        "count": len(values),
+        "p50_ms": float(np.percentile(data, 50)),
+        "p95_ms": float(np.percentile(data, 95)),
+        "p99_ms": float(np.percentile(data, 99)),
+        "max_ms": float(data.max()),
+    }
+
+
+def collect_spans(trace, durations: dict) -> None:
+    durations.setdefault(trace.name, []).append(trace.duration)
+    for child in trace.children:
+        collect_spans(child, durations)
+
+
+def configure_env(args, gemini_base: str) -> None:
+    """Окружение бота до импорта: фейковые ключи, заглушка Gemini, без прокси и метрик"""
+    os.environ.update({
+        "BOT_TOKEN": "123456:REPLAY",
+        "GOOGLE_API_KEY": "replay",
+        "GOOGLE_API_BASE": gemini_base,
+        "PROXY_URL": "",
+        "GOOGLE_HEDGE": "0",
+        "BOT_MODE": "polling",
+        "MARKET_FEED": "rest",
+        "METRICS_PORT": "0",
+        "ANALYSIS_MODE": args.mode,
+        "PROMPT_CACHE_MODE": args.prompt_cache,
+        "ANALYSIS_GATE": "0" if args.no_gate else "1",
+        "INDICATOR_CONTEXT": "0" if args.no_indicators else "1",
+        "KLINE_CACHE_SIZE": str(max(1000, args.history)),
+        "MTF_TIMEFRAMES": args.mtf or "",
+    })
+    if args.render_workers is not None:
+        os.environ["RENDER_WORKERS"] = str(args.render_workers)
+    if not args.telegram_limits:
+        # Флуд-лимиты Telegram растянули бы прогон на реальное время
+        os.environ.update({"TG_GLOBAL_RATE": "100000", "TG_CHAT_RATE": "100000", "TG_GROUP_RATE_PER_MIN": "6000000"})
+
+
+async def replay(args) -> dict:
+    from kline_cache import INTERVAL_MS
+
+    interval_ms = INTERVAL_MS[args.timeframe]
+    if args.klines:
+        series = {os.path.splitext(os.path.basename(path))[0].upper(): recorded_series(path) for path in args.klines}
+    else:
+        total = args.history + args.steps
+        series = {f"SYN{i}USDT": synthetic_series(total, args.seed + i, interval_ms) for i in range(args.symbols)}
+    warmup = min(len(ts) for ts, _ in series.values()) - args.steps
+    if warmup < 2:
+        raise SystemExit(f"series too short for {args.steps} steps")
+
+    gemini = GeminiStub(args.gemini_latency, args.seed, args.mode)
+    await gemini.start()
+    configure_env(args, gemini.base)
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    os.chdir(workdir)  # журнал запросов, кэш анализов и состояние квоты — во временный каталог
+
+    quiet = io.StringIO()
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else quiet):
+        import bot
+        import kline_cache
+        import metrics
+        import signal_outcomes
+        from signal_outcomes import OUTCOME_NAMES
+
+        bot.init_runtime()
+        bybit = FakeBybit(series, args.bybit_latency, interval_ms)
+        bot.kline_cache.fetch = bybit.fetch
+        telegram = FakeTelegram(args.telegram_latency)
+        bot.bot.send_photo = telegram.send_photo
+        bot.bot.send_message = telegram.send_message
+        bot.bot.get_me = telegram.get_me
+        bot.google_quota.daily_limit = bot.google_quota.monthly_limit = 10 ** 9
+        bot.INDICATOR_HISTORY = args.history
+        clock = VirtualClock(0.0)
+        kline_cache.time = clock
+        signal_outcomes.time = clock  # незакрытая свеча определяется по тем же часам
+
+        for symbol in series:
+            for chat in range(args.chats):
+                bot.sessions.subscribe(1000 + chat, symbol, args.timeframe)
+        jobs = [SimpleNamespace(symbol=symbol, timeframe=args.timeframe) for symbol in series]
+        await bot.render_pool.start()
+
+        slots = asyncio.Semaphore(args.concurrency)
+        durations: dict[str, list[float]] = {}
+        outcomes: dict[str, int] = {}
+        errors = 0
+
+        async def run(job):
+            nonlocal errors
+            async with slots:
+                try:
+                    await bot.run_analysis_job(job)
+                except Exception as e:
+                    errors += 1
+                    print(f"[replay] {job.symbol}: {e}", file=sys.stderr)
+
+        rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        for step in range(args.steps):
+            bybit.cursor = warmup + step
+            reference = next(iter(series.values()))[0]
+            # Шаг — чуть после открытия очередной свечи
+            clock.now = reference[bybit.cursor] / 1000 + 1
+            await asyncio.gather(*(run(job) for job in jobs))
+            traces = metrics.recent_traces("auto_analysis")
+            while traces:
+                collect_spans(traces.popleft(), durations)
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(0.1)
+        for (outcome,), value in bot.auto_analysis_runs._values.items():
+            outcomes[outcome] = int(value)
+        result = {
+            "config": {
+                "symbols": len(series), "steps": args.steps, "timeframe": args.timeframe, "chats": args.chats,
+                "mode": args.mode, "prompt_cache": args.prompt_cache, "gate": not args.no_gate,
+                "indicators": not args.no_indicators, "mtf": args.mtf or "", "gemini_latency": args.gemini_latency,
+                "concurrency": args.concurrency, "render_workers": args.render_workers,
+            },
+            "passes": len(jobs) * args.steps,
+            "elapsed_s": elapsed,
+            "passes_per_s": len(jobs) * args.steps / elapsed,
+            "speedup": args.steps * interval_ms / 1000 / elapsed,
+            "outcomes": outcomes,
+            "errors": errors,
+            "gemini_requests": gemini.requests,
+            "gemini_images": gemini.images,
+            "bybit_fetches": bybit.calls,
+            "bybit_full_fetches": bot.kline_cache.full_fetches,
+            "telegram": {"photos": telegram.photos, "messages": telegram.messages},
+            "signal_outcomes": {
+                name: int((bot.signal_journal.frame()["outcome"] == code).sum())
+                for code, name in OUTCOME_NAMES.items()
+            },
+            "stages": {name: percentiles(durations.get(name, [])) for name in STAGES},
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "rss_growth_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_start) / 1024,
+        }
+        await bot.shutdown(drain_timeout=5)
+    await gemini.stop()
+    result["children_peak_rss_mb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return result
+
+
+def report(result: dict) -> None:
+    cfg = result["config"]
+    print(
+        f"replay: {cfg['symbols']} symbols x {cfg['steps']} steps ({cfg['timeframe']}m), {cfg['chats']} chats/symbol, "
+        f"mode={cfg['mode']}, prompt={cfg['prompt_cache']}, gate={'on' if cfg['gate'] else 'off'}, "
+        f"indicators={'on' if cfg['indicators'] else 'off'}, mtf={cfg.get('mtf') or 'off'}"
+    )
+    print(f"{'stage':<14}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, stats in result["stages"].items():
+        if stats["count"]:
+            print(f"{name:<14}{stats['count']:>7}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}"
+                  f"{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+    print(
+        f"throughput: {result['passes_per_s']:.1f} passes/s, x{result['speedup']:.0f} real time, "
+        f"{result['passes']} passes in {result['elapsed_s']:.1f} s, errors {result['errors']}"
+    )
+    print(
+        f"outcomes: {result['outcomes']} | gemini requests {result['gemini_requests']} "
+        f"({result.get('gemini_images', result['gemini_requests'])} images), "
+        f"bybit fetches {result['bybit_fetches']} ({result.get('bybit_full_fetches', '?')} full), "
+        f"telegram {result['telegram']}"
+    )
+    if "signal_outcomes" in result:
+        print(f"signal journal: {result['signal_outcomes']}")
+    print(
+        f"memory: peak RSS {result['peak_rss_mb']:.0f} MB (+{result['rss_growth_mb']:.0f} MB during run), "
+        f"render workers peak {result['children_peak_rss_mb']:.0f} MB"
+    )
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Регрессии относительно baseline: p95 этапов и пропускная способность"""
+    problems = []
+    for name, stats in result["stages"].items():
+        base = baseline["stages"].get(name, {})
+        # Этапы короче миллисекунды шумят сильнее, чем меняются
+        if stats.get("count") and base.get("count") and base["p95_ms"] >= 1.0:
+            if stats["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+                problems.append(f"{name} p95 {stats['p95_ms']:.1f} ms > baseline {base['p95_ms']:.1f} ms")
+    if result["passes_per_s"] < baseline["passes_per_s"] * (1 - tolerance):
+        problems.append(f"throughput {result['passes_per_s']:.1f}/s < baseline {baseline['passes_per_s']:.1f}/s")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-прогон конвейера автоанализа")
+    parser.add_argument("--symbols", type=int, default=4, help="синтетических символов")
+    parser.add_argument("--klines", nargs="*", help="записанные ответы Bybit kline (JSON), символ — имя файла")
+    parser.add_argument("--steps", type=int, default=100, help="свечей (проходов на символ)")
+    parser.add_argument("--history", type=int, default=500, help="свечей до первого шага")
+    parser.add_argument("--timeframe", default="5")
+    parser.add_argument("--chats", type=int, default=3, help="подписчиков на символ")
+    parser.add_argument("--concurrency", type=int, default=4, help="одновременных проходов")
+    parser.add_argument("--render-workers", type=int, default=None)
+    parser.add_argument("--mode", choices=("text", "json"), default="text")
+    parser.add_argument("--prompt-cache", choices=("inline", "system", "context"), default="system")
+    parser.add_argument("--no-gate", action="store_true", help="анализировать каждую свечу")
+    parser.add_argument("--no-indicators", action="store_true")
+    parser.add_argument("--mtf", help="контекстные таймфреймы одним запросом, например 1,5,60")
+    parser.add_argument("--gemini-latency", type=float, default=0.05, help="секунд на ответ заглушки")
+    parser.add_argument("--bybit-latency", type=float, default=0.005)
+    parser.add_argument("--telegram-latency", type=float, default=0.01)
+    parser.add_argument("--telegram-limits", action="store_true", help="оставить флуд-лимиты Telegram")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--save", help="записать результат в JSON")
+    parser.add_argument("--baseline", help="сравнить с сохраненным результатом")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимое ухудшение (доля)")
+    parser.add_argument("--verbose", action="store_true", help="не глушить вывод бота")
+    args = parser.parse_args()
+    if args.klines:
+        args.klines = [os.path.abspath(path) for path in args.klines]
+    for attr in ("save", "baseline"):
+        if getattr(args, attr):
+            setattr(args, attr, os.path.abspath(getattr(args, attr)))
+
+    result = asyncio.run(replay(args))
+    report(result)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = compare(result, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        if problems:
+            sys.exit(1)
+        print(f"no regressions vs {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,51 +1,137 @@
 import os
 import base64
-import re
-import requests
-import json
 import asyncio
-import io
-import matplotlib.pyplot as plt
-import mplfinance as mpf
+import signal
 import pandas as pd
 from datetime import datetime, timezone, timedelta
 from zoneinfo import ZoneInfo
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.client.default import DefaultBotProperties
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 from dotenv import load_dotenv
 from time import perf_counter
+from urllib.parse import urlsplit
+from http_client import HttpClient
+from chart_render import RenderPool, ChartImages
+from image_encoding import ImageSpec
+from request_ledger import RequestLedger
+from quota import QuotaManager, QuotaExceeded
+from kline_cache import KlineCache, parse_bybit_klines, COLUMNS as KLINE_COLUMNS, INTERVAL_MS
+from market_feed import BybitKlineStream, BYBIT_WS_URL
+from scheduler import AnalysisJob, AnalysisScheduler
+from sessions import SessionRegistry
+from analysis_cache import AnalysisCache
+from prompt_cache import PromptManager
+from route_manager import RouteManager, RouteError, RequestRejected, is_route_failure
+from send_queue import SendQueue, PRIORITY_SIGNAL, PRIORITY_RESULT, PRIORITY_STATUS
+from webhook_server import WebhookServer
+from photo_queue import PhotoJob, PhotoQueue, PhotoQueueFull, PhotoRateLimited
+from signal_parser import parse_signal, decode_signal_json, SignalDecodeError, SIGNAL_SCHEMA
+from indicators import IndicatorEngine, frame_arrays
+from market_gate import ChangeGate
+from signal_outcomes import SignalJournal
+from metrics import (
+    registry, span, recent_traces, loop_lag_seconds, MetricsServer, start_loop_lag_monitor, stop_loop_lag_monitor,
+    BYTES_BUCKETS, TOKEN_BUCKETS,
+)
 
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 GOOGLE_MODEL = os.getenv("GOOGLE_MODEL", "gemini-2.5-flash")
+PROMPT_VERSION = "1"  # Менять при правке промпта analyze_chart — входит в ключ кэша анализов
+# Режим ответа модели: text — свободный текст по шаблону, json — responseSchema с типизированными полями
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "text").lower()
+JSON_MAX_OUTPUT_TOKENS = int(os.getenv("JSON_MAX_OUTPUT_TOKENS", "1024"))
+# Токены "размышлений" в JSON-режиме: 0 — выключены, -1 — на усмотрение модели;
+# не задано — выключены там, где модель это позволяет (см. thinking_budget)
+GOOGLE_THINKING_BUDGET = int(os.environ["GOOGLE_THINKING_BUDGET"]) if os.getenv("GOOGLE_THINKING_BUDGET") else None
+# Базовый URL API (можно направить на локальную заглушку generateContent)
+GOOGLE_API_BASE = os.getenv("GOOGLE_API_BASE", "https://generativelanguage.googleapis.com").rstrip("/")
+# Как передавать промпт: inline — текстом в каждом запросе, system — systemInstruction, context — кэш контекста Gemini
+PROMPT_CACHE_MODE = os.getenv("PROMPT_CACHE_MODE", "system").lower()
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", "3600"))
 PROXY_URL = os.getenv("PROXY_URL")
+# Прием апдейтов: polling (getUpdates) или webhook (встроенный aiohttp-сервер)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Числовая сводка индикаторов (EMA/RSI/ATR/BB/VWAP, свинги, зоны) в запросе автоанализа
+INDICATOR_CONTEXT = os.getenv("INDICATOR_CONTEXT", "1") == "1"
+INDICATOR_HISTORY = int(os.getenv("INDICATOR_HISTORY", "500"))  # Свечей для прогрева индикаторов (на графике — последние 200)
+# Фильтр перед автоанализом: без заметного движения рынка прошлый сигнал остается в силе, квота не тратится
+ANALYSIS_GATE = os.getenv("ANALYSIS_GATE", "1") == "1"
+# Мульти-таймфрейм: графики этих таймфреймов (например "1,5,60") уходят модели одним запросом
+# вместе с основным; пусто — только таймфрейм подписки
+MTF_TIMEFRAMES = [tf.strip() for tf in os.getenv("MTF_TIMEFRAMES", "").split(",") if tf.strip()]
+MTF_CANDLES = int(os.getenv("MTF_CANDLES", "120"))  # Свечей на контекстных графиках
+# Локальный HTTP с /metrics (Prometheus) и /traces; METRICS_PORT=0 — выключить
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
 
 if not BOT_TOKEN:
     raise RuntimeError("Set BOT_TOKEN environment variable")
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+    raise RuntimeError("Set WEBHOOK_SECRET environment variable for webhook mode")
 if not GOOGLE_API_KEY:
     raise RuntimeError("Set GOOGLE_API_KEY environment variable")
+if BOT_MODE not in ("polling", "webhook"):
+    raise RuntimeError("BOT_MODE must be 'polling' or 'webhook'")
+if ANALYSIS_MODE not in ("text", "json"):
+    raise RuntimeError("ANALYSIS_MODE must be 'text' or 'json'")
+if any(tf not in INTERVAL_MS for tf in MTF_TIMEFRAMES):
+    raise RuntimeError(f"MTF_TIMEFRAMES must be Bybit intervals: {', '.join(INTERVAL_MS)}")
 
-bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
+BYBIT_HOST = "api.bybit.com"
+GOOGLE_HOST = urlsplit(GOOGLE_API_BASE).hostname
+
+bot: Bot | None = None  # создается в init_runtime()
 dp = Dispatcher()
-async def send_with_retry(coro_factory, *, attempts: int = 5, base_delay: float = 1.0) -> None:
-    """Отправка в Telegram с экспоненциальным backoff + джиттером.
-    coro_factory: функция без аргументов, возвращает корутину отправки.
-    """
-    delay = base_delay
-    for i in range(attempts):
-        try:
-            await coro_factory()
-            return
-        except Exception as e:
-            if i == attempts - 1:
-                raise
-            jitter = (0.5 + os.urandom(1)[0] / 255)  # 0.5..1.5
-            await asyncio.sleep(delay * jitter)
-            delay *= 2
+
+# Общий пул HTTP-соединений: keep-alive, лимиты на хост, отдельные таймауты connect/read
+http_client = HttpClient(
+    limit_per_host=int(os.getenv("HTTP_LIMIT_PER_HOST", "8")),
+    host_limits={
+        BYBIT_HOST: int(os.getenv("BYBIT_MAX_CONCURRENCY", "10")),
+        GOOGLE_HOST: int(os.getenv("GOOGLE_MAX_CONCURRENCY", "4")),
+    },
+    connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")),
+    read_timeout=float(os.getenv("HTTP_READ_TIMEOUT", "30")),
+)
+
+# Пул процессов для рендеринга графиков (RENDER_WORKERS=0 — рисовать в потоке)
+render_pool = RenderPool(
+    workers=int(os.environ["RENDER_WORKERS"]) if os.getenv("RENDER_WORKERS") else None,
+    queue_size=int(os.getenv("RENDER_QUEUE_SIZE", "0")) or None,
+    # Формат "формат:макс_сторона:качество" (png, png8, jpeg, webp) — отдельно для Telegram и для модели
+    display_spec=ImageSpec.parse(os.getenv("CHART_DISPLAY_IMAGE", "png")),
+    model_spec=ImageSpec.parse(os.getenv("CHART_MODEL_IMAGE", "png8::128")),
+    dpi=float(os.getenv("CHART_DPI", "150")),
+    # fast — заготовка фигуры переиспользуется между кадрами, mpf — полный рендер mplfinance
+    renderer=os.getenv("CHART_RENDERER", "fast").lower(),
+)
+# Метрики горячих путей: гистограммы задержек/размеров и счетчики (отдаются на /metrics)
+bybit_fetch_seconds = registry.histogram("bybit_fetch_seconds", "Запрос свечей Bybit (REST)", ("outcome",))
+chart_render_seconds = registry.histogram("chart_render_seconds", "Рендер графика: отрисовка и кодирование", ("stage",))
+chart_image_bytes = registry.histogram("chart_image_bytes", "Размер картинки графика", ("target",), BYTES_BUCKETS)
+gemini_request_seconds = registry.histogram("gemini_request_seconds", "Запрос generateContent со всеми маршрутами", ("outcome",))
+gemini_tokens = registry.histogram("gemini_tokens", "Токены запроса Gemini по usageMetadata", ("kind",), TOKEN_BUCKETS)
+signal_parse_seconds = registry.histogram("signal_parse_seconds", "Разбор ответа модели в сигнал")
+telegram_send_seconds = registry.histogram("telegram_send_seconds", "Отправка в Telegram от постановки в очередь", ("outcome",))
+auto_analysis_runs = registry.counter("auto_analysis_runs_total", "Проходы автоанализа по исходу", ("outcome",))
+analysis_gate_decisions = registry.counter("analysis_gate_total", "Решения фильтра перед анализом", ("decision", "reason"))
+
+# Все исходящие сообщения — через очередь с флуд-лимитами Telegram (общий и на чат)
+telegram_sender = SendQueue(
+    global_rate=float(os.getenv("TG_GLOBAL_RATE", "25")),
+    chat_rate=float(os.getenv("TG_CHAT_RATE", "1")),
+    group_rate=float(os.getenv("TG_GROUP_RATE_PER_MIN", "20")) / 60,
+    on_finish=lambda latency, ok: telegram_send_seconds.observe(latency, outcome="ok" if ok else "error"),
+)
+metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
 
 
 # Обработчик глобальных ошибок
@@ -55,76 +141,96 @@ async def error_handler(event, exception):
     print(f"Ошибка: {exception}")
     return True  # Продолжаем работу
 
-# Счетчик запросов
-request_count = 0
-request_log = []
-
 # Переменные для автоматического анализа
-auto_analysis_active = False
-auto_analysis_chat_id = None
-auto_analysis_symbols = ["SOLUSDT"]  # Только Solana
+auto_analysis_active = False  # Работает ли планировщик (есть хотя бы одна подписка)
+sessions = SessionRegistry()  # Подписки чатов на пары (symbol, timeframe)
+auto_analysis_symbols = os.getenv("AUTO_ANALYSIS_SYMBOLS", "SOLUSDT").split(",")  # По умолчанию только Solana
 auto_analysis_interval = 360  # 6 минут в секундах
 auto_analysis_timeframe = "5"  # 5-минутный таймфрейм
-last_signals = {}  # Хранение последних сигналов для фильтрации дубликатов
+last_signals = {}  # Последние сигналы по (symbol, timeframe) для фильтрации дубликатов
 
-# Загружаем существующий лог при запуске
-def load_request_log():
-    global request_count, request_log
-    try:
-        if os.path.exists("request_log.json"):
-            with open("request_log.json", "r", encoding="utf-8") as f:
-                request_log = json.load(f)
-                request_count = len(request_log)
-        else:
-            request_log = []
-            request_count = 0
-    except Exception:
-        request_log = []
-        request_count = 0
+# Планировщик: у каждой пары свой период, пары анализируются параллельно
+AUTO_ANALYSIS_CONCURRENCY = int(os.getenv("AUTO_ANALYSIS_CONCURRENCY", "4"))
+AUTO_ANALYSIS_JITTER = float(os.getenv("AUTO_ANALYSIS_JITTER", "0.1"))
+analysis_scheduler = None
+auto_analysis_task = None  # Задача auto_analysis_handler (для ожидания при остановке)
+
+def auto_analysis_jobs() -> list[tuple[str, str, float]]:
+    """Список задач (symbol, timeframe, период в секундах).
+    AUTO_ANALYSIS_JOBS="SOLUSDT:5:360,BTCUSDT:15:900" задает их явно,
+    иначе — все auto_analysis_symbols на auto_analysis_timeframe."""
+    spec = os.getenv("AUTO_ANALYSIS_JOBS", "").strip()
+    if not spec:
+        return [(symbol, auto_analysis_timeframe, auto_analysis_interval) for symbol in auto_analysis_symbols]
+    jobs = []
+    for item in spec.split(","):
+        parts = item.strip().split(":")
+        symbol = parts[0]
+        timeframe = parts[1] if len(parts) > 1 else auto_analysis_timeframe
+        interval = float(parts[2]) if len(parts) > 2 else auto_analysis_interval
+        jobs.append((symbol, timeframe, interval))
+    return jobs
 
-# Загружаем лог при импорте
-load_request_log()
+def job_interval(symbol: str, timeframe: str) -> float:
+    """Период анализа пары: из AUTO_ANALYSIS_JOBS либо общий auto_analysis_interval"""
+    for job_symbol, job_timeframe, interval in auto_analysis_jobs():
+        if (job_symbol, job_timeframe) == (symbol, timeframe):
+            return interval
+    return auto_analysis_interval
 
 # Лимиты Google
 GOOGLE_LIMITS = {"daily": 250, "monthly": 7500, "period": "день"}
+PACIFIC_TZ = ZoneInfo("America/Los_Angeles")
 
-def get_pacific_time():
-    """Получить текущее время PT с учетом DST (America/Los_Angeles)."""
-    return datetime.now(ZoneInfo("America/Los_Angeles"))
+# Журнал запросов: append-only JSONL с индексом дневных/месячных счетчиков.
+# Старый request_log.json один раз мигрируется при первом запуске.
+request_ledger = RequestLedger("request_log.jsonl", tz=PACIFIC_TZ, legacy_path="request_log.json")
 
-def should_reset_google_counter():
-    """Проверить, нужно ли сбросить счетчик Google (прошла полночь PT)"""
+def load_request_log():
     try:
-        if os.path.exists("last_reset.json"):
-            with open("last_reset.json", "r", encoding="utf-8") as f:
-                data = json.load(f)
-                last_reset = datetime.fromisoformat(data["last_reset"])
-        else:
-            return True
-        
-        pacific_now = get_pacific_time()
-        return pacific_now.date() > last_reset.date()
-    except:
-        return True
+        request_ledger.load()
+    except Exception as e:
+        print(f"[ledger] failed to load request log: {e}")
 
-def reset_google_counter():
-    """Сбросить счетчик Google запросов"""
-    global request_log
-    pacific_now = get_pacific_time()
-    
-    # Удаляем все записи Google за предыдущие дни
-    request_log = [log for log in request_log if not (
-        log["provider"] == "google" and 
-        datetime.fromisoformat(log["timestamp"]).date() < pacific_now.date()
-    )]
-    
-    # Сохраняем время последнего сброса
-    with open("last_reset.json", "w", encoding="utf-8") as f:
-        json.dump({"last_reset": pacific_now.isoformat()}, f, ensure_ascii=False, indent=2)
-    
-    # Сохраняем обновленный лог
-    with open("request_log.json", "w", encoding="utf-8") as f:
-        json.dump(request_log, f, ensure_ascii=False, indent=2)
+# Квота Google в памяти: сброс в полночь PT вычисляется заранее,
+# проверка перед запросом — сравнение счетчиков без файлового I/O
+google_quota = QuotaManager(GOOGLE_LIMITS, PACIFIC_TZ, state_path="last_reset.json")
+
+# Кэш результатов анализа: повторный график не тратит квоту Google
+analysis_cache = AnalysisCache(
+    "analysis_cache.json",
+    ttl=float(os.getenv("ANALYSIS_CACHE_TTL", "600")),
+    max_entries=int(os.getenv("ANALYSIS_CACHE_SIZE", "1000")),
+)
+
+# Журнал отправленных сигналов: исход (тейк/стоп/истечение) проверяется по следующим свечам
+signal_journal = SignalJournal(
+    "signals.jsonl",
+    expiry_candles=int(os.getenv("SIGNAL_EXPIRY_CANDLES", "48")),  # Сколько свечей ждать тейка или стопа
+)
+
+def init_runtime():
+    """Создать Bot и загрузить состояние с диска (журнал запросов, квота, кэш, сигналы).
+    Не при импорте: воркеры рендеринга (spawn) заново исполняют этот модуль как __mp_main__,
+    и загрузка в них обрезала бы хвост журнала, в который пишет основной процесс."""
+    global bot
+    if bot is not None:
+        return
+    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
+    load_request_log()
+    google_quota.load(
+        used_today=request_ledger.daily_count("google"),
+        used_month=request_ledger.monthly_count("google"),
+    )
+    analysis_cache.load()
+    signal_journal.load()
+
+# Гейджи читаются в момент выдачи /metrics
+registry.gauge("google_quota_used_today", "Запросов к Google за сегодня (PT)", lambda: google_quota.used_today)
+registry.gauge("analysis_cache_hits", "Попадания в кэш анализов", lambda: analysis_cache.hits)
+registry.gauge("analysis_cache_misses", "Промахи кэша анализов", lambda: analysis_cache.misses)
+registry.gauge("telegram_send_queue_depth", "Сообщений в очереди отправки", lambda: telegram_sender.depth)
+registry.gauge("photo_queue_pending", "Фото в очереди на анализ", lambda: photo_queue.pending)
 
 async def build_health_text() -> str:
     """Собрать текст health-статуса для /health и кнопки Статус"""
@@ -142,26 +248,45 @@ async def build_health_text() -> str:
     bybit_latency_ms = None
     try:
         b_start = perf_counter()
-        df = await get_bybit_klines(auto_analysis_symbols[0], auto_analysis_timeframe, 1)
+        df = await kline_cache.get(auto_analysis_symbols[0], auto_analysis_timeframe, 1)
         bybit_latency_ms = int((perf_counter() - b_start) * 1000)
         bybit_status = "✅ OK" if df is not None and not df.empty else "⚠️ Пусто"
     except Exception as e:
         bybit_status = f"❌ Ошибка: {e}"
 
-    # Google usage (с учетом возможного ночного сброса по PT)
-    try:
-        if should_reset_google_counter():
-            reset_google_counter()
-    except Exception as e:
-        print(f"[health] failed to reset Google counter: {e}")
-
-    google_daily_limit = GOOGLE_LIMITS.get("daily", 250)
-    google_used_today = sum(1 for log in request_log if log.get("provider") == "google")
-    google_remaining = max(0, google_daily_limit - google_used_today)
+    # Google usage (сброс по полуночи PT делает сам QuotaManager)
+    google_remaining = google_quota.remaining()
+    google_daily_limit = google_quota.daily_limit
+    google_used_today = google_quota.used_today
     google_usage_pct = (google_used_today / google_daily_limit * 100) if google_daily_limit else 0
 
+    # Экономия на промпте (токены из кэша Gemini, невысланные байты)
+    prompt_stats = prompt_manager.stats
+    send_stats = telegram_sender.stats
+    gate_stats = analysis_gate.stats
+
+    # Задержки по метрикам: event loop и Gemini, последняя трасса автоанализа
+    lag_p99 = loop_lag_seconds.quantile(0.99)
+    gemini_p50 = gemini_request_seconds.quantile(0.5, outcome="ok")
+    gemini_p95 = gemini_request_seconds.quantile(0.95, outcome="ok")
+    latency_text = (
+        f"⏲ Event loop p99: {lag_p99 * 1000:.0f} ms" if lag_p99 is not None else "⏲ Event loop: нет данных"
+    ) + (f" | Gemini p50 {gemini_p50:.1f}/p95 {gemini_p95:.1f} s" if gemini_p50 is not None else "")
+    auto_traces = recent_traces("auto_analysis")
+    trace_text = f"\n🧭 Последний проход: {auto_traces[-1].summary()}" if auto_traces else ""
+
     # Автоанализ статус
-    aa_status = "✅ АКТИВЕН" if auto_analysis_active else "⏹️ ОСТАНОВЛЕН"
+    aa_status = f"✅ АКТИВЕН (чатов: {len(sessions.chats)})" if auto_analysis_active else "⏹️ ОСТАНОВЛЕН"
+    
+    # Статистика задач планировщика
+    jobs_text = ""
+    if analysis_scheduler is not None and analysis_scheduler.jobs:
+        job_lines = [
+            f"• {job.symbol}/{job.timeframe}m: {job.stats.runs} запусков, {job.stats.failures} ошибок, "
+            f"~{job.stats.avg_latency:.1f} s (max {job.stats.max_latency:.1f} s)"
+            for job in analysis_scheduler.jobs.values()
+        ]
+        jobs_text = "\n⏱ Задачи:\n" + "\n".join(job_lines)
 
     text = (
         "👀👁 <b>Статус сервисов</b>\n\n"
@@ -169,308 +294,372 @@ async def build_health_text() -> str:
         f"🔗 Bybit: {bybit_status}"
         + (f" ({bybit_latency_ms} ms)" if bybit_latency_ms is not None else "") + "\n"
         f"🧠 Google: {google_used_today}/{google_daily_limit} в день ({google_usage_pct:.1f}%), осталось {google_remaining}\n"
+        f"🛣 Маршруты: {google_routes.summary()}" + (f", хеджей: {google_routes.hedges}" if google_routes.hedge else "") + "\n"
+        f"♻️ Кэш анализов: {analysis_cache.hits} попаданий / {analysis_cache.misses} промахов\n"
+        f"📝 Промпт v{prompt_manager.version} ({prompt_manager.mode}"
+        + (", кэш активен" if prompt_manager.cache_active else "")
+        + f"): {prompt_stats.cached_tokens}/{prompt_stats.prompt_tokens} токенов из кэша "
+        f"({prompt_stats.cached_ratio:.0%}), сэкономлено {prompt_stats.saved_bytes // 1024} KB\n"
+        + (
+            f"🚦 Фильтр анализа: пропущено {gate_stats.skipped}/{gate_stats.checked} ({gate_stats.skipped_ratio:.0%}), "
+            f"сэкономлено запросов к AI: {gate_stats.saved}\n" if ANALYSIS_GATE else ""
+        )
+        + f"🖼 Фото: в работе {photo_queue.busy}, в очереди {photo_queue.pending}, "
+        f"готово {photo_queue.stats.finished} (ожидание ~{photo_queue.stats.avg_wait:.1f} s, анализ ~{photo_queue.stats.avg_run:.1f} s)\n"
+        f"📨 Отправка: очередь {telegram_sender.depth}, в пути {telegram_sender.in_flight}, "
+        f"отправлено {send_stats.sent}, ошибок {send_stats.failed}, 429: {send_stats.retry_after}, "
+        f"задержка p50 {send_stats.latency(0.5):.1f}/p95 {send_stats.latency(0.95):.1f} s\n"
+        f"{latency_text}\n"
         f"⚙️ Автоанализ: {aa_status}\n"
         f"📊 Символ: {', '.join(auto_analysis_symbols)} | ⏰ Интервал: каждые {auto_analysis_interval//60} минут"
+        + jobs_text
+        + trace_text
     )
     return text
 
 def log_request(provider: str, model: str, success: bool):
-    global request_count
-    request_count += 1
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    request_log.append({
-        "timestamp": timestamp,
-        "provider": provider,
-        "model": model,
-        "success": success,
-        "count": request_count
-    })
-    with open("request_log.json", "w", encoding="utf-8") as f:
-        json.dump(request_log, f, ensure_ascii=False, indent=2)
-
-def _call_google(image_bytes: bytes, question: str, model_name: str) -> str:
+    try:
+        request_ledger.append(provider, model, success)
+    except Exception as e:
+        print(f"[ledger] failed to log request: {e}")
+
+def thinking_budget(model: str) -> int | None:
+    """Бюджет размышлений для модели; None — thinkingConfig не передаем.
+    Размышления есть только у gemini-2.5; flash их отключает (0), а pro — нет:
+    бюджет 0 он отклоняет, минимум 128."""
+    if not model.startswith("gemini-2.5"):
+        return None
+    can_disable = "flash" in model
+    if GOOGLE_THINKING_BUDGET is None:
+        return 0 if can_disable else None
+    if not can_disable and 0 <= GOOGLE_THINKING_BUDGET < 128:
+        return 128
+    return GOOGLE_THINKING_BUDGET
+
+def google_generation_config(mode: str = "text", model: str = GOOGLE_MODEL) -> dict:
+    """generationConfig для режима ответа: в JSON-режиме — схема и жесткий лимит токенов.
+    Размышления gemini-2.5 входят в maxOutputTokens, поэтому известный бюджет на них
+    прибавляем к лимиту — иначе ответ обрезается еще до JSON."""
+    if mode != "json":
+        return {"temperature": 0.0, "maxOutputTokens": 1000000}
+    config = {
+        "temperature": 0.0,
+        "responseMimeType": "application/json",
+        "responseSchema": SIGNAL_SCHEMA,
+    }
+    budget = thinking_budget(model)
+    if budget is not None:
+        config["thinkingConfig"] = {"thinkingBudget": budget}
+    if not model.startswith("gemini-2.5"):
+        config["maxOutputTokens"] = JSON_MAX_OUTPUT_TOKENS
+    elif budget is not None and budget >= 0:
+        config["maxOutputTokens"] = JSON_MAX_OUTPUT_TOKENS + budget
+    # Иначе (-1 или бюджет по умолчанию у pro) объем размышлений неизвестен — лимит не ставим
+    return config
+
+# Маршруты к Google: сначала прокси (если задан), затем напрямую; порядок дальше — по статистике
+google_routes = RouteManager(
+    [PROXY_URL, None] if PROXY_URL else [None],
+    hedge=os.getenv("GOOGLE_HEDGE", "0") == "1",
+    hedge_default=float(os.getenv("GOOGLE_HEDGE_DELAY", "20")),
+)
+
+async def _call_google(
+    image_bytes: bytes,
+    prompts: PromptManager,
+    model_name: str,
+    generation_config: dict | None = None,
+    mime_type: str = "image/jpeg",
+    context: str | None = None,
+    extra_images: list[tuple[str, bytes, str]] | None = None,
+) -> str:
+    """extra_images — дополнительные картинки (подпись, байты, mime) после основной, в том же запросе"""
     img_b64 = base64.b64encode(image_bytes).decode("utf-8")
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={GOOGLE_API_KEY}"
+    extra_parts = []
+    extra_bytes = 0
+    for label, data, extra_mime in extra_images or ():
+        data_b64 = base64.b64encode(data).decode("utf-8")
+        extra_parts += [{"text": label}, {"inline_data": {"mime_type": extra_mime, "data": data_b64}}]
+        extra_bytes += len(data_b64) + len(label.encode("utf-8"))
+    url = f"{GOOGLE_API_BASE}/v1beta/models/{model_name}:generateContent?key={GOOGLE_API_KEY}"
     headers = {"Content-Type": "application/json"}
     
+    fields, instruction, saved_bytes = await prompts.request_fields()
     body = {
+        **fields,
         "contents": [
             {
                 "role": "user",
                 "parts": [
-                    {"text": question},
-                    {"inline_data": {"mime_type": "image/jpeg", "data": img_b64}}
+                    {"text": instruction},
+                    *([{"text": context}] if context else []),
+                    {"inline_data": {"mime_type": mime_type, "data": img_b64}},
+                    *extra_parts,
                 ]
             }
         ],
-        "generationConfig": {"temperature": 0.0, "maxOutputTokens": 1000000}
+        "generationConfig": generation_config or google_generation_config("text")
     }
+    request_bytes = len(img_b64) + extra_bytes + len(instruction.encode("utf-8")) + len((context or "").encode("utf-8")) + (prompts.prompt_bytes if "systemInstruction" in fields else 0)
     
-    # Пробуем сначала с прокси, потом без прокси
-    proxy_configs = []
-    if PROXY_URL:
-        proxy_configs.append({
-            "http": PROXY_URL,
-            "https": PROXY_URL
-        })
-    proxy_configs.append(None)  # Без прокси
+    async def attempt(proxy):
+        request = body
+        status, data = await http_client.post_json(
+            url, headers=headers, json=request, proxy=proxy,
+            connect_timeout=10, read_timeout=120
+        )
+        used_bytes, used_saved = request_bytes, saved_bytes
+        if status in (400, 403, 404) and "cachedContent" in request:
+            # Кэш промпта истек или удален — шлем промпт через systemInstruction
+            print(f"[prompt] cached content rejected (HTTP {status}), falling back to systemInstruction")
+            prompts.invalidate()
+            request = {k: v for k, v in request.items() if k != "cachedContent"}
+            request["systemInstruction"] = {"parts": [{"text": prompts.prompt}]}
+            used_bytes, used_saved = used_bytes + prompts.prompt_bytes, 0
+            status, data = await http_client.post_json(
+                url, headers=headers, json=request, proxy=proxy,
+                connect_timeout=10, read_timeout=120
+            )
+        if status != 200 and not is_route_failure(status):
+            # Отказ в запросе (400, 403, ...): пробуем остальные маршруты, без них — это и есть ответ
+            raise RequestRejected(f"HTTP {status}: {str(data)[:200]}")
+        if status != 200 or not isinstance(data, dict):
+            raise RouteError(f"HTTP {status}")
+        
+        candidates = data.get("candidates") or []
+        if not candidates:
+            raise RouteError("empty candidates")
+        
+        parts = (candidates[0].get("content") or {}).get("parts") or []
+        texts = []
+        for p in parts:
+            t = p.get("text") if isinstance(p, dict) else None
+            if isinstance(t, str):
+                texts.append(t)
+        usage = data.get("usageMetadata") or {}
+        prompts.record(usage, used_bytes, used_saved)
+        for kind, field in (("prompt", "promptTokenCount"), ("cached", "cachedContentTokenCount"), ("output", "candidatesTokenCount")):
+            if usage.get(field):
+                gemini_tokens.observe(usage[field], kind=kind)
+        return "\n".join(texts).strip()
     
-    for proxies in proxy_configs:
+    # Маршруты (прокси/напрямую) — от лучшего по статистике, с хеджированием по p95
+    started = perf_counter()
+    with span("gemini", model=model_name):
         try:
-            resp = requests.post(url, headers=headers, json=body, proxies=proxies, timeout=120)
-            if resp.status_code != 200:
-                continue
-            
-            data = resp.json()
-            candidates = data.get("candidates") or []
-            if not candidates:
-                continue
-            
-            parts = (candidates[0].get("content") or {}).get("parts") or []
-            texts = []
-            for p in parts:
-                t = p.get("text") if isinstance(p, dict) else None
-                if isinstance(t, str):
-                    texts.append(t)
-            result = "\n".join(texts).strip()
-            log_request("google", model_name, True)
-            return result
-            
+            result = await google_routes.run(attempt)
+        except RouteError as e:
+            gemini_request_seconds.observe(perf_counter() - started, outcome="error")
+            log_request("google", model_name, False)
+            return f"Ошибка анализа: Google все конфигурации не сработали ({e})"
         except Exception as e:
-            if proxies is None:
-                log_request("google", model_name, False)
-                return f"Ошибка анализа: Google({model_name}) exception: {e}"
-            continue
-    
-    log_request("google", model_name, False)
-    return "Ошибка анализа: Google все конфигурации не сработали"
+            gemini_request_seconds.observe(perf_counter() - started, outcome="error")
+            log_request("google", model_name, False)
+            return f"Ошибка анализа: Google({model_name}) exception: {e}"
+    gemini_request_seconds.observe(perf_counter() - started, outcome="ok")
+    log_request("google", model_name, True)
+    return result
 
-def analyze_chart(image_bytes):
-    # Проверяем и сбрасываем счетчик Google если нужно
-    if should_reset_google_counter():
-        reset_google_counter()
-    
-    question = (
-        "Ты — легендарный трейдер-аналитик мирового уровня с 25-летним стажем, объединяющий в себе опыт величайших трейдеров всех времен:\n"
-        "• Джесси Ливермор — мастер психологии рынка и крупных движений\n"
-        "• Пол Тюдор Джонс — виртуоз макроанализа и тайминга\n"
-        "• Линда Брэдфорд Рашке — эксперт внутридневных паттернов\n"
-        "• Стив Коэн — гений краткосрочной торговли и риск-менеджмента\n"
-        "• Марк Минервини — мастер технического анализа и моментума\n\n"
-        
-        "Твой трек-рекорд: 82% выигрышных сделок, средняя доходность 340% годовых, максимальная просадка 4.2%.\n"
-        "Ты управляешь портфелем $500M и известен своей способностью видеть то, что упускают другие.\n\n"
-        
-        "ЗАДАЧА: Анализируй как человек-профессионал, учитывая ВСЕ аспекты трейдинга — структуру, импульс, объем, волатильность, ликвидность, уровни, паттерны, риск, новости, сезонность, корреляции, поведение толпы и следы крупных игроков. Объединяй сигналы в целостную картину и давай только высоковероятные выводы.\n\n"
-        
-        "ПРАВИЛА ОТВЕТА: Будь предельно конкретным, без воды и общих фраз. Не используй markdown символы вроде ** или #. Пиши чистым текстом. Формат строго соблюдай.\n\n"
-        
-        "МЕТОДОЛОГИЯ АНАЛИЗА (выполняй ВСЕ этапы последовательно):\n\n"
-        
-        "🎯 ЭТАП 1 — КОНТЕКСТНЫЙ АНАЛИЗ:\n"
-        "• Определи текущую фазу рынка: импульс/коррекция/накопление/распределение\n"
-        "• Оцени общую волатильность и энергию движения\n"
-        "• Найди доминирующий временной цикл и его стадию\n"
-        "• Определи уровни институциональной ликвидности\n\n"
-        
-        "📊 ЭТАП 2 — СТРУКТУРНЫЙ АНАЛИЗ:\n"
-        "• Market Structure: Higher Highs/Lower Lows, структурные сдвиги\n"
-        "• Order Flow: где накапливаются/снимаются крупные позиции\n"
-        "• Support/Resistance: не просто уровни, а ЗОНЫ с историей взаимодействия\n"
-        "• Value Areas: где цена проводит больше всего времени\n\n"
-        
-        "💹 ЭТАП 3 — ТЕХНИЧЕСКИЙ АНАЛИЗ (мульти-индикаторный):\n"
-        "• Price Action: точные паттерны (Pin Bars, Engulfing, Inside Bars, Outside Bars)\n"
-        "• Trend Analysis: не только направление, но и КАЧЕСТВО тренда\n"
-        "• Momentum: дивергенции, acceleration/deceleration signals\n"
-        "• Volatility Patterns: сжатие/расширение, Bollinger Bands dynamics\n"
-        "• Volume Analysis: накопление/распределение, аномальные всплески\n\n"
-        
-        "🧠 ЭТАП 4 — ПСИХОЛОГИЧЕСКИЙ АНАЛИЗ:\n"
-        "• Sentiment Extremes: признаки паники или эйфории\n"
-        "• Crowd Behavior: где большинство ошибается\n"
-        "• Smart Money vs Retail: следы крупных игроков vs мелких спекулянтов\n"
-        "• Fear/Greed Indicators: точки разворота настроений\n\n"
-        
-        "⚡ ЭТАП 5 — КАТАЛИЗАТОРЫ И ДРАЙВЕРЫ:\n"
-        "• Time-based patterns: время дня/недели с высокой активностью\n"
-        "• News Flow Impact: как фундаментальные события влияют на техническую картину\n"
-        "• Seasonal Effects: сезонные тенденции для криптовалют\n"
-        "• Correlation Analysis: связи с другими активами (BTC dominance, DXY, Gold)\n\n"
-        
-        "🎛️ ЭТАП 6 — ПРЕЦИЗИОННЫЙ РИСК-МЕНЕДЖМЕНТ:\n"
-        "• Position Sizing: не просто SL, а оптимальный размер позиции\n"
-        "• Multiple Scenarios: бычий/медвежий/нейтральный исходы с вероятностями\n"
-        "• Exit Strategy: не только TP, но и динамическое управление позицией\n"
-        "• Risk/Reward Optimization: минимум 1:2, в идеале 1:3+\n\n"
-        
-        "💎 ЭТАП 7 — СИНТЕЗ И ПРИНЯТИЕ РЕШЕНИЯ:\n"
-        "• Confluence Factors: схождение нескольких сигналов для максимальной вероятности\n"
-        "• Timing Optimization: не просто сигнал, а ЛУЧШИЙ момент для входа\n"
-        "• Conviction Level: оценка силы сигнала от 1 до 10\n"
-        "• Edge Identification: твое конкурентное преимущество в этой сделке\n\n"
-        
-        "ЖЕЛЕЗНЫЕ ПРАВИЛА ПРОФЕССИОНАЛА:\n"
-        "✓ Никогда не торгуй против четкого тренда старшего таймфрейма\n"
-        "✓ Ждешь ИДЕАЛЬНУЮ setup — лучше пропустить 10 сделок, чем потерять на 1\n"
-        "✓ Risk/Reward ВСЕГДА не менее 1:2, иначе математика против тебя\n"
-        "✓ Если сомневаешься — НЕ торгуй (сомнения = отсутствие edge)\n"
-        "✓ Защищай капитал как свою жизнь — без него ты НЕ трейдер\n"
-        "✓ Каждая сделка должна иметь ЛОГИЧЕСКОЕ обоснование, не интуицию\n"
-        "✓ Предугадывай ВСЕ сценарии: что если SL, что если TP, что если консолидация\n\n"
-        
-        "УРОВНИ СИЛЫ СИГНАЛА (объясняй просто):\n"
-        "🔥 9-10 баллов: ОЧЕНЬ СИЛЬНО - почти гарантированно сработает, можно рисковать больше\n"
-        "⚡ 7-8 баллов: СИЛЬНО - хорошие шансы на успех, обычный риск\n"
-        "💫 5-6 баллов: СРЕДНЕ - 50/50 шансы, но прибыль покроет возможные потери\n"
-        "❌ 1-4 балла: СЛАБО - большие шансы потерять деньги, лучше не торговать\n\n"
-        
-        "КРИТЕРИИ ДЛЯ РАЗНЫХ СИГНАЛОВ:\n"
-        "📈 BUY — только если:\n"
-        "• Четкий пробой сопротивления с объемом ИЛИ\n"
-        "• Отскок от сильной поддержки с подтверждением ИЛИ\n"
-        "• Импульсивная структура вверх + коррекция завершена ИЛИ\n"
-        "• Дивергенция на oversold + катализатор\n\n"
-        
-        "📉 SELL — только если:\n"
-        "• Четкий пробой поддержки с объемом ИЛИ\n"
-        "• Отбой от сильного сопротивления с подтверждением ИЛИ\n"
-        "• Импульсивная структура вниз + коррекция завершена ИЛИ\n"
-        "• Дивергенция на overbought + катализатор\n\n"
-        
-        "⏸️ NO TRADE — если:\n"
-        "• Неопределенная структура без четких уровней\n"
-        "• Низкая волатильность без катализаторов\n"
-        "• Противоречивые сигналы разных таймфреймов\n"
-        "• Risk/Reward хуже чем 1:2\n\n"
-        
-        "СТРОГО ОБЯЗАТЕЛЬНЫЙ ФОРМАТ ОТВЕТА:\n\n"
-        "1. Сигнал: Buy/Sell/No Trade\n"
-        "2. Причина: [КРАТКОЕ профессиональное обоснование, максимум 1-2 предложения, ≤400 символов]\n"
-        "3. Stop Loss (SL): [точная цена с обоснованием]\n"
-        "4. Take Profit (TP): [точная цена с обоснованием]\n"
-        "5. Комментарий: [ПОНЯТНОЕ объяснение: сила сигнала из 10, соотношение риск/прибыль, что это означает простыми словами]\n\n"
-        
-        "ПРИМЕРЫ ПОНЯТНЫХ КОММЕНТАРИЕВ:\n"
-        "• Сила 9/10 - очень сильный сигнал. Риск $1, прибыль $3. Все указывает на рост\n"
-        "• Сила 6/10 - средний сигнал. Риск $1, прибыль $2. Есть шансы, но не гарантия\n"
-        "• Сила 3/10 - слабый сигнал. Риск $1, прибыль $1.5. Лучше пропустить\n\n"
-        
-        "Проанализируй график как ЛУЧШИЙ трейдер мира. Используй ВСЮ свою экспертизу.\n\n"
-        "⚠️ ВАЖНО: Будь максимально КРАТКИМ! Анализ не должен превышать 400 символов. Только самое важное!"
+# Промпт анализа: общая часть + формат ответа (текстовый или JSON)
+ANALYSIS_PROMPT_BODY = (
+    "Ты — легендарный трейдер-аналитик мирового уровня с 25-летним стажем, объединяющий в себе опыт величайших трейдеров всех времен:\n"
+    "• Джесси Ливермор — мастер психологии рынка и крупных движений\n"
+    "• Пол Тюдор Джонс — виртуоз макроанализа и тайминга\n"
+    "• Линда Брэдфорд Рашке — эксперт внутридневных паттернов\n"
+    "• Стив Коэн — гений краткосрочной торговли и риск-менеджмента\n"
+    "• Марк Минервини — мастер технического анализа и моментума\n\n"
+
+    "Твой трек-рекорд: 82% выигрышных сделок, средняя доходность 340% годовых, максимальная просадка 4.2%.\n"
+    "Ты управляешь портфелем $500M и известен своей способностью видеть то, что упускают другие.\n\n"
+
+    "ЗАДАЧА: Анализируй как человек-профессионал, учитывая ВСЕ аспекты трейдинга — структуру, импульс, объем, волатильность, ликвидность, уровни, паттерны, риск, новости, сезонность, корреляции, поведение толпы и следы крупных игроков. Объединяй сигналы в целостную картину и давай только высоковероятные выводы.\n\n"
+
+    "ПРАВИЛА ОТВЕТА: Будь предельно конкретным, без воды и общих фраз. Не используй markdown символы вроде ** или #. Пиши чистым текстом. Формат строго соблюдай.\n\n"
+
+    "МЕТОДОЛОГИЯ АНАЛИЗА (выполняй ВСЕ этапы последовательно):\n\n"
+
+    "🎯 ЭТАП 1 — КОНТЕКСТНЫЙ АНАЛИЗ:\n"
+    "• Определи текущую фазу рынка: импульс/коррекция/накопление/распределение\n"
+    "• Оцени общую волатильность и энергию движения\n"
+    "• Найди доминирующий временной цикл и его стадию\n"
+    "• Определи уровни институциональной ликвидности\n\n"
+
+    "📊 ЭТАП 2 — СТРУКТУРНЫЙ АНАЛИЗ:\n"
+    "• Market Structure: Higher Highs/Lower Lows, структурные сдвиги\n"
+    "• Order Flow: где накапливаются/снимаются крупные позиции\n"
+    "• Support/Resistance: не просто уровни, а ЗОНЫ с историей взаимодействия\n"
+    "• Value Areas: где цена проводит больше всего времени\n\n"
+
+    "💹 ЭТАП 3 — ТЕХНИЧЕСКИЙ АНАЛИЗ (мульти-индикаторный):\n"
+    "• Price Action: точные паттерны (Pin Bars, Engulfing, Inside Bars, Outside Bars)\n"
+    "• Trend Analysis: не только направление, но и КАЧЕСТВО тренда\n"
+    "• Momentum: дивергенции, acceleration/deceleration signals\n"
+    "• Volatility Patterns: сжатие/расширение, Bollinger Bands dynamics\n"
+    "• Volume Analysis: накопление/распределение, аномальные всплески\n\n"
+
+    "🧠 ЭТАП 4 — ПСИХОЛОГИЧЕСКИЙ АНАЛИЗ:\n"
+    "• Sentiment Extremes: признаки паники или эйфории\n"
+    "• Crowd Behavior: где большинство ошибается\n"
+    "• Smart Money vs Retail: следы крупных игроков vs мелких спекулянтов\n"
+    "• Fear/Greed Indicators: точки разворота настроений\n\n"
+
+    "⚡ ЭТАП 5 — КАТАЛИЗАТОРЫ И ДРАЙВЕРЫ:\n"
+    "• Time-based patterns: время дня/недели с высокой активностью\n"
+    "• News Flow Impact: как фундаментальные события влияют на техническую картину\n"
+    "• Seasonal Effects: сезонные тенденции для криптовалют\n"
+    "• Correlation Analysis: связи с другими активами (BTC dominance, DXY, Gold)\n\n"
+
+    "🎛️ ЭТАП 6 — ПРЕЦИЗИОННЫЙ РИСК-МЕНЕДЖМЕНТ:\n"
+    "• Position Sizing: не просто SL, а оптимальный размер позиции\n"
+    "• Multiple Scenarios: бычий/медвежий/нейтральный исходы с вероятностями\n"
+    "• Exit Strategy: не только TP, но и динамическое управление позицией\n"
+    "• Risk/Reward Optimization: минимум 1:2, в идеале 1:3+\n\n"
+
+    "💎 ЭТАП 7 — СИНТЕЗ И ПРИНЯТИЕ РЕШЕНИЯ:\n"
+    "• Confluence Factors: схождение нескольких сигналов для максимальной вероятности\n"
+    "• Timing Optimization: не просто сигнал, а ЛУЧШИЙ момент для входа\n"
+    "• Conviction Level: оценка силы сигнала от 1 до 10\n"
+    "• Edge Identification: твое конкурентное преимущество в этой сделке\n\n"
+
+    "ЖЕЛЕЗНЫЕ ПРАВИЛА ПРОФЕССИОНАЛА:\n"
+    "✓ Никогда не торгуй против четкого тренда старшего таймфрейма\n"
+    "✓ Ждешь ИДЕАЛЬНУЮ setup — лучше пропустить 10 сделок, чем потерять на 1\n"
+    "✓ Risk/Reward ВСЕГДА не менее 1:2, иначе математика против тебя\n"
+    "✓ Если сомневаешься — НЕ торгуй (сомнения = отсутствие edge)\n"
+    "✓ Защищай капитал как свою жизнь — без него ты НЕ трейдер\n"
+    "✓ Каждая сделка должна иметь ЛОГИЧЕСКОЕ обоснование, не интуицию\n"
+    "✓ Предугадывай ВСЕ сценарии: что если SL, что если TP, что если консолидация\n\n"
+
+    "УРОВНИ СИЛЫ СИГНАЛА (объясняй просто):\n"
+    "🔥 9-10 баллов: ОЧЕНЬ СИЛЬНО - почти гарантированно сработает, можно рисковать больше\n"
+    "⚡ 7-8 баллов: СИЛЬНО - хорошие шансы на успех, обычный риск\n"
+    "💫 5-6 баллов: СРЕДНЕ - 50/50 шансы, но прибыль покроет возможные потери\n"
+    "❌ 1-4 балла: СЛАБО - большие шансы потерять деньги, лучше не торговать\n\n"
+
+    "КРИТЕРИИ ДЛЯ РАЗНЫХ СИГНАЛОВ:\n"
+    "📈 BUY — только если:\n"
+    "• Четкий пробой сопротивления с объемом ИЛИ\n"
+    "• Отскок от сильной поддержки с подтверждением ИЛИ\n"
+    "• Импульсивная структура вверх + коррекция завершена ИЛИ\n"
+    "• Дивергенция на oversold + катализатор\n\n"
+
+    "📉 SELL — только если:\n"
+    "• Четкий пробой поддержки с объемом ИЛИ\n"
+    "• Отбой от сильного сопротивления с подтверждением ИЛИ\n"
+    "• Импульсивная структура вниз + коррекция завершена ИЛИ\n"
+    "• Дивергенция на overbought + катализатор\n\n"
+
+    "⏸️ NO TRADE — если:\n"
+    "• Неопределенная структура без четких уровней\n"
+    "• Низкая волатильность без катализаторов\n"
+    "• Противоречивые сигналы разных таймфреймов\n"
+    "• Risk/Reward хуже чем 1:2\n\n"
+)
+
+TEXT_RESPONSE_FORMAT = (
+    "СТРОГО ОБЯЗАТЕЛЬНЫЙ ФОРМАТ ОТВЕТА:\n\n"
+    "1. Сигнал: Buy/Sell/No Trade\n"
+    "2. Причина: [КРАТКОЕ профессиональное обоснование, максимум 1-2 предложения, ≤400 символов]\n"
+    "3. Stop Loss (SL): [точная цена с обоснованием]\n"
+    "4. Take Profit (TP): [точная цена с обоснованием]\n"
+    "5. Комментарий: [ПОНЯТНОЕ объяснение: сила сигнала из 10, соотношение риск/прибыль, что это означает простыми словами]\n\n"
+    "ПРИМЕРЫ ПОНЯТНЫХ КОММЕНТАРИЕВ:\n"
+    "• Сила 9/10 - очень сильный сигнал. Риск $1, прибыль $3. Все указывает на рост\n"
+    "• Сила 6/10 - средний сигнал. Риск $1, прибыль $2. Есть шансы, но не гарантия\n"
+    "• Сила 3/10 - слабый сигнал. Риск $1, прибыль $1.5. Лучше пропустить\n\n"
+)
+
+JSON_RESPONSE_FORMAT = (
+    "ФОРМАТ ОТВЕТА: строго JSON-объект по заданной схеме, без текста вокруг:\n"
+    "• signal — BUY, SELL или NO_TRADE\n"
+    "• reason — КРАТКОЕ профессиональное обоснование, максимум 1-2 предложения, ≤400 символов\n"
+    "• stop_loss — точная цена стопа числом (null для NO_TRADE)\n"
+    "• take_profit — точная цена тейка числом (null для NO_TRADE)\n"
+    "• strength — сила сигнала от 1 до 10\n"
+    "• comment — ПОНЯТНОЕ объяснение: соотношение риск/прибыль и что это означает простыми словами\n\n"
+)
+
+ANALYSIS_PROMPT_TAIL = (
+    "Проанализируй график как ЛУЧШИЙ трейдер мира. Используй ВСЮ свою экспертизу.\n\n"
+    "⚠️ ВАЖНО: Будь максимально КРАТКИМ! Анализ не должен превышать 400 символов. Только самое важное!"
+)
+
+def build_analysis_prompt(mode: str = "text") -> str:
+    """Собрать промпт analyze_chart для текстового или JSON-режима ответа"""
+    response_format = JSON_RESPONSE_FORMAT if mode == "json" else TEXT_RESPONSE_FORMAT
+    return ANALYSIS_PROMPT_BODY + response_format + ANALYSIS_PROMPT_TAIL
+
+# Промпт собирается один раз; версия включает хэш текста
+prompt_manager = PromptManager(
+    http_client,
+    api_base=GOOGLE_API_BASE,
+    api_key=GOOGLE_API_KEY,
+    model=GOOGLE_MODEL,
+    prompt=build_analysis_prompt(ANALYSIS_MODE),
+    version=f"{PROMPT_VERSION}-{ANALYSIS_MODE}",
+    mode=PROMPT_CACHE_MODE,
+    ttl=PROMPT_CACHE_TTL,
+    proxies=[PROXY_URL, None] if PROXY_URL else [None],
+)
+
+def analysis_prompt_version() -> str:
+    """Версия промпта для ключа кэша: текстовые и JSON-ответы не смешиваются"""
+    return prompt_manager.version
+
+async def analyze_chart(
+    image_bytes,
+    *,
+    mime_type: str = "image/jpeg",
+    cache_key: str | None = None,
+    wait_for_quota: bool = False,
+    context: str | None = None,
+    extra_images: list[tuple[str, bytes, str]] | None = None,
+):
+    """Анализ графика с кэшем по содержимому.
+    cache_key задает ключ явно (автографики), иначе ключ — хэш байтов картинки.
+    context — дополнительный текст к картинке (сводка индикаторов),
+    extra_images — графики других таймфреймов в том же запросе."""
+    key = cache_key or AnalysisCache.image_key(image_bytes, GOOGLE_MODEL, analysis_prompt_version())
+    return await analysis_cache.get_or_compute(
+        key,
+        lambda: _analyze_chart_uncached(
+            image_bytes, mime_type=mime_type, wait_for_quota=wait_for_quota, context=context, extra_images=extra_images
+        ),
+        # Ошибки не кэшируем — следующий запрос попробует снова
+        cacheable=lambda results: all(not raw.startswith("Ошибка анализа:") for _, raw in results),
     )
+
+async def _analyze_chart_uncached(
+    image_bytes,
+    *,
+    mime_type: str = "image/jpeg",
+    wait_for_quota: bool = False,
+    context: str | None = None,
+    extra_images: list[tuple[str, bytes, str]] | None = None,
+):
+    # Проверяем квоту до обращения к API (при wait_for_quota ждем сброса)
+    try:
+        await google_quota.acquire(wait=wait_for_quota)
+    except QuotaExceeded as e:
+        return [(f"google/{GOOGLE_MODEL}", f"Ошибка анализа: лимит Google исчерпан, сброс через {int(e.retry_after // 60)} мин")]
     
-    raw = _call_google(image_bytes, question, GOOGLE_MODEL)
+    raw = await _call_google(
+        image_bytes, prompt_manager, GOOGLE_MODEL, google_generation_config(ANALYSIS_MODE, GOOGLE_MODEL),
+        mime_type=mime_type, context=context, extra_images=extra_images,
+    )
+    if ANALYSIS_MODE == "json" and not raw.startswith("Ошибка анализа:"):
+        # Проверяем ответ сразу: невалидный JSON не должен попасть в кэш
+        try:
+            decode_signal_json(raw)
+        except SignalDecodeError as e:
+            print(f"[analyze] invalid JSON response: {e}; raw={raw[:200]!r}")
+            return [(f"google/{GOOGLE_MODEL}", f"Ошибка анализа: ответ модели не по схеме ({e})")]
     return [(f"google/{GOOGLE_MODEL}", raw)]
 
 def parse_trading_signal(text: str) -> tuple[str, str, str, str, str, str]:
-    # Ищем сигнал
-    signal_patterns = [
-        r"^\s*1\.\s*Сигнал:\s*(Buy|Sell|No Trade)\b",
-        r"^\s*1\.\s*\*\*Сигнал:\*\*\s*(Buy|Sell|No Trade)\b",
-        r"Сигнал:\s*(Buy|Sell|No Trade)\b",
-        r"\*\*Сигнал:\*\*\s*(Buy|Sell|No Trade)\b"
-    ]
-    
-    signal = "NO_TRADE"
-    for pattern in signal_patterns:
-        m_sig = re.search(pattern, text, flags=re.IGNORECASE | re.MULTILINE)
-        if m_sig:
-            signal = m_sig.group(1).upper()
-            break
-    
-    # Ищем причину
-    reason_patterns = [
-        r"^\s*2\.\s*Причина:\s*(.*?)(?=\n\s*[3-5]\.|$)",
-        r"^\s*2\.\s*\*\*Причина:\*\*\s*(.*?)(?=\n\s*[3-5]\.|$)",
-        r"Причина:\s*(.*?)(?=\n\s*[3-5]\.|$)",
-        r"\*\*Причина:\*\*\s*(.*?)(?=\n\s*[3-5]\.|$)"
-    ]
-    
-    reason = ""
-    for pattern in reason_patterns:
-        m_rea = re.search(pattern, text, flags=re.IGNORECASE | re.MULTILINE | re.DOTALL)
-        if m_rea:
-            reason = m_rea.group(1).strip()
-            break
-    
-    # Ищем стоп-лосс
-    sl_patterns = [
-        r"^\s*3\.\s*Stop Loss \(SL\):\s*(.*?)(?=\n\s*[4-5]\.|$)",
-        r"Stop Loss \(SL\):\s*(.*?)(?=\n\s*[4-5]\.|$)",
-        r"Stop Loss:\s*(.*?)(?=\n\s*[4-5]\.|$)",
-        r"SL:\s*(.*?)(?=\n\s*[4-5]\.|$)"
-    ]
-    
-    stop_loss = "-"
-    for pattern in sl_patterns:
-        m_sl = re.search(pattern, text, flags=re.IGNORECASE | re.MULTILINE | re.DOTALL)
-        if m_sl:
-            stop_loss = m_sl.group(1).strip()
-            break
-    
-    # Ищем тейк-профит
-    tp_patterns = [
-        r"^\s*4\.\s*Take Profit \(TP\):\s*(.*?)(?=\n\s*5\.|$)",
-        r"Take Profit \(TP\):\s*(.*?)(?=\n\s*5\.|$)",
-        r"Take Profit:\s*(.*?)(?=\n\s*5\.|$)",
-        r"TP:\s*(.*?)(?=\n\s*5\.|$)"
-    ]
-    
-    take_profit = "-"
-    for pattern in tp_patterns:
-        m_tp = re.search(pattern, text, flags=re.IGNORECASE | re.MULTILINE | re.DOTALL)
-        if m_tp:
-            take_profit = m_tp.group(1).strip()
-            break
-    
-    # Ищем комментарий
-    comm_patterns = [
-        r"^\s*5\.\s*Комментарий:\s*(.*?)$",
-        r"Комментарий:\s*(.*?)$",
-        r"\*\*Комментарий:\*\*\s*(.*?)$"
-    ]
-    
-    comment = ""
-    for pattern in comm_patterns:
-        m_comm = re.search(pattern, text, flags=re.IGNORECASE | re.MULTILINE | re.DOTALL)
-        if m_comm:
-            comment = m_comm.group(1).strip()
-            break
-    
-    # Если причина пустая, ищем в тексте
-    if not reason:
-        lines = text.splitlines()
-        for line in lines:
-            line = line.strip()
-            if line and not re.match(r"^\s*[1-5]\.\s*(Сигнал|Причина|Stop Loss|Take Profit|Комментарий):\s*", line, flags=re.IGNORECASE):
-                if not re.match(r"^\s*\*\*.*\*\*:\s*", line):
-                    reason = line
-                    break
-    
-    # Последний фолбэк - весь текст
-    if not reason:
-        reason = text.strip()
-    
-    # Объединяем причину и комментарий только если они разные
-    full_reason = reason
-    if comment and comment != reason and comment not in reason:
-        full_reason = f"{reason} | {comment}"
-    
-    return "TRADING", signal, "-", stop_loss, take_profit, full_reason[:300]
-
-def extract_strength(text: str) -> str | None:
-    """Вытащить силу сигнала вида 'Сила 8/10' или 'Strength 8/10' из текста.
-    Возвращает строку вида '8/10' или None."""
-    try:
-        if not text:
-            return None
-        m = re.search(r"(?:Сила|Strength)\s*([0-9]{1,2})\s*/\s*10", text, re.IGNORECASE)
-        if m:
-            return f"{m.group(1)}/10"
-    except Exception as e:
-        print(f"[parse-strength] regex failed: {e}")
-    return None
+    """Совместимая обертка над parse_signal: (стратегия, сигнал, вход, SL, TP, причина)"""
+    parsed = parse_signal(text)
+    return "TRADING", parsed.signal, "-", parsed.stop_loss, parsed.take_profit, parsed.full_reason[:300]
 
 def clean_field(value: str) -> str:
     """Возвращает исходное значение без агрессивной очистки, только тримминг."""
@@ -481,256 +670,456 @@ def clean_field(value: str) -> str:
     except Exception:
         return str(value)
 
-async def get_bybit_klines(symbol: str, interval: str = "1", limit: int = 200):
-    """Получить данные свечей с Bybit"""
+async def fetch_bybit_kline_arrays(
+    symbol: str, interval: str, limit: int = 200, start: int | None = None, end: int | None = None
+):
+    """Получить свечи с Bybit в виде массивов (timestamps, ohlcv) по возрастанию времени"""
+    started = perf_counter()
     try:
-        url = "https://api.bybit.com/v5/market/kline"
+        url = f"https://{BYBIT_HOST}/v5/market/kline"
         params = {
             "category": "linear",
             "symbol": symbol,
             "interval": interval,
             "limit": limit
         }
-        response = requests.get(url, params=params, timeout=10)
-        data = response.json()
+        if start is not None:
+            params["start"] = start
+        if end is not None:
+            params["end"] = end
+        _, data = await http_client.get_json(url, params=params, connect_timeout=5, read_timeout=10)
         
-        if data.get("retCode") == 0 and data.get("result", {}).get("list"):
-            klines = data["result"]["list"]
-            # Преобразуем в DataFrame
-            df_data = []
-            for kline in reversed(klines):  # Bybit возвращает в обратном порядке
-                df_data.append({
-                    'timestamp': int(kline[0]),
-                    'open': float(kline[1]),
-                    'high': float(kline[2]),
-                    'low': float(kline[3]),
-                    'close': float(kline[4]),
-                    'volume': float(kline[5])
-                })
-            
-            df = pd.DataFrame(df_data)
-            df['datetime'] = pd.to_datetime(df['timestamp'], unit='ms')
-            df.set_index('datetime', inplace=True)
-            return df[['open', 'high', 'low', 'close', 'volume']]
+        if isinstance(data, dict) and data.get("retCode") == 0 and data.get("result", {}).get("list"):
+            timestamps, ohlcv = parse_bybit_klines(data["result"]["list"])
+            if len(timestamps):
+                bybit_fetch_seconds.observe(perf_counter() - started, outcome="ok")
+                return timestamps, ohlcv
+        bybit_fetch_seconds.observe(perf_counter() - started, outcome="empty")
         return None
     except Exception as e:
+        bybit_fetch_seconds.observe(perf_counter() - started, outcome="error")
         print(f"Ошибка получения данных Bybit: {e}")
         return None
 
-async def create_chart_image(df: pd.DataFrame, symbol: str, title: str = None) -> bytes:
-    """Создать изображение графика из данных"""
+async def get_bybit_klines(symbol: str, interval: str = "1", limit: int = 200):
+    """Получить данные свечей с Bybit"""
+    result = await fetch_bybit_kline_arrays(symbol, interval, limit)
+    if result is None:
+        return None
+    timestamps, ohlcv = result
+    index = pd.DatetimeIndex(timestamps.view('datetime64[ms]'), name='datetime')
+    return pd.DataFrame(ohlcv, index=index, columns=KLINE_COLUMNS, copy=False)
+
+# Проверенные символы linear-контрактов Bybit: повторные /subscribe не ходят в API
+known_symbols: set[str] = set()
+
+async def check_bybit_symbol(symbol: str) -> bool | None:
+    """Есть ли торгуемый linear-контракт symbol на Bybit; None — проверить не удалось"""
+    if symbol in known_symbols:
+        return True
+    if not symbol.isascii() or not symbol.isalnum() or len(symbol) > 30:
+        return False
+    try:
+        _, data = await http_client.get_json(
+            f"https://{BYBIT_HOST}/v5/market/instruments-info",
+            params={"category": "linear", "symbol": symbol},
+            connect_timeout=5, read_timeout=10,
+        )
+    except Exception as e:
+        print(f"[subscribe] symbol check {symbol} failed: {e}")
+        return None
+    if not isinstance(data, dict):
+        return None
+    # Неизвестный символ: retCode 10001 ("params error: symbol invalid") или пустой список;
+    # прочие ошибки (лимит запросов и т.п.) — не ответ о символе
+    if data.get("retCode") == 10001:
+        return False
+    if data.get("retCode") != 0:
+        print(f"[subscribe] symbol check {symbol}: retCode {data.get('retCode')} {data.get('retMsg')}")
+        return None
+    instruments = (data.get("result") or {}).get("list") or []
+    if any(item.get("symbol") == symbol and item.get("status") == "Trading" for item in instruments):
+        known_symbols.add(symbol)
+        return True
+    return False
+
+# Кэш свечей: на каждый цикл догружаем только новые свечи, окно отдаем копией
+kline_cache = KlineCache(fetch_bybit_kline_arrays, capacity=int(os.getenv("KLINE_CACHE_SIZE", "1000")))
+
+# MARKET_FEED=ws — свечи приходят из WebSocket-потока Bybit, анализ запускается по закрытию бара
+MARKET_FEED = os.getenv("MARKET_FEED", "rest").lower()
+market_feed = BybitKlineStream(
+    http_client, kline_cache, url=os.getenv("BYBIT_WS_URL", BYBIT_WS_URL)
+) if MARKET_FEED == "ws" else None
+
+# Индикаторы по парам: при одной новой свече рекурсивные ряды сдвигаются на шаг, без пересчета окна
+indicator_engine = IndicatorEngine()
+analysis_gate = ChangeGate(
+    min_move_atr=float(os.getenv("GATE_MIN_MOVE_ATR", "0.5")),  # сдвиг цены от опорной свечи, в ATR
+    atr_expansion=float(os.getenv("GATE_ATR_EXPANSION", "1.25")),  # рост ATR относительно опорной свечи
+    max_age=float(os.getenv("GATE_MAX_AGE", "1800")),  # не дольше стольких секунд без нового анализа
+)
+
+async def create_chart_image(df: pd.DataFrame, symbol: str, title: str = None, *, model_only: bool = False) -> ChartImages | None:
+    """Создать изображение графика из данных (рендер в пуле процессов):
+    отдельные варианты для Telegram (display) и для модели (model).
+    model_only — контекстный график только для модели, без варианта для Telegram."""
     try:
         if df is None or df.empty:
             return None
         
-        # Настройки стиля
-        mc = mpf.make_marketcolors(
-            up='#00ff88', down='#ff4444',
-            edge='inherit',
-            wick={'up':'#00ff88', 'down':'#ff4444'},
-            volume='in'
-        )
-        
-        style = mpf.make_mpf_style(
-            marketcolors=mc,
-            gridstyle='-',
-            gridcolor='#333333',
-            facecolor='#1e1e1e',
-            figcolor='#1e1e1e'
-        )
-        
-        # Создаем график
-        fig, axes = mpf.plot(
-            df,
-            type='candle',
-            style=style,
-            volume=True,
-            title=title or f'{symbol} Chart',
-            ylabel='Price ($)',
-            ylabel_lower='Volume',
-            figsize=(12, 8),
-            returnfig=True,
-            tight_layout=True
+        with span("render", candles=len(df)):
+            images = await render_pool.render(df, symbol, title, model_only=model_only)
+        chart_render_seconds.observe(images.render_seconds, stage="draw")
+        chart_render_seconds.observe(images.encode_seconds, stage="encode")
+        if model_only:
+            chart_image_bytes.observe(len(images.model), target="context")
+        else:
+            chart_image_bytes.observe(len(images.display), target="display")
+            chart_image_bytes.observe(len(images.model), target="model")
+        print(
+            f"[render] {symbol}: display {len(images.display) // 1024} KB {images.display.extension} "
+            f"{images.display.width}x{images.display.height}, model {len(images.model) // 1024} KB "
+            f"{images.model.extension} {images.model.width}x{images.model.height}, "
+            f"draw {images.render_seconds * 1000:.0f} ms + encode {images.encode_seconds * 1000:.0f} ms"
         )
-        
-        # Сохраняем в байты
-        buf = io.BytesIO()
-        fig.savefig(buf, format='png', dpi=150, bbox_inches='tight')
-        buf.seek(0)
-        image_bytes = buf.getvalue()
-        buf.close()
-        plt.close(fig)
-        
-        return image_bytes
+        return images
     except Exception as e:
         print(f"Ошибка создания графика: {e}")
         return None
 
-async def auto_analysis_handler():
-    """Обработчик автоматического анализа графиков"""
-    global auto_analysis_active, auto_analysis_chat_id, auto_analysis_symbols, last_signals
-    
-    # Небольшая задержка перед первым анализом (чтобы пользователь увидел быстрый ответ)
-    await asyncio.sleep(5)
-    
-    while auto_analysis_active:
-        try:
-            for symbol in auto_analysis_symbols:
-                if not auto_analysis_active:
-                    break
-                
-                print(f"📊 Автоанализ {symbol}...")
-                
-                # Отладка: показываем что начался анализ
-                print(f"🔍 Начинаю анализ для {symbol}...")
-                
-                # Получаем данные с Bybit
-                df = await get_bybit_klines(symbol, auto_analysis_timeframe, 200)
-                
-                if df is None or df.empty:
-                    print(f"❌ Не удалось получить данные Bybit для {symbol}")
+async def run_analysis_job(job: AnalysisJob):
+    """Один проход автоанализа по паре: данные → график → AI → сигнал.
+    Каждый проход — дерево спанов (klines, render, analyze/gemini, parse, broadcast)."""
+    if not sessions.subscribers(job.symbol, job.timeframe):
+        return
+    outcome = "error"
+    try:
+        with span("auto_analysis", symbol=job.symbol, tf=job.timeframe):
+            outcome = await _run_analysis_pass(job.symbol, job.timeframe)
+    finally:
+        auto_analysis_runs.inc(outcome=outcome)
+
+async def _run_analysis_pass(symbol: str, timeframe: str) -> str:
+    """Проход автоанализа; вернуть исход для метрик"""
+    outcome = "no_result"
+    try:
+        print(f"📊 Автоанализ {symbol}...")
+
+        # Отладка: показываем что начался анализ
+        print(f"🔍 Начинаю анализ для {symbol}...")
+
+        # Получаем данные с Bybit: основной таймфрейм и контекстные — параллельно
+        context_timeframes = sorted(
+            (tf for tf in MTF_TIMEFRAMES if tf != timeframe), key=lambda tf: INTERVAL_MS[tf], reverse=True
+        )
+        with span("klines", timeframes=1 + len(context_timeframes)):
+            use_indicators = INDICATOR_CONTEXT or ANALYSIS_GATE
+            limit = max(INDICATOR_HISTORY, 200) if use_indicators else 200
+            # Контекстные таймфреймы — с тем же окном, что и основной: таймфрейм может быть основным
+            # у другой подписки, и запрос окна длиннее кэша перезагружал бы его кольцо целиком
+            history, *context_frames = await asyncio.gather(
+                kline_cache.get(symbol, timeframe, limit),
+                *(kline_cache.get(symbol, tf, limit) for tf in context_timeframes),
+            )
+        df = history.iloc[-200:] if history is not None else None
+        context_frames = [frame.iloc[-MTF_CANDLES:] if frame is not None else None for frame in context_frames]
+
+        if df is None or df.empty:
+            print(f"❌ Не удалось получить данные Bybit для {symbol}")
+            return "no_data"
+
+        print(f"✅ Данные получены для {symbol}: {len(df)} свечей")
+
+        # Свечи уже загружены — заодно закрываем ожидающие сигналы пары
+        resolved = signal_journal.resolve(symbol, timeframe, *frame_arrays(history))
+        if resolved:
+            print(f"📈 Закрыто сигналов {symbol}/{timeframe}m: {resolved}")
+
+        snapshot = None
+        if use_indicators:
+            with span("indicators"):
+                snapshot = indicator_engine.snapshot_frame(symbol, timeframe, history)
+        context = snapshot.to_text() if INDICATOR_CONTEXT and snapshot is not None else None
+
+        if ANALYSIS_GATE and snapshot is not None:
+            # Сравниваем с окном, по которому получен последний сигнал пары
+            previous = last_signals.get((symbol, timeframe), {})
+            decision = analysis_gate.check(previous.get('market'), snapshot)
+            analysis_gate_decisions.inc(decision="analyze" if decision.analyze else "skip", reason=decision.reason)
+            if not decision.analyze:
+                print(f"[gate] {symbol}/{timeframe}m: рынок не изменился ({decision.describe()}), "
+                      f"остается {previous.get('signal')}, запрос к AI не нужен")
+                return "gated"
+
+        # Создаем графики: основной и контекстные (только для модели) рисуются параллельно в пуле
+        chart, *context_charts = await asyncio.gather(
+            create_chart_image(df, symbol, f"{symbol} - {timeframe}m (Авто)"),
+            *(create_chart_image(frame, symbol, f"{symbol} - {tf}m", model_only=True)
+              for tf, frame in zip(context_timeframes, context_frames)),
+        )
+        extra_images, shown_timeframes = [], []
+        for tf, image in zip(context_timeframes, context_charts):
+            if image is None:
+                print(f"⚠️ Нет графика {symbol} {tf}m, анализ без него")
+                continue
+            role = "старший" if INTERVAL_MS[tf] > INTERVAL_MS[timeframe] else "младший"
+            extra_images.append((f"График {symbol} {tf}m ({role} таймфрейм):", image.model.data, image.model.mime_type))
+            shown_timeframes.append(tf)
+        if extra_images:
+            mtf_note = (
+                f"Первая картинка — основной график {timeframe}m: сигнал, SL и TP давай по нему. "
+                f"Следом графики {', '.join(f'{tf}m' for tf in shown_timeframes)}: анализируй их вместе — тренд старшего таймфрейма, "
+                f"структура основного, точка входа на младшем."
+            )
+            context = f"{mtf_note}\n\n{context}" if context else mtf_note
+
+        if chart:
+            # Анализируем график
+            print(f"🤖 Отправляю график на анализ AI...")
+            last_candle_ms = int(df.index[-1].timestamp() * 1000)
+            prompt_version = (
+                analysis_prompt_version()
+                + ("-ind" if snapshot is not None and INDICATOR_CONTEXT else "")
+                + "".join(f"-mtf{tf}" for tf in shown_timeframes)
+            )
+            cache_key = AnalysisCache.chart_key(symbol, timeframe, last_candle_ms, GOOGLE_MODEL, prompt_version)
+            analyze_started = perf_counter()
+            with span("analyze"):
+                model_results = await analyze_chart(
+                    chart.model.data, mime_type=chart.model.mime_type, cache_key=cache_key, context=context,
+                    extra_images=extra_images,
+                )
+            image_kb = (len(chart.model) + sum(len(data) for _, data, _ in extra_images)) // 1024
+            print(f"🎯 AI ответил за {perf_counter() - analyze_started:.1f} s "
+                  f"(картинок {1 + len(extra_images)}, {image_kb} KB)")
+            print(f"🎯 AI вернул {len(model_results)} результатов")
+
+            for model_name, raw in model_results:
+                if raw.startswith("Ошибка анализа:"):
+                    outcome = "model_error"
                     continue
-                
-                print(f"✅ Данные получены для {symbol}: {len(df)} свечей")
-                
-                # Создаем график
-                chart_bytes = await create_chart_image(df, symbol, f"{symbol} - {auto_analysis_timeframe}m (Авто)")
-                
-                if chart_bytes:
-                    # Анализируем график
-                    print(f"🤖 Отправляю график на анализ AI...")
-                    model_results = analyze_chart(chart_bytes)
-                    print(f"🎯 AI вернул {len(model_results)} результатов")
-                    
-                    for model_name, raw in model_results:
-                        if raw.startswith("Ошибка анализа:"):
-                            continue
-                        
-                        print(f"📄 Сырой ответ AI: {raw[:200]}...")
-                        strategy, signal, entry, stop_loss, take_profit, reason = parse_trading_signal(raw)
-                        print(f"🎯 Распарсенный сигнал: {signal}, SL: {stop_loss}, TP: {take_profit}")
-                        
-                        # Проверяем, изменился ли сигнал с последнего раза
-                        last_signal = last_signals.get(symbol, {})
-                        current_signal_data = {
-                            'signal': signal,
-                            'stop_loss': stop_loss,
-                            'take_profit': take_profit,
-                            'reason': reason[:100]  # Первые 100 символов для сравнения
-                        }
-                        
-                        # Простая проверка: отправляем ВСЕ сигналы (без фильтрации)
-                        # Трейдеры должны видеть каждое изменение!
-                        signal_should_send = True
-                        print(f"📤 Отправляю ВСЕ сигналы без фильтрации")
-                        
-                        if signal in ['BUY', 'SELL'] and signal_should_send:
-                            
-                            # Сохраняем текущий сигнал
-                            last_signals[symbol] = current_signal_data
-                            
-                            # Отправляем график
-                            try:
-                                chart_file = types.BufferedInputFile(chart_bytes, filename=f"{symbol}_auto_{auto_analysis_timeframe}m.png")
-                                await send_with_retry(lambda: bot.send_photo(
-                                    auto_analysis_chat_id,
-                                    chart_file,
-                                    caption=f"🤖 Автоанализ {symbol} ({auto_analysis_timeframe}m)"
-                                ))
-                            except Exception as e:
-                                print(f"❌ Ошибка отправки графика: {e}")
-                            
-                            # Отправляем сигнал
-                            reason = (reason or "").strip()
-                            
-                            # Ограничиваем длину анализа для предотвращения обрезания
-                            max_reason_length = 500  # Уменьшаем до 500 символов
-                            if len(reason) > max_reason_length:
-                                reason = reason[:max_reason_length] + "..."
-                            
-                            # Чистим разметку из причин/комментариев
-                            clean_reason = clean_field(reason)
-                            if " | " in clean_reason:
-                                reason_part, comment_part = clean_reason.split(" | ", 1)
-                                analysis_text = f"📝 Причина: {reason_part}\n💬 Комментарий: {comment_part}"
-                            else:
-                                analysis_text = f"📝 Анализ: {clean_reason}"
-                            
-                            # Добавляем эмодзи и силу сигнала (в заголовке жирным)
-                            signal_emoji = "🟢📈" if signal == "BUY" else "🔴📉"
-                            strength = extract_strength(reason) or extract_strength(comment)
-                            if strength:
-                                signal_text = f"{signal_emoji} АВТОСИГНАЛ <b>{signal} · Сила {strength}</b>"
-                            else:
-                                signal_text = f"{signal_emoji} АВТОСИГНАЛ <b>{signal}</b>"
-                            
-                            # Очищаем поля от лишней markdown-разметки
-                            stop_clean = clean_field(stop_loss)
-                            take_clean = clean_field(take_profit)
-                            
-                            message_text = (
-                                f"{signal_text}\n"
-                                f"💰 Пара: {symbol}\n"
-                                f"🛑 Стоп: <b>{stop_clean}</b>\n"
-                                f"🎯 Тейк: <b>{take_clean}</b>\n"
-                                f"{analysis_text}\n"
-                                f"🕐 {datetime.now().strftime('%H:%M:%S')}"
-                            )
-                            
-                            try:
-                                await send_with_retry(lambda: bot.send_message(auto_analysis_chat_id, message_text))
-                                print(f"✅ {signal} сигнал отправлен для {symbol}: {stop_loss} -> {take_profit}")
-                            except Exception as e:
-                                print(f"❌ Ошибка отправки {signal} сигнала: {e}")
-                                # Сохраняем сигнал даже если не удалось отправить
-                                last_signals[symbol] = current_signal_data
-                            
-                        elif signal == 'NO_TRADE':
-                            # NO_TRADE не отправляем пользователю - только сохраняем в память
-                            last_signals[symbol] = current_signal_data
-                            print(f"🔍 NO_TRADE сигнал (не отправляем) для {symbol}: {reason[:50]}...")
-                        
-                        break  # Берем только первый результат анализа
-                        
-                # Пауза между символами
-                await asyncio.sleep(5)
-                
-        except Exception as e:
-            if auto_analysis_active:
-                print(f"Ошибка автоанализа: {e}")
+
+                print(f"📄 Сырой ответ AI: {raw[:200]}...")
+                with span("parse"), signal_parse_seconds.time():
+                    parsed = parse_signal(raw)
+                signal, stop_loss, take_profit = parsed.signal, parsed.stop_loss, parsed.take_profit
+                reason = parsed.full_reason[:300]
+                print(f"🎯 Распарсенный сигнал: {signal}, SL: {stop_loss}, TP: {take_profit}")
+
+                # Проверяем, изменился ли сигнал с последнего раза
+                last_signal = last_signals.get((symbol, timeframe), {})
+                current_signal_data = {
+                    'signal': signal,
+                    'stop_loss': stop_loss,
+                    'take_profit': take_profit,
+                    'sl_price': parsed.sl_price,
+                    'tp_price': parsed.tp_price,
+                    'strength': parsed.strength,
+                    'reason': reason[:100],  # Первые 100 символов для сравнения
+                    'market': snapshot,  # Сводка окна, по которому получен сигнал (опора для фильтра)
+                }
+
+                # Простая проверка: отправляем ВСЕ сигналы (без фильтрации)
+                # Трейдеры должны видеть каждое изменение!
+                signal_should_send = True
+                print(f"📤 Отправляю ВСЕ сигналы без фильтрации")
+
+                if signal in ['BUY', 'SELL'] and signal_should_send:
+
+                    # Сохраняем текущий сигнал
+                    last_signals[(symbol, timeframe)] = current_signal_data
+
+                    # Готовим сигнал
+                    reason = (reason or "").strip()
+
+                    # Ограничиваем длину анализа для предотвращения обрезания
+                    max_reason_length = 500  # Уменьшаем до 500 символов
+                    if len(reason) > max_reason_length:
+                        reason = reason[:max_reason_length] + "..."
+
+                    # Чистим разметку из причин/комментариев
+                    clean_reason = clean_field(reason)
+                    if " | " in clean_reason:
+                        reason_part, comment_part = clean_reason.split(" | ", 1)
+                        analysis_text = f"📝 Причина: {reason_part}\n💬 Комментарий: {comment_part}"
+                    else:
+                        analysis_text = f"📝 Анализ: {clean_reason}"
+
+                    # Добавляем эмодзи и силу сигнала (в заголовке жирным)
+                    signal_emoji = "🟢📈" if signal == "BUY" else "🔴📉"
+                    strength = parsed.strength_text
+                    if strength:
+                        signal_text = f"{signal_emoji} АВТОСИГНАЛ <b>{signal} · Сила {strength}</b>"
+                    else:
+                        signal_text = f"{signal_emoji} АВТОСИГНАЛ <b>{signal}</b>"
+
+                    # Очищаем поля от лишней markdown-разметки
+                    stop_clean = clean_field(stop_loss)
+                    take_clean = clean_field(take_profit)
+
+                    message_text = (
+                        f"{signal_text}\n"
+                        f"💰 Пара: {symbol}\n"
+                        f"🛑 Стоп: <b>{stop_clean}</b>\n"
+                        f"🎯 Тейк: <b>{take_clean}</b>\n"
+                        f"{analysis_text}\n"
+                        f"🕐 {datetime.now().strftime('%H:%M:%S')}"
+                    )
+
+                    # Один анализ — рассылка всем подписчикам пары
+                    chat_ids = sessions.subscribers(symbol, timeframe)
+                    with span("broadcast", chats=len(chat_ids)):
+                        delivered = await broadcast_signal(
+                            chat_ids,
+                            chart.display.data,
+                            f"{symbol}_auto_{timeframe}m.{chart.display.extension}",
+                            f"🤖 Автоанализ {symbol} ({timeframe}m)",
+                            message_text,
+                        )
+                    outcome = "signal"
+                    print(f"✅ {signal} сигнал для {symbol} отправлен в {delivered}/{len(chat_ids)} чатов: {stop_loss} -> {take_profit}")
+                    signal_journal.record(
+                        symbol, timeframe, last_candle_ms, signal, float(df['close'].iloc[-1]),
+                        parsed.sl_price, parsed.tp_price, parsed.strength,
+                    )
+
+                elif signal == 'NO_TRADE':
+                    # NO_TRADE не отправляем пользователю - только сохраняем в память
+                    last_signals[(symbol, timeframe)] = current_signal_data
+                    outcome = "no_trade"
+                    print(f"🔍 NO_TRADE сигнал (не отправляем) для {symbol}: {reason[:50]}...")
+
+                break  # Берем только первый результат анализа
+    except Exception as e:
+        if auto_analysis_active:
+            print(f"Ошибка автоанализа: {e}")
+            # Текст готовим сразу: отправка из очереди выполнится уже после выхода из except, где e удалена
+            error_text = f"❌ Ошибка автоанализа {symbol}: {e}"
+            for chat_id in sessions.subscribers(symbol, timeframe):
                 try:
-                    await bot.send_message(auto_analysis_chat_id, f"❌ Ошибка автоанализа: {e}")
+                    # Повторные ошибки по паре, еще не ушедшие, схлопываются в одну
+                    await telegram_sender.send(
+                        chat_id,
+                        lambda chat_id=chat_id: bot.send_message(chat_id, error_text),
+                        priority=PRIORITY_STATUS,
+                        coalesce_key=("auto-error", chat_id, symbol, timeframe),
+                    )
                 except Exception as notify_err:
                     print(f"[auto-analysis] failed to notify error: {notify_err}")
-        
-        if auto_analysis_active:
-            print(f"⏰ Ожидание {auto_analysis_interval} секунд до следующего анализа...")
-            await asyncio.sleep(auto_analysis_interval)
+        raise
+    return outcome
 
-async def start_auto_analysis(chat_id: int):
-    """Запустить автоматический анализ с фиксированными настройками"""
-    global auto_analysis_active, auto_analysis_chat_id
+async def broadcast_signal(chat_ids: list[int], chart_bytes: bytes, filename: str, caption: str, message_text: str) -> int:
+    """Разослать график и сигнал подписчикам; вернуть число чатов, получивших сигнал.
+    График загружается в Telegram один раз, остальным чатам уходит его file_id.
+    Если сигнал помещается в подпись, график и текст уходят одним сообщением."""
+    combined = f"{caption}\n\n{message_text}"
+    single = len(combined) <= 1024  # лимит подписи к фото
     
-    if auto_analysis_active:
-        return False
+    async def deliver(chat_id, photo):
+        sent = None
+        try:
+            sent = await telegram_sender.send(
+                chat_id,
+                lambda: bot.send_photo(chat_id, photo, caption=combined if single else caption),
+                priority=PRIORITY_SIGNAL,
+            )
+            if single:
+                return sent, True
+        except Exception as e:
+            print(f"❌ Ошибка отправки графика в {chat_id}: {e}")
+        try:
+            await telegram_sender.send(chat_id, lambda: bot.send_message(chat_id, message_text), priority=PRIORITY_SIGNAL)
+            return sent, True
+        except Exception as e:
+            print(f"❌ Ошибка отправки сигнала в {chat_id}: {e}")
+            return sent, False
+    
+    if not chat_ids:
+        return 0
+    photo = types.BufferedInputFile(chart_bytes, filename=filename)
+    sent, ok = await deliver(chat_ids[0], photo)
+    if sent is not None and sent.photo:
+        photo = sent.photo[-1].file_id
+    results = await asyncio.gather(*(deliver(chat_id, photo) for chat_id in chat_ids[1:]))
+    return int(ok) + sum(1 for _, delivered in results if delivered)
+
+async def _on_candle_closed(symbol: str, interval: str, start_ms: int):
+    # В режиме WebSocket задача пары запускается сразу по закрытию бара
+    if analysis_scheduler is not None:
+        analysis_scheduler.trigger(symbol, interval)
+
+if market_feed is not None:
+    market_feed.add_listener(_on_candle_closed)
+
+async def auto_analysis_handler():
+    """Обработчик автоматического анализа графиков (планировщик задач по парам)"""
+    global analysis_scheduler
     
-    auto_analysis_active = True
-    auto_analysis_chat_id = chat_id
+    scheduler = AnalysisScheduler(
+        run_analysis_job,
+        max_concurrency=AUTO_ANALYSIS_CONCURRENCY,
+        jitter=AUTO_ANALYSIS_JITTER,
+    )
+    for symbol, timeframe in sessions.keys:
+        scheduler.add(symbol, timeframe, job_interval(symbol, timeframe))
+    analysis_scheduler = scheduler
     
-    # Запускаем обработчик в фоне (без ожидания первого анализа)
-    asyncio.create_task(auto_analysis_handler())
-    return True
+    try:
+        await scheduler.run()
+    finally:
+        if analysis_scheduler is scheduler:
+            analysis_scheduler = None
 
-async def stop_auto_analysis():
-    """Остановить автоматический анализ"""
-    global auto_analysis_active
-    auto_analysis_active = False
+async def subscribe_chat(chat_id: int, symbol: str, timeframe: str):
+    """Подписать чат на пару и при необходимости запустить планировщик"""
+    global auto_analysis_active, auto_analysis_task
+    
+    sessions.subscribe(chat_id, symbol, timeframe)
+    if market_feed is not None:
+        await market_feed.subscribe(symbol, timeframe)
+        market_feed.start()
+    if analysis_scheduler is not None:
+        analysis_scheduler.add(symbol, timeframe, job_interval(symbol, timeframe))
+    
+    if not auto_analysis_active:
+        auto_analysis_active = True
+        # Запускаем обработчик в фоне (без ожидания первого анализа)
+        auto_analysis_task = asyncio.create_task(auto_analysis_handler())
 
-def get_control_keyboard():
-    """Создать клавиатуру с кнопками управления (постоянная внизу)"""
+async def start_auto_analysis(chat_id: int):
+    """Подписать чат на автоанализ с настройками по умолчанию"""
+    if sessions.is_active(chat_id):
+        return False
+    
+    for symbol, timeframe, _ in auto_analysis_jobs():
+        await subscribe_chat(chat_id, symbol, timeframe)
+    return True
+
+async def stop_auto_analysis(chat_id: int | None = None, symbol: str | None = None, timeframe: str | None = None):
+    """Отписать чат (или все чаты); планировщик останавливается, когда подписок не осталось"""
     global auto_analysis_active
     
-    if auto_analysis_active:
+    chat_ids = [chat_id] if chat_id is not None else sessions.chats
+    for cid in chat_ids:
+        for key in sessions.unsubscribe(cid, symbol, timeframe):
+            # Пару больше никто не слушает — убираем ее задачу и поток свечей
+            if analysis_scheduler is not None:
+                analysis_scheduler.remove(*key)
+            if market_feed is not None:
+                await market_feed.unsubscribe(*key)
+    
+    if not sessions:
+        auto_analysis_active = False
+        if analysis_scheduler is not None:
+            analysis_scheduler.stop()
+        if market_feed is not None:
+            await market_feed.stop()
+
+def get_control_keyboard(chat_id: int | None = None):
+    """Создать клавиатуру с кнопками управления (постоянная внизу) для чата"""
+    if sessions.is_active(chat_id):
         # Если автоанализ активен - показываем кнопку "Остановить"
         keyboard = ReplyKeyboardMarkup(
             keyboard=[
@@ -753,6 +1142,10 @@ def get_control_keyboard():
     
     return keyboard
 
+def subscriptions_text(chat_id: int) -> str:
+    """Пары, на которые подписан чат, в виде 'SOLUSDT 5m, BTCUSDT 15m'"""
+    return ", ".join(f"{symbol} {timeframe}m" for symbol, timeframe in sessions.subscriptions(chat_id)) or "-"
+
 @dp.message(F.text == "🚀 Запустить автоанализ")
 async def message_start_analysis(message: types.Message):
     """Обработчик кнопки 'Запустить автоанализ'"""
@@ -761,46 +1154,45 @@ async def message_start_analysis(message: types.Message):
         success = await start_auto_analysis(message.chat.id)
         
         if not success:
-            await message.answer("❌ Автоанализ уже активен!", reply_markup=get_control_keyboard())
+            await message.answer("❌ Автоанализ уже активен!", reply_markup=get_control_keyboard(message.chat.id))
             return
         
         # Быстро отвечаем пользователю
         new_text = (
             "🤖 <b>Панель управления автоанализом</b>\n\n"
             f"✅ Автоанализ запущен!\n"
-            f"📊 Символ: SOLUSDT\n"
+            f"📊 Пары: {subscriptions_text(message.chat.id)}\n"
             f"⏰ Интервал: каждые 6 минут\n"
             f"📈 Таймфрейм: 5m графики\n"
             f"🔗 Источник: Bybit API\n\n"
             f"💡 Первый анализ начнется через несколько секунд..."
         )
         
-        await message.answer(new_text, reply_markup=get_control_keyboard())
+        await message.answer(new_text, reply_markup=get_control_keyboard(message.chat.id))
             
     except Exception as e:
-        await message.answer("❌ Ошибка запуска автоанализа", reply_markup=get_control_keyboard())
+        await message.answer("❌ Ошибка запуска автоанализа", reply_markup=get_control_keyboard(message.chat.id))
 
 @dp.message(F.text == "🛑 Остановить автоанализ")
 async def message_stop_analysis(message: types.Message):
     """Обработчик кнопки 'Остановить автоанализ'"""
-    global auto_analysis_active, auto_analysis_chat_id
-    
     try:
-        if auto_analysis_chat_id != message.chat.id:
-            await message.answer("❌ Автоанализ запущен в другом чате!")
+        if not sessions.is_active(message.chat.id):
+            await message.answer("❌ Автоанализ в этом чате не запущен!", reply_markup=get_control_keyboard(message.chat.id))
             return
         
-        await stop_auto_analysis()
+        stopped = subscriptions_text(message.chat.id)
+        await stop_auto_analysis(message.chat.id)
         
         # Отправляем сообщение с новой клавиатурой
         new_text = (
             "🤖 <b>Панель управления автоанализом</b>\n\n"
             f"⏹️ Автоанализ остановлен\n"
-            f"📊 Символ: SOLUSDT\n"
+            f"📊 Пары: {stopped}\n"
             f"⏰ Готов к запуску"
         )
         
-        await message.answer(new_text, reply_markup=get_control_keyboard())
+        await message.answer(new_text, reply_markup=get_control_keyboard(message.chat.id))
             
     except Exception as e:
         await message.answer("❌ Ошибка остановки автоанализа")
@@ -810,12 +1202,47 @@ async def message_show_status(message: types.Message):
     """Обработчик кнопки 'Статус' — теперь показывает Health"""
     try:
         text = await build_health_text()
-        await message.answer(text, reply_markup=get_control_keyboard())
+        await message.answer(text, reply_markup=get_control_keyboard(message.chat.id))
     except Exception:
         await message.answer("❌ Ошибка получения статуса")
 
 ## Removed /stats in favor of Status button
 
+async def resolve_pending_signals():
+    """Закрыть ожидающие сигналы всех пар: по одной загрузке свечей с момента самого раннего.
+    Bybit отдает последние limit свечей диапазона, поэтому конец окна задаем явно —
+    сигналы дальше окна закроются при следующем вызове."""
+    for (symbol, timeframe), earliest in signal_journal.pending_pairs().items():
+        end = earliest + 1000 * INTERVAL_MS.get(timeframe, 60_000)
+        result = await fetch_bybit_kline_arrays(symbol, timeframe, 1000, start=earliest, end=end)
+        if result is not None:
+            signal_journal.resolve(symbol, timeframe, *result)
+
+def signal_stats_text(window: int = 50) -> str:
+    stats = signal_journal.stats(window)
+    if stats.empty:
+        return "📈 Сигналов с SL/TP пока нет"
+    lines = [f"📈 <b>Исходы сигналов</b> (последние {window} в группе)"]
+    for (symbol, timeframe, bucket), row in stats.iterrows():
+        if row.signals:
+            lines.append(
+                f"• {symbol} {timeframe}m, сила {bucket}: {row.signals} сигн., прибыльных {row.win_rate:.0%}, "
+                f"R {row.avg_r:+.2f} в среднем, {row.total_r:+.1f} всего (TP {row.tp} / SL {row.sl})"
+                + (f", ждут {row.pending}" if row.pending else "")
+            )
+        else:
+            lines.append(f"• {symbol} {timeframe}m, сила {bucket}: ждут исхода {row.pending}")
+    return "\n".join(lines)
+
+@dp.message(Command("signals"))
+async def cmd_signals(message: types.Message):
+    """Винрейт и R-мультипликатор отправленных сигналов по парам и силе"""
+    try:
+        await resolve_pending_signals()
+    except Exception as e:
+        print(f"[signals] failed to resolve pending: {e}")
+    await message.answer(signal_stats_text())
+
 @dp.message(Command("health"))
 async def cmd_health(message: types.Message):
     """Показать состояние сервисов: Telegram, Bybit, Google, автоанализ"""
@@ -825,13 +1252,11 @@ async def cmd_health(message: types.Message):
 @dp.message(Command("start"))
 async def start_cmd(message: types.Message):
     """Показать панель управления с кнопками"""
-    global auto_analysis_active
-    
-    if auto_analysis_active:
+    if sessions.is_active(message.chat.id):
         status_text = (
             "🤖 <b>Панель управления автоанализом</b>\n\n"
             f"✅ Статус: <b>АКТИВЕН</b>\n"
-            f"📊 Символ: SOLUSDT\n"
+            f"📊 Пары: {subscriptions_text(message.chat.id)}\n"
             f"⏰ Интервал: каждые 6 минут\n"
             f"📈 Таймфрейм: 5m графики\n"
             f"🔗 Источник: Bybit API\n\n"
@@ -846,21 +1271,51 @@ async def start_cmd(message: types.Message):
             f"🎯 Нажмите кнопку ниже чтобы запустить автоматические торговые сигналы!"
         )
     
-    await message.answer(status_text, reply_markup=get_control_keyboard())
+    await message.answer(status_text, reply_markup=get_control_keyboard(message.chat.id))
 
-@dp.message(F.photo)
-async def handle_photo(message: types.Message):
-    """Анализ отправленного пользователем фото графика"""
-    await message.answer("Анализирую график… ⏳")
-    
-    # Получаем изображение
-    photo = message.photo[-1]
-    file = await bot.get_file(photo.file_id)
-    img_bytes = await bot.download_file(file.file_path)
-    
-    # Анализируем график
-    model_results = analyze_chart(img_bytes.read())
-    
+@dp.message(Command("subscribe"))
+async def cmd_subscribe(message: types.Message, command: CommandObject):
+    """Подписать чат на пару: /subscribe BTCUSDT 15"""
+    args = (command.args or "").split()
+    if not args:
+        await message.answer("Использование: /subscribe SYMBOL [таймфрейм], например /subscribe BTCUSDT 15")
+        return
+    symbol = args[0].upper()
+    timeframe = args[1] if len(args) > 1 else auto_analysis_timeframe
+    if timeframe not in INTERVAL_MS:
+        await message.answer(f"❌ Неизвестный таймфрейм: {timeframe}")
+        return
+    # Пару проверяем до регистрации: иначе планировщик будет гонять пустые запросы по опечатке
+    valid = await check_bybit_symbol(symbol)
+    if valid is None:
+        await message.answer(f"⚠️ Не удалось проверить {symbol} на Bybit, попробуйте позже")
+        return
+    if not valid:
+        await message.answer(f"❌ {symbol} не найден среди торгуемых контрактов Bybit (linear), пример: BTCUSDT")
+        return
+    await subscribe_chat(message.chat.id, symbol, timeframe)
+    await message.answer(
+        f"✅ Подписка оформлена: {symbol} {timeframe}m\n📊 Пары: {subscriptions_text(message.chat.id)}",
+        reply_markup=get_control_keyboard(message.chat.id)
+    )
+
+@dp.message(Command("unsubscribe"))
+async def cmd_unsubscribe(message: types.Message, command: CommandObject):
+    """Отписать чат от пары: /unsubscribe BTCUSDT [15]"""
+    args = (command.args or "").split()
+    if not args:
+        await message.answer("Использование: /unsubscribe SYMBOL [таймфрейм]")
+        return
+    symbol = args[0].upper()
+    timeframe = args[1] if len(args) > 1 else None
+    await stop_auto_analysis(message.chat.id, symbol, timeframe)
+    await message.answer(
+        f"⏹️ Отписка: {symbol}\n📊 Пары: {subscriptions_text(message.chat.id)}",
+        reply_markup=get_control_keyboard(message.chat.id)
+    )
+
+def format_photo_reply(model_results) -> str:
+    """Текст ответа на фото пользователя по результатам моделей"""
     lines = []
     for model_name, raw in model_results:
         if raw.startswith("Ошибка анализа:"):
@@ -880,46 +1335,175 @@ async def handle_photo(message: types.Message):
         
         lines.append(block)
 
-    reply = "\n\n".join(lines) if lines else "Ошибка анализа: пустой ответ"
+    return "\n\n".join(lines) if lines else "Ошибка анализа: пустой ответ"
 
-    # Разбиваем длинные сообщения
-    if len(reply) <= 4000:
-        await message.answer(reply)
-    else:
-        chunks = []
-        start = 0
-        while start < len(reply):
-            end = start + 4000
-            if end >= len(reply):
-                chunks.append(reply[start:])
-                break
-            
-            # Ищем последний перенос строки
-            cut = reply.rfind('\n', start, end)
-            if cut == -1:
-                cut = end
-            
-            chunks.append(reply[start:cut])
-            start = cut
+def split_message(reply: str, limit: int = 4000) -> list[str]:
+    """Разбить длинный текст по переносам строк на куски не длиннее limit"""
+    if len(reply) <= limit:
+        return [reply]
+    chunks = []
+    start = 0
+    while start < len(reply):
+        end = start + limit
+        if end >= len(reply):
+            chunks.append(reply[start:])
+            break
+        
+        # Ищем последний перенос строки
+        cut = reply.rfind('\n', start, end)
+        if cut == -1:
+            cut = end
         
-        for chunk in chunks:
-            if chunk.strip():
-                await message.answer(chunk.strip())
+        chunks.append(reply[start:cut])
+        start = cut
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+async def process_photo_job(job: PhotoJob) -> str:
+    """Задача очереди: скачать фото и проанализировать"""
+    # Свой корневой спан: трассы фото не смешиваются с проходами автоанализа
+    with span("photo_analysis", user=job.user_id):
+        file = await bot.get_file(job.file_id)
+        img_bytes = await bot.download_file(file.file_path)
+        model_results = await analyze_chart(img_bytes.read())
+    return format_photo_reply(model_results)
+
+async def deliver_photo_result(job: PhotoJob, waiter: tuple[int, int], reply: str):
+    """Подставить результат в сообщение "в очереди", хвост длинного ответа — новыми сообщениями"""
+    chat_id, message_id = waiter
+    chunks = split_message(reply)
+    await telegram_sender.send(
+        chat_id,
+        lambda: bot.edit_message_text(chunks[0], chat_id=chat_id, message_id=message_id),
+        priority=PRIORITY_RESULT,
+    )
+    for chunk in chunks[1:]:
+        await telegram_sender.send(chat_id, lambda: bot.send_message(chat_id, chunk), priority=PRIORITY_RESULT)
+
+# Анализ фото пользователей — через очередь с ограниченным числом воркеров
+photo_queue = PhotoQueue(
+    process_photo_job,
+    deliver_photo_result,
+    workers=int(os.getenv("PHOTO_WORKERS", "4")),
+    max_pending=int(os.getenv("PHOTO_QUEUE_SIZE", "100")),
+    user_limit=int(os.getenv("PHOTO_USER_LIMIT", "5")),
+    user_window=float(os.getenv("PHOTO_USER_WINDOW", "60")),
+    user_pending=int(os.getenv("PHOTO_USER_PENDING", "2")),
+)
+
+@dp.message(F.photo)
+async def handle_photo(message: types.Message):
+    """Анализ отправленного пользователем фото графика (через очередь)"""
+    photo = message.photo[-1]
+    user_id = message.from_user.id if message.from_user else message.chat.id
+    try:
+        job, position = photo_queue.submit(user_id, photo.file_unique_id, photo.file_id)
+    except PhotoRateLimited as e:
+        if e.retry_after > 0:
+            await message.answer(f"⏳ Слишком много фото, попробуйте через {int(e.retry_after) + 1} с")
+        else:
+            await message.answer("⏳ Дождитесь результата по уже отправленным графикам")
+        return
+    except PhotoQueueFull:
+        await message.answer("⚠️ Очередь анализа переполнена, попробуйте чуть позже")
+        return
+    
+    if position:
+        ack = await message.answer(f"⏳ В очереди #{position}, результат появится в этом сообщении")
+    else:
+        ack = await message.answer("Анализирую график… ⏳")
+    await photo_queue.attach(job, ack.chat.id, ack.message_id)
+
+async def shutdown(drain_timeout: float = 30.0):
+    """Остановить фоновые части бота: автоанализ, очереди, пулы, сохранить состояние"""
+    # Останавливаем автоанализ и ждем, пока планировщик завершит текущие задачи
+    await stop_auto_analysis()
+    if auto_analysis_task is not None and not auto_analysis_task.done():
+        try:
+            await asyncio.wait_for(auto_analysis_task, drain_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            print(f"[shutdown] auto-analysis handler failed: {e}")
+    # Даем очереди фото доделать начатое
+    await photo_queue.stop(timeout=float(os.getenv("PHOTO_DRAIN_TIMEOUT", "30")))
+    await telegram_sender.stop(timeout=10)
+    # В режиме polling сессию закрывает aiogram; в режиме вебхука — только здесь, после очереди отправки
+    await bot.session.close()
+    await render_pool.shutdown()
+    await http_client.close()
+    request_ledger.close()
+    signal_journal.close()
+    await analysis_cache.flush()
+    await google_quota.flush()
+    if metrics_server is not None:
+        await metrics_server.stop()
+    await stop_loop_lag_monitor()
+
+async def run_polling():
+    # Удаляем активный вебхук, чтобы можно было использовать getUpdates (long polling)
+    try:
+        await bot.delete_webhook(drop_pending_updates=True)
+    except Exception as e:
+        print(f"[startup] delete_webhook failed: {e}")
+    await dp.start_polling(bot)
+
+async def run_webhook():
+    """Режим вебхука: aiohttp-сервер принимает апдейты, остановка по SIGTERM/SIGINT с дренажом"""
+    server = WebhookServer(
+        dp, bot,
+        path=WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+        port=int(os.getenv("WEBHOOK_PORT", "8080")),
+        max_concurrency=int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "32")),
+    )
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    
+    await server.start()
+    try:
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40")),
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+        await dp.emit_startup(bot=bot)
+        await stop_event.wait()
+    finally:
+        # Вебхук не снимаем: при нескольких репликах апдейты примут остальные
+        await server.stop(drain_timeout=float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30")))
+        await dp.emit_shutdown(bot=bot)
 
 if __name__ == "__main__":
     import asyncio
 
     async def main():
-        # Удаляем активный вебхук, чтобы можно было использовать getUpdates (long polling)
+        init_runtime()
+        # Прогреваем воркеры рендеринга до первых апдейтов
         try:
-            await bot.delete_webhook(drop_pending_updates=True)
+            await render_pool.start()
         except Exception as e:
-            print(f"[startup] delete_webhook failed: {e}")
+            print(f"[startup] render pool start failed: {e}")
+        
+        photo_queue.start()
+        # Лаг event loop нужен и /health, поэтому меряем его и без /metrics
+        start_loop_lag_monitor()
+        if metrics_server is not None:
+            try:
+                await metrics_server.start()
+            except Exception as e:
+                print(f"[startup] metrics server start failed: {e}")
         
         try:
-            await dp.start_polling(bot)
+            if BOT_MODE == "webhook":
+                await run_webhook()
+            else:
+                await run_polling()
         finally:
-            # Останавливаем автоанализ при завершении
-            await stop_auto_analysis()
+            await shutdown()
 
     asyncio.run(main())
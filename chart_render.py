@@ -0,0 +1,170 @@
+"""Рендеринг свечных графиков вне event loop.
+
+mpf.plot + savefig занимают сотни миллисекунд CPU, поэтому рисуем в пуле
+процессов: воркеры заранее импортируют matplotlib/mplfinance, очередь
+ограничена семафором (backpressure), API — обычная корутина.
+Фигура растеризуется один раз и кодируется в два варианта: для Telegram
+и для модели (см. image_encoding). Рендерер "fast" переиспользует готовую
+фигуру между кадрами (см. fast_chart), "mpf" строит ее через mplfinance.
+"""
+import asyncio
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import pandas as pd
+
+from image_encoding import EncodedImage, ImageSpec, encode_image, figure_to_image
+
+DISPLAY_SPEC = ImageSpec("png")
+MODEL_SPEC = ImageSpec("png8", None, 128)
+RENDERERS = ("mpf", "fast")
+
+
+@dataclass(frozen=True)
+class ChartImages:
+    display: EncodedImage
+    model: EncodedImage
+    render_seconds: float
+    encode_seconds: float
+
+
+def _init_worker():
+    """Прогрев воркера: backend Agg и импорт тяжелых модулей один раз"""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot  # noqa: F401
+    import mplfinance  # noqa: F401
+    import fast_chart  # noqa: F401
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def render_chart(
+    df: pd.DataFrame,
+    symbol: str,
+    title: str = None,
+    display_spec: ImageSpec = DISPLAY_SPEC,
+    model_spec: ImageSpec = MODEL_SPEC,
+    dpi: float = 150,
+    renderer: str = "mpf",
+) -> ChartImages:
+    """Нарисовать свечной график с объемом и закодировать для Telegram и для модели"""
+    started = time.perf_counter()
+    if renderer == "fast":
+        from fast_chart import render_template_figure
+        image = figure_to_image(render_template_figure(df, title or f'{symbol} Chart'), dpi)
+    else:
+        image = _render_mpf(df, symbol, title, dpi)
+    rendered = time.perf_counter()
+    display = encode_image(image, display_spec)
+    model = display if model_spec == display_spec else encode_image(image, model_spec)
+    return ChartImages(display, model, rendered - started, time.perf_counter() - rendered)
+
+
+def _render_mpf(df: pd.DataFrame, symbol: str, title: str, dpi: float):
+    """Полный рендер через mplfinance: стиль и фигура строятся заново"""
+    import matplotlib.pyplot as plt
+    import mplfinance as mpf
+
+    # Настройки стиля
+    mc = mpf.make_marketcolors(
+        up='#00ff88', down='#ff4444',
+        edge='inherit',
+        wick={'up':'#00ff88', 'down':'#ff4444'},
+        volume='in'
+    )
+
+    style = mpf.make_mpf_style(
+        marketcolors=mc,
+        gridstyle='-',
+        gridcolor='#333333',
+        facecolor='#1e1e1e',
+        figcolor='#1e1e1e'
+    )
+
+    # Создаем график
+    fig, axes = mpf.plot(
+        df,
+        type='candle',
+        style=style,
+        volume=True,
+        title=title or f'{symbol} Chart',
+        ylabel='Price ($)',
+        ylabel_lower='Volume',
+        figsize=(12, 8),
+        returnfig=True,
+        tight_layout=True
+    )
+
+    try:
+        return figure_to_image(fig, dpi)
+    finally:
+        plt.close(fig)
+
+
+class RenderPool:
+    """Пул процессов для рендеринга с ограниченной очередью"""
+
+    def __init__(
+        self,
+        workers: int | None = None,
+        queue_size: int | None = None,
+        *,
+        display_spec: ImageSpec = DISPLAY_SPEC,
+        model_spec: ImageSpec = MODEL_SPEC,
+        dpi: float = 150,
+        renderer: str = "mpf",
+    ):
+        if renderer not in RENDERERS:
+            raise ValueError(f"renderer must be one of {RENDERERS}")
+        self.renderer = renderer
+        self.display_spec = display_spec
+        self.model_spec = model_spec
+        self.dpi = dpi
+        self.workers = workers if workers is not None else max(1, (os.cpu_count() or 2) - 1)
+        self.queue_size = queue_size or max(1, self.workers * 2)
+        self._executor: ProcessPoolExecutor | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self.in_flight = 0
+
+    async def start(self) -> None:
+        """Поднять воркеры и дождаться их прогрева"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.queue_size)
+        if self._executor is not None or self.workers <= 0:
+            return
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=mp.get_context("spawn"),
+            initializer=_init_worker,
+        )
+        loop = asyncio.get_running_loop()
+        # Каждый ping заставляет пул запустить очередной процесс с initializer
+        await asyncio.gather(*(loop.run_in_executor(self._executor, _ping) for _ in range(self.workers)))
+
+    async def render(self, df: pd.DataFrame, symbol: str, title: str = None, *, model_only: bool = False) -> ChartImages:
+        """Отрисовать график в пуле; ждет свободного слота, если очередь полна.
+        model_only — картинка нужна только модели (display совпадает с model, кодируется один раз)."""
+        await self.start()
+        async with self._slots:
+            self.in_flight += 1
+            try:
+                display_spec = self.model_spec if model_only else self.display_spec
+                args = (df, symbol, title, display_spec, self.model_spec, self.dpi, self.renderer)
+                if self._executor is None:
+                    # workers=0 — рисуем в потоке (без отдельных процессов)
+                    return await asyncio.to_thread(render_chart, *args)
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, render_chart, *args)
+            finally:
+                self.in_flight -= 1
+
+    async def shutdown(self) -> None:
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.to_thread(executor.shutdown, True, cancel_futures=True)
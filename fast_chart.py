@@ -0,0 +1,128 @@
+"""Быстрый рендер свечного графика по заготовке.
+
+mplfinance на каждый кадр заново строит стиль, фигуру, оси и тысячи
+отдельных артистов. Здесь фигура в том же оформлении собирается один раз
+на раскладку (число свечей, размер фигуры), а для нового кадра меняются только
+вершины коллекций свечей/объемов, цвета, пределы осей и подписи времени.
+Без pyplot: фигура живет вне глобального состояния matplotlib.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.colors import to_rgba
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.ticker import FuncFormatter, MaxNLocator
+
+UP_COLOR = "#00ff88"
+DOWN_COLOR = "#ff4444"
+FACE_COLOR = "#1e1e1e"
+GRID_COLOR = "#333333"
+VOLUME_EDGE = "#1f77b4"
+BODY_WIDTH = 0.3  # половина ширины тела свечи в шагах по оси x
+VOLUME_WIDTH = 0.35
+
+_COLORS = np.array([to_rgba(DOWN_COLOR), to_rgba(UP_COLOR)])
+
+
+class ChartTemplate:
+    """Стилизованная фигура с осями и коллекциями, переиспользуемая между кадрами"""
+
+    def __init__(self, candles: int, figsize=(12, 8)):
+        self.candles = candles
+        self.fig = Figure(figsize=figsize, facecolor=FACE_COLOR)
+        FigureCanvasAgg(self.fig)
+        grid = self.fig.add_gridspec(2, 1, height_ratios=(5, 2), hspace=0)
+        self.ax_price = self.fig.add_subplot(grid[0])
+        self.ax_volume = self.fig.add_subplot(grid[1], sharex=self.ax_price)
+        for ax in (self.ax_price, self.ax_volume):
+            ax.set_facecolor(FACE_COLOR)
+            ax.grid(True, color=GRID_COLOR, linestyle="-")
+            ax.set_axisbelow(True)
+            ax.margins(0)
+        self.ax_price.tick_params(labelbottom=False)
+        self.ax_price.set_ylabel("Price ($)")
+        self.ax_volume.set_ylabel("Volume")
+        self.ax_volume.ticklabel_format(axis="y", style="plain", useOffset=False)
+        self.fig.subplots_adjust(left=0.07, right=0.99, top=0.98, bottom=0.08)
+
+        self.wicks = LineCollection([], linewidths=1.0)
+        self.bodies = PolyCollection([], linewidths=0)
+        self.volumes = PolyCollection([], linewidths=0.8, edgecolors=VOLUME_EDGE)
+        self.ax_price.add_collection(self.wicks)
+        self.ax_price.add_collection(self.bodies)
+        self.ax_volume.add_collection(self.volumes)
+        self.title = self.ax_price.text(0.5, 0.9, "", transform=self.ax_price.transAxes, ha="center", fontsize=14)
+
+        # Ось x — номера свечей (без пропусков), подписи — время соответствующей свечи
+        self._labels: list[str] = []
+        self.ax_volume.xaxis.set_major_locator(MaxNLocator(nbins=8, integer=True))
+        self.ax_volume.xaxis.set_major_formatter(FuncFormatter(self._format_x))
+        self.ax_volume.tick_params(axis="x", labelrotation=45)
+
+        x = np.arange(candles, dtype=np.float64)
+        self._body = np.empty((candles, 4, 2))
+        self._body[:, 0, 0] = self._body[:, 1, 0] = x - BODY_WIDTH
+        self._body[:, 2, 0] = self._body[:, 3, 0] = x + BODY_WIDTH
+        self._volume = np.zeros((candles, 4, 2))
+        self._volume[:, 0, 0] = self._volume[:, 1, 0] = x - VOLUME_WIDTH
+        self._volume[:, 2, 0] = self._volume[:, 3, 0] = x + VOLUME_WIDTH
+        self._wick = np.empty((candles, 2, 2))
+        self._wick[:, 0, 0] = self._wick[:, 1, 0] = x
+        self.ax_price.set_xlim(-1, candles)
+
+    def _format_x(self, value, _pos) -> str:
+        i = int(round(value))
+        return self._labels[i] if 0 <= i < len(self._labels) else ""
+
+    def update(self, df: pd.DataFrame, title: str) -> None:
+        """Подставить данные нового кадра (число свечей — как у заготовки)"""
+        o = df["open"].to_numpy(np.float64)
+        h = df["high"].to_numpy(np.float64)
+        l = df["low"].to_numpy(np.float64)
+        c = df["close"].to_numpy(np.float64)
+        v = df["volume"].to_numpy(np.float64)
+
+        self._body[:, 0, 1] = self._body[:, 3, 1] = o
+        self._body[:, 1, 1] = self._body[:, 2, 1] = c
+        self._wick[:, 0, 1] = l
+        self._wick[:, 1, 1] = h
+        self._volume[:, 1, 1] = self._volume[:, 2, 1] = v
+        colors = _COLORS[(c >= o).view(np.int8)]
+
+        self.bodies.set_verts(self._body)
+        self.bodies.set_facecolor(colors)
+        self.wicks.set_segments(self._wick)
+        self.wicks.set_color(colors)
+        self.volumes.set_verts(self._volume)
+        self.volumes.set_facecolor(colors)
+
+        low, high = float(l.min()), float(h.max())
+        pad = (high - low) * 0.03 or abs(high) * 0.01 or 1.0
+        self.ax_price.set_ylim(low - pad, high + pad)
+        self.ax_volume.set_ylim(0, float(v.max()) * 1.05 or 1.0)
+        index = df.index
+        fmt = "%H:%M" if len(index) < 2 or index[-1] - index[0] < pd.Timedelta(days=2) else "%d.%m %H:%M"
+        self._labels = list(index.strftime(fmt))
+        self.title.set_text(title)
+
+
+_local = threading.local()
+
+
+def render_template_figure(df: pd.DataFrame, title: str, figsize=(12, 8)) -> Figure:
+    """Вернуть заготовку под число свечей df с подставленными данными.
+    Заготовки свои у каждого потока/процесса-воркера."""
+    templates = getattr(_local, "templates", None)
+    if templates is None:
+        templates = _local.templates = {}
+    key = (len(df), figsize)
+    template = templates.get(key)
+    if template is None:
+        if len(templates) >= 8:
+            templates.clear()  # раскладок обычно одна-две; не копим фигуры бесконечно
+        template = templates[key] = ChartTemplate(len(df), figsize)
+    template.update(df, title)
+    return template.fig
@@ -0,0 +1,104 @@
+"""Общий асинхронный HTTP-клиент для Bybit и Google.
+
+Один aiohttp.ClientSession на весь процесс: keep-alive пул соединений,
+ограничение одновременных запросов на хост и раздельные таймауты
+на подключение и на чтение ответа.
+"""
+import asyncio
+from urllib.parse import urlsplit
+
+import aiohttp
+
+
+class HttpClient:
+    """Пул соединений с лимитами по хостам"""
+
+    def __init__(
+        self,
+        *,
+        limit: int = 100,
+        limit_per_host: int = 8,
+        host_limits: dict[str, int] | None = None,
+        keepalive_timeout: float = 60.0,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.host_limits = dict(host_limits or {})
+        self.keepalive_timeout = keepalive_timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._session: aiohttp.ClientSession | None = None
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Сессию создаем лениво — она должна жить внутри запущенного event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    def _semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).hostname or ""
+        sem = self._semaphores.get(host)
+        if sem is None:
+            sem = asyncio.Semaphore(self.host_limits.get(host, self.limit_per_host))
+            self._semaphores[host] = sem
+        return sem
+
+    def _timeout(self, connect_timeout: float | None, read_timeout: float | None) -> aiohttp.ClientTimeout:
+        connect = connect_timeout if connect_timeout is not None else self.connect_timeout
+        read = read_timeout if read_timeout is not None else self.read_timeout
+        return aiohttp.ClientTimeout(total=None, connect=connect, sock_connect=connect, sock_read=read)
+
+    async def request_json(
+        self,
+        method: str,
+        url: str,
+        *,
+        params: dict | None = None,
+        json: dict | None = None,
+        headers: dict | None = None,
+        proxy: str | None = None,
+        connect_timeout: float | None = None,
+        read_timeout: float | None = None,
+    ) -> tuple[int, dict | None]:
+        """Выполнить запрос и вернуть (HTTP статус, JSON-тело или None)"""
+        session = self._get_session()
+        async with self._semaphore(url):
+            async with session.request(
+                method,
+                url,
+                params=params,
+                json=json,
+                headers=headers,
+                proxy=proxy,
+                timeout=self._timeout(connect_timeout, read_timeout),
+            ) as resp:
+                try:
+                    data = await resp.json(content_type=None)
+                except (aiohttp.ContentTypeError, ValueError):
+                    data = None
+                return resp.status, data
+
+    async def get_json(self, url: str, **kwargs) -> tuple[int, dict | None]:
+        return await self.request_json("GET", url, **kwargs)
+
+    async def post_json(self, url: str, **kwargs) -> tuple[int, dict | None]:
+        return await self.request_json("POST", url, **kwargs)
+
+    def ws_connect(self, url: str, **kwargs):
+        """Открыть WebSocket через общую сессию (async context manager)"""
+        return self._get_session().ws_connect(url, **kwargs)
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._semaphores.clear()
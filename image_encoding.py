@@ -0,0 +1,95 @@
+"""Кодирование отрисованного графика в байты под конкретного получателя.
+
+Один растр графика кодируется дважды: для показа в Telegram и для модели.
+Формат задается спецификацией "формат[:макс_сторона[:качество]]":
+png, png8 (палитровый PNG, качество = число цветов), jpeg, webp.
+MIME-тип и расширение берутся из фактического формата.
+"""
+from dataclasses import dataclass
+import io
+
+from PIL import Image
+
+_FORMATS = {
+    "png": ("PNG", "image/png", "png"),
+    "png8": ("PNG", "image/png", "png"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+    "webp": ("WEBP", "image/webp", "webp"),
+}
+_ALIASES = {"jpg": "jpeg"}
+
+
+@dataclass(frozen=True)
+class ImageSpec:
+    format: str = "png"
+    max_side: int | None = None
+    quality: int = 85
+
+    @classmethod
+    def parse(cls, spec: str) -> "ImageSpec":
+        """'jpeg:1280:85' → ImageSpec('jpeg', 1280, 85); пустые части — по умолчанию"""
+        parts = [p.strip() for p in spec.lower().split(":")]
+        fmt = _ALIASES.get(parts[0], parts[0]) or "png"
+        if fmt not in _FORMATS:
+            raise ValueError(f"unsupported image format: {parts[0]!r}")
+        max_side = int(parts[1]) if len(parts) > 1 and parts[1] else None
+        default_quality = 64 if fmt == "png8" else 85
+        quality = int(parts[2]) if len(parts) > 2 and parts[2] else default_quality
+        return cls(fmt, max_side, quality)
+
+    def __str__(self) -> str:
+        if self.format == "png":
+            return f"png:{self.max_side}" if self.max_side else "png"
+        return f"{self.format}:{self.max_side or ''}:{self.quality}"
+
+
+@dataclass(frozen=True)
+class EncodedImage:
+    data: bytes
+    mime_type: str
+    extension: str
+    width: int
+    height: int
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+def encode_image(image: Image.Image, spec: ImageSpec) -> EncodedImage:
+    """Уменьшить (если задано) и закодировать RGB-растр по спецификации"""
+    pil_format, mime_type, extension = _FORMATS[spec.format]
+    if spec.max_side and max(image.size) > spec.max_side:
+        image = image.copy()
+        image.thumbnail((spec.max_side, spec.max_side), Image.LANCZOS)
+
+    if spec.format == "png8":
+        image = image.quantize(colors=max(2, min(spec.quality, 256)), method=Image.Quantize.FASTOCTREE)
+    options = {}
+    if spec.format == "png" or spec.format == "png8":
+        options = {"optimize": False, "compress_level": 6}
+    elif spec.format == "jpeg":
+        options = {"quality": spec.quality, "subsampling": 0 if spec.quality >= 90 else 2, "optimize": True}
+    elif spec.format == "webp":
+        options = {"quality": spec.quality, "method": 4}
+
+    buf = io.BytesIO()
+    image.save(buf, format=pil_format, **options)
+    return EncodedImage(buf.getvalue(), mime_type, extension, *image.size)
+
+
+def figure_to_image(fig, dpi: float, pad_inches: float = 0.1) -> Image.Image:
+    """Отрисовать фигуру matplotlib один раз и вернуть RGB-растр,
+    обрезанный по содержимому (как savefig(bbox_inches='tight'))"""
+    fig.set_dpi(dpi)
+    fig.canvas.draw()
+    width, height = fig.canvas.get_width_height()
+    image = Image.frombuffer("RGBA", (width, height), fig.canvas.buffer_rgba(), "raw", "RGBA", 0, 1).convert("RGB")
+    bbox = fig.get_tightbbox(fig.canvas.get_renderer()).padded(pad_inches)
+    left = max(0, int(bbox.x0 * dpi))
+    right = min(width, int(round(bbox.x1 * dpi)))
+    # У matplotlib ось y направлена вверх
+    top = max(0, height - int(round(bbox.y1 * dpi)))
+    bottom = min(height, height - int(bbox.y0 * dpi))
+    if (left, top, right, bottom) != (0, 0, width, height) and right > left and bottom > top:
+        image = image.crop((left, top, right, bottom))
+    return image
@@ -0,0 +1,355 @@
+"""Векторные индикаторы по свечам и краткая числовая сводка для модели.
+
+Все функции работают с numpy-массивами вдоль последней оси, поэтому
+одинаково считают один символ (n,) и пачку символов (symbols, n).
+Рекурсивные ряды (EMA, сглаживание Уайлдера для RSI/ATR) считаются
+блоками в замкнутой форме через cumsum — без цикла по свечам.
+
+IndicatorEngine хранит состояние рекурсивных рядов по каждой паре и при
+появлении одной новой свечи делает шаг O(1) вместо пересчета окна.
+"""
+import math
+from dataclasses import dataclass, field
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from kline_cache import COLUMNS
+
+EMA_SPANS = (20, 50, 200)
+RSI_PERIOD = 14
+ATR_PERIOD = 14
+BB_PERIOD = 20
+BB_WIDTH = 2.0
+VOLUME_PERIOD = 20
+SWING_WINDOW = 3  # свинг — экстремум среди 3 свечей слева и справа
+DAY_MS = 86_400_000
+
+OPEN, HIGH, LOW, CLOSE, VOLUME = (COLUMNS.index(name) for name in ("open", "high", "low", "close", "volume"))
+
+
+# --- векторные ряды ---
+
+def ewm(x, alpha: float) -> np.ndarray:
+    """y[t] = alpha * x[t] + (1 - alpha) * y[t-1], y[0] = x[0].
+
+    Внутри блока рекурсия раскрывается: y[k] = d^(k+1) y[-1] + d^k Σ a d^-j x[j],
+    сумма — один cumsum. Длина блока ограничена так, чтобы d^-k не превышал
+    1e6 (потеря точности ~1e-10), блоков всего n / block."""
+    x = np.asarray(x, dtype=np.float64)
+    n = x.shape[-1]
+    decay = 1.0 - alpha
+    if n == 0 or decay <= 0:
+        return x.copy()
+    out = np.empty_like(x)
+    block = min(n, max(1, int(math.log(1e6) / -math.log(decay))))
+    k = np.arange(block)
+    up, down = decay ** -k, decay ** k
+    prev = x[..., 0]
+    for start in range(0, n, block):
+        chunk = x[..., start:start + block]
+        m = chunk.shape[-1]
+        acc = np.cumsum(chunk * up[:m], axis=-1) * alpha
+        out[..., start:start + m] = down[:m] * (decay * prev[..., None] + acc)
+        prev = out[..., start + m - 1]
+    return out
+
+
+def ema(x, span: int) -> np.ndarray:
+    return ewm(x, 2.0 / (span + 1))
+
+
+def wilder(x, period: int) -> np.ndarray:
+    """Сглаживание Уайлдера (RMA), как в RSI и ATR"""
+    return ewm(x, 1.0 / period)
+
+
+def _gains_losses(close: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    delta = np.diff(close, axis=-1, prepend=close[..., :1])
+    return np.clip(delta, 0, None), np.clip(-delta, 0, None)
+
+
+def _rsi_from(avg_gain, avg_loss) -> np.ndarray:
+    total = avg_gain + avg_loss
+    return np.divide(100.0 * avg_gain, total, out=np.full_like(total, np.nan), where=total > 0)
+
+
+def rsi(close, period: int = RSI_PERIOD) -> np.ndarray:
+    gain, loss = _gains_losses(np.asarray(close, dtype=np.float64))
+    return _rsi_from(wilder(gain, period), wilder(loss, period))
+
+
+def true_range(high, low, close) -> np.ndarray:
+    prev_close = np.concatenate([close[..., :1], close[..., :-1]], axis=-1)
+    return np.maximum(high - low, np.maximum(np.abs(high - prev_close), np.abs(low - prev_close)))
+
+
+def atr(high, low, close, period: int = ATR_PERIOD) -> np.ndarray:
+    return wilder(true_range(high, low, close), period)
+
+
+def rolling_mean(x, window: int) -> np.ndarray:
+    """Скользящее среднее; первые window-1 значений — NaN"""
+    x = np.asarray(x, dtype=np.float64)
+    out = np.full_like(x, np.nan)
+    if x.shape[-1] >= window:
+        csum = np.cumsum(x, axis=-1)
+        csum = np.concatenate([np.zeros_like(csum[..., :1]), csum], axis=-1)
+        out[..., window - 1:] = (csum[..., window:] - csum[..., :-window]) / window
+    return out
+
+
+def rolling_std(x, window: int) -> np.ndarray:
+    """Скользящее СКО (ddof=0); ряд центрируется, чтобы E[x²]-E[x]² не терял точность"""
+    x = np.asarray(x, dtype=np.float64)
+    centered = x - x[..., :1]
+    mean = rolling_mean(centered, window)
+    var = rolling_mean(centered * centered, window) - mean * mean
+    return np.sqrt(np.clip(var, 0, None))
+
+
+def bollinger(close, period: int = BB_PERIOD, width: float = BB_WIDTH) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(нижняя, средняя, верхняя) полосы Боллинджера"""
+    mid = rolling_mean(close, period)
+    dev = rolling_std(close, period) * width
+    return mid - dev, mid, mid + dev
+
+
+def _day_sums(ts: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Нарастающая сумма values с обнулением в начале каждых суток UTC"""
+    day = ts // DAY_MS
+    index = np.arange(len(ts))
+    first = np.maximum.accumulate(np.where(np.r_[True, day[1:] != day[:-1]], index, 0))
+    csum = np.cumsum(values, axis=-1)
+    return csum - csum[..., first] + values[..., first]
+
+
+def vwap(ts, high, low, close, volume) -> np.ndarray:
+    """VWAP с якорем на начало суток UTC"""
+    pv = _day_sums(ts, (high + low + close) / 3 * volume)
+    vol = _day_sums(ts, volume)
+    return np.divide(pv, vol, out=np.full_like(pv, np.nan), where=vol > 0)
+
+
+def swing_points(high, low, k: int = SWING_WINDOW) -> tuple[np.ndarray, np.ndarray]:
+    """Маски свингов: high[i] — максимум, low[i] — минимум среди k свечей по обе стороны.
+    Последние k свечей еще не подтверждены и свингами не считаются."""
+    n = len(high)
+    is_high = np.zeros(n, dtype=bool)
+    is_low = np.zeros(n, dtype=bool)
+    if n >= 2 * k + 1:
+        is_high[k:n - k] = high[k:n - k] >= sliding_window_view(high, 2 * k + 1).max(axis=-1)
+        is_low[k:n - k] = low[k:n - k] <= sliding_window_view(low, 2 * k + 1).min(axis=-1)
+    return is_high, is_low
+
+
+@dataclass(frozen=True)
+class Zone:
+    low: float
+    high: float
+    touches: int
+
+    @property
+    def mid(self) -> float:
+        return (self.low + self.high) / 2
+
+
+def sr_zones(levels: np.ndarray, width: float) -> list[Zone]:
+    """Сгруппировать уровни свингов в зоны по ценовой сетке с шагом width.
+    Сетка, а не склейка соседей: цепочка близких уровней не растягивается в одну огромную зону."""
+    if not len(levels) or not width > 0:
+        return []
+    levels = np.sort(levels)
+    _, starts, counts = np.unique(np.floor(levels / width), return_index=True, return_counts=True)
+    return [Zone(float(levels[s]), float(levels[s + c - 1]), int(c)) for s, c in zip(starts, counts)]
+
+
+# --- состояние рекурсивных рядов ---
+
+@dataclass(frozen=True)
+class RecursiveState:
+    """Значения рекурсивных рядов после свечи ts — достаточно для шага на следующую"""
+    ts: int
+    close: float
+    ema: tuple[float, ...]
+    avg_gain: float
+    avg_loss: float
+    atr: float
+    day: int
+    day_pv: float
+    day_volume: float
+
+    @property
+    def rsi(self) -> float:
+        total = self.avg_gain + self.avg_loss
+        return 100.0 * self.avg_gain / total if total > 0 else math.nan
+
+    @property
+    def vwap(self) -> float:
+        return self.day_pv / self.day_volume if self.day_volume > 0 else math.nan
+
+    def step(self, ts: int, row) -> "RecursiveState":
+        """Состояние после следующей свечи row (open, high, low, close, volume)"""
+        high, low, close, volume = float(row[HIGH]), float(row[LOW]), float(row[CLOSE]), float(row[VOLUME])
+        delta = close - self.close
+        tr = max(high - low, abs(high - self.close), abs(low - self.close))
+        day = ts // DAY_MS
+        pv = (high + low + close) / 3 * volume
+        same_day = day == self.day
+        return RecursiveState(
+            ts=int(ts),
+            close=close,
+            ema=tuple(value + 2.0 / (span + 1) * (close - value) for span, value in zip(EMA_SPANS, self.ema)),
+            avg_gain=self.avg_gain + (max(delta, 0.0) - self.avg_gain) / RSI_PERIOD,
+            avg_loss=self.avg_loss + (max(-delta, 0.0) - self.avg_loss) / RSI_PERIOD,
+            atr=self.atr + (tr - self.atr) / ATR_PERIOD,
+            day=day,
+            day_pv=self.day_pv + pv if same_day else pv,
+            day_volume=self.day_volume + volume if same_day else volume,
+        )
+
+
+def recursive_state(ts: np.ndarray, ohlcv: np.ndarray, end: int | None = None) -> RecursiveState:
+    """Посчитать рекурсивные ряды по свечам [0, end) векторно и вернуть состояние после последней"""
+    ts, ohlcv = ts[:end], ohlcv[:end]
+    high, low, close, volume = ohlcv[:, HIGH], ohlcv[:, LOW], ohlcv[:, CLOSE], ohlcv[:, VOLUME]
+    gain, loss = _gains_losses(close)
+    day_ts = ts[-1:] // DAY_MS
+    today = ts // DAY_MS == day_ts
+    return RecursiveState(
+        ts=int(ts[-1]),
+        close=float(close[-1]),
+        ema=tuple(float(ema(close, span)[-1]) for span in EMA_SPANS),
+        avg_gain=float(wilder(gain, RSI_PERIOD)[-1]),
+        avg_loss=float(wilder(loss, RSI_PERIOD)[-1]),
+        atr=float(atr(high, low, close, ATR_PERIOD)[-1]),
+        day=int(day_ts[0]),
+        day_pv=float(((high + low + close) / 3 * volume)[today].sum()),
+        day_volume=float(volume[today].sum()),
+    )
+
+
+# --- сводка ---
+
+def _price(value: float) -> str:
+    return "—" if value is None or math.isnan(value) else f"{value:.6g}"
+
+
+@dataclass
+class IndicatorSnapshot:
+    symbol: str
+    timeframe: str
+    ts: int
+    close: float
+    state: RecursiveState
+    bb_lower: float
+    bb_mid: float
+    bb_upper: float
+    volume_ratio: float
+    swing_high: float | None
+    swing_low: float | None
+    resistance: list[Zone] = field(default_factory=list)
+    support: list[Zone] = field(default_factory=list)
+
+    @property
+    def atr_pct(self) -> float:
+        return self.state.atr / self.close * 100 if self.close else math.nan
+
+    @property
+    def bb_position(self) -> float:
+        """Где цена внутри полос: 0 — нижняя, 1 — верхняя"""
+        width = self.bb_upper - self.bb_lower
+        return (self.close - self.bb_lower) / width if width > 0 else math.nan
+
+    def to_text(self) -> str:
+        """Компактный текст для запроса к модели (цифры по последней свече)"""
+        s = self.state
+        emas = " / ".join(f"EMA{span} {_price(value)}" for span, value in zip(EMA_SPANS, s.ema))
+        above = sum(self.close > value for value in s.ema)
+        vwap_diff = (self.close / s.vwap - 1) * 100 if s.vwap and not math.isnan(s.vwap) else math.nan
+        zones = lambda items: ", ".join(f"{_price(z.low)}–{_price(z.high)} ({z.touches})" for z in items) or "нет"
+        minute = s.ts // 60_000
+        lines = [
+            f"Индикаторы {self.symbol} {self.timeframe}m на свече {minute // 60 % 24:02d}:{minute % 60:02d} UTC, цена {_price(self.close)}",
+            f"{emas} (цена выше {above} из {len(EMA_SPANS)})",
+            f"RSI{RSI_PERIOD} {s.rsi:.1f} | ATR{ATR_PERIOD} {_price(s.atr)} ({self.atr_pct:.2f}%)",
+            f"BB{BB_PERIOD}: {_price(self.bb_lower)}–{_price(self.bb_upper)}, позиция {self.bb_position:.2f}, "
+            f"ширина {(self.bb_upper - self.bb_lower) / self.close * 100:.2f}%",
+            f"VWAP дня {_price(s.vwap)} (цена {vwap_diff:+.2f}%) | объем {self.volume_ratio:.1f}x от среднего за {VOLUME_PERIOD}",
+            f"Свинги: хай {_price(self.swing_high)}, лоу {_price(self.swing_low)}",
+            f"Сопротивления: {zones(self.resistance)}; поддержки: {zones(self.support)} (в скобках — касания)",
+        ]
+        return "\n".join(lines)
+
+
+def build_snapshot(symbol: str, timeframe: str, ts: np.ndarray, ohlcv: np.ndarray,
+                   state: RecursiveState, max_zones: int = 2) -> IndicatorSnapshot:
+    """Сводка по последней свече: рекурсивные ряды из state, окна — по хвосту свечей"""
+    high, low, close, volume = ohlcv[:, HIGH], ohlcv[:, LOW], ohlcv[:, CLOSE], ohlcv[:, VOLUME]
+    last = float(close[-1])
+    tail = close[-BB_PERIOD:]
+    mid, dev = float(tail.mean()), float(tail.std()) * BB_WIDTH
+    prev_volume = volume[-VOLUME_PERIOD - 1:-1]
+    volume_ratio = float(volume[-1] / prev_volume.mean()) if len(prev_volume) and prev_volume.mean() > 0 else math.nan
+
+    is_high, is_low = swing_points(high, low)
+    highs, lows = high[is_high], low[is_low]
+    width = state.atr if state.atr > 0 else last * 0.005
+    zones = sr_zones(np.concatenate([highs, lows]), width)
+    resistance = sorted((z for z in zones if z.low > last), key=lambda z: z.low)[:max_zones]
+    support = sorted((z for z in zones if z.high < last), key=lambda z: -z.high)[:max_zones]
+    return IndicatorSnapshot(
+        symbol=symbol,
+        timeframe=timeframe,
+        ts=int(ts[-1]),
+        close=last,
+        state=state,
+        bb_lower=mid - dev,
+        bb_mid=mid,
+        bb_upper=mid + dev,
+        volume_ratio=volume_ratio,
+        swing_high=float(highs[-1]) if len(highs) else None,
+        swing_low=float(lows[-1]) if len(lows) else None,
+        resistance=resistance,
+        support=support,
+    )
+
+
+def frame_arrays(df) -> tuple[np.ndarray, np.ndarray]:
+    """(метки времени в мс, ohlcv) из DataFrame свечей"""
+    ts = df.index.values.astype("datetime64[ms]").astype(np.int64)
+    return ts, df[COLUMNS].to_numpy(dtype=np.float64)
+
+
+class IndicatorEngine:
+    """Сводки индикаторов по парам (symbol, timeframe).
+
+    Последняя свеча окна может быть незакрытой, поэтому хранится состояние
+    по предпоследнюю свечу. Если с прошлого вызова пришла одна новая свеча,
+    состояние сдвигается одним шагом; если окно то же — переиспользуется;
+    иначе (первый вызов, пропуск свечей) — полный векторный пересчет.
+    """
+
+    def __init__(self):
+        self._states: dict[tuple[str, str], RecursiveState] = {}
+        self.full_updates = 0
+        self.incremental_updates = 0
+
+    def snapshot(self, symbol: str, timeframe: str, ts: np.ndarray, ohlcv: np.ndarray) -> IndicatorSnapshot | None:
+        n = len(ts)
+        if n < 2:
+            return None
+        key = (symbol, timeframe)
+        base = self._states.get(key)
+        if base is not None and n >= 3 and base.ts == ts[-3]:
+            base = base.step(int(ts[-2]), ohlcv[-2])  # предыдущая свеча закрылась
+        if base is None or base.ts != ts[-2]:
+            base = recursive_state(ts, ohlcv, -1)
+            self.full_updates += 1
+        else:
+            self.incremental_updates += 1
+        self._states[key] = base
+        return build_snapshot(symbol, timeframe, ts, ohlcv, base.step(int(ts[-1]), ohlcv[-1]))
+
+    def snapshot_frame(self, symbol: str, timeframe: str, df) -> IndicatorSnapshot | None:
+        return self.snapshot(symbol, timeframe, *frame_arrays(df))
@@ -0,0 +1,171 @@
+"""Инкрементальный кэш свечей Bybit.
+
+Для каждой пары (symbol, interval) держим кольцевой буфер фиксированного
+размера и догружаем только свечи новее последней сохраненной. Окно
+отдается копией: буфер меняется на месте (текущая свеча, перенос в начало,
+полная перезагрузка), а вызывающий держит кадр через await'ы.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+# Длительность свечи Bybit в миллисекундах (для M берем минимальный месяц)
+INTERVAL_MS = {
+    **{str(m): m * 60_000 for m in (1, 3, 5, 15, 30, 60, 120, 240, 360, 720)},
+    "D": 86_400_000,
+    "W": 7 * 86_400_000,
+    "M": 28 * 86_400_000,
+}
+
+def parse_bybit_klines(klines: list) -> tuple[np.ndarray, np.ndarray]:
+    """Разобрать result.list Bybit одним векторным шагом.
+
+    Bybit отдает строки [start, open, high, low, close, volume, turnover]
+    строками и от новых к старым; разворот делается срезом. Берем первые
+    шесть полей каждой строки (лишние поля не сдвигают столбцы), строки
+    короче пропускаем; метки времени в мс точно представимы в float64.
+    """
+    rows = [row[:6] for row in klines if len(row) >= 6]
+    if len(rows) != len(klines):
+        print(f"[klines] skipped {len(klines) - len(rows)} malformed rows")
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty((0, len(COLUMNS)), dtype=np.float64)
+    raw = np.array(rows, dtype=np.float64)[::-1]
+    return raw[:, 0].astype(np.int64), np.ascontiguousarray(raw[:, 1:6])
+
+
+# fetch(symbol, interval, limit, start_ms) -> (timestamps int64, ohlcv float64 [n, 5]) по возрастанию времени
+KlineFetcher = Callable[[str, str, int, int | None], Awaitable[tuple[np.ndarray, np.ndarray] | None]]
+
+
+class KlineRing:
+    """Кольцевой буфер свечей с непрерывным окном последних capacity строк.
+
+    Буфер выделен на 2 * capacity строк: запись идет подряд, а при
+    достижении конца последние capacity строк переносятся в начало.
+    Так окно всегда лежит в памяти одним куском и отдается срезом.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._ts = np.zeros(capacity * 2, dtype=np.int64)
+        self._data = np.zeros((capacity * 2, len(COLUMNS)), dtype=np.float64)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    @property
+    def last_ts(self) -> int | None:
+        return int(self._ts[self._end - 1]) if len(self) else None
+
+    def clear(self) -> None:
+        self._start = self._end = 0
+
+    def _push(self, ts: np.ndarray, data: np.ndarray) -> None:
+        n = len(ts)
+        if n >= self.capacity:
+            ts, data, n = ts[-self.capacity:], data[-self.capacity:], self.capacity
+            self._start = self._end = 0
+        if self._end + n > len(self._ts):
+            keep = min(len(self), self.capacity - n)
+            self._ts[:keep] = self._ts[self._end - keep:self._end]
+            self._data[:keep] = self._data[self._end - keep:self._end]
+            self._start, self._end = 0, keep
+        self._ts[self._end:self._end + n] = ts
+        self._data[self._end:self._end + n] = data
+        self._end += n
+        self._start = max(self._start, self._end - self.capacity)
+
+    def merge(self, ts: np.ndarray, data: np.ndarray) -> int:
+        """Влить свечи (по возрастанию времени); вернуть число новых свечей"""
+        last = self.last_ts
+        if last is not None:
+            # Текущая (незакрытая) свеча обновляется на месте
+            same = ts == last
+            if same.any():
+                self._data[self._end - 1] = data[same][-1]
+            newer = ts > last
+            ts, data = ts[newer], data[newer]
+        if len(ts):
+            self._push(ts, data)
+        return len(ts)
+
+    def frame(self, limit: int | None = None) -> pd.DataFrame:
+        """DataFrame с копией последних limit свечей: последующие merge/clear его не меняют"""
+        n = len(self) if limit is None else min(limit, len(self))
+        ts = self._ts[self._end - n:self._end].copy()
+        data = self._data[self._end - n:self._end].copy()
+        index = pd.DatetimeIndex(ts.view('datetime64[ms]'), name='datetime')
+        return pd.DataFrame(data, index=index, columns=COLUMNS, copy=False)
+
+
+class KlineCache:
+    """Кэш свечей по (symbol, interval) с дозагрузкой дельты"""
+
+    def __init__(self, fetch: KlineFetcher, *, capacity: int = 1000, min_refresh: float = 1.0):
+        self.fetch = fetch
+        self.capacity = capacity
+        self.min_refresh = min_refresh
+        self._rings: dict[tuple[str, str], KlineRing] = {}
+        self._locks: dict[tuple[str, str], asyncio.Lock] = {}
+        self._fetched_at: dict[tuple[str, str], float] = {}
+        # Пары, которые обновляются потоком (WebSocket) и не требуют REST-опроса
+        self.live: set[tuple[str, str]] = set()
+        self.full_fetches = 0
+        self.delta_fetches = 0
+
+    async def _refresh(self, key: tuple[str, str], ring: KlineRing, limit: int) -> None:
+        symbol, interval = key
+        last = ring.last_ts
+        step = INTERVAL_MS.get(interval)
+        missing = None
+        if last is not None and step:
+            missing = int((time.time() * 1000 - last) // step) + 1
+        if last is None or missing is None or missing >= self.capacity or len(ring) < limit:
+            # Кэш пуст, слишком старый или короче запрошенного окна — полная загрузка
+            result = await self.fetch(symbol, interval, min(max(limit, len(ring)), self.capacity), None)
+            if result is not None:
+                ring.clear()
+                ring.merge(*result)
+                self.full_fetches += 1
+            return
+        result = await self.fetch(symbol, interval, missing + 1, last)
+        if result is not None:
+            ring.merge(*result)
+            self.delta_fetches += 1
+
+    def ring(self, symbol: str, interval: str) -> KlineRing:
+        return self._rings.setdefault((symbol, interval), KlineRing(self.capacity))
+
+    def push(self, symbol: str, interval: str, ts: np.ndarray, data: np.ndarray) -> int:
+        """Влить свечи, пришедшие из потока; вернуть число новых"""
+        return self.ring(symbol, interval).merge(ts, data)
+
+    async def backfill(self, symbol: str, interval: str, limit: int = 200) -> None:
+        """Принудительно догрузить пропущенные свечи через REST"""
+        key = (symbol, interval)
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            await self._refresh(key, self.ring(symbol, interval), limit)
+            self._fetched_at[key] = time.monotonic()
+
+    async def get(self, symbol: str, interval: str, limit: int = 200) -> pd.DataFrame | None:
+        """Вернуть последние limit свечей, догрузив с Bybit только новые"""
+        key = (symbol, interval)
+        ring = self.ring(symbol, interval)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # Параллельные запросы одной пары делят одну загрузку
+            fresh = key in self.live or time.monotonic() - self._fetched_at.get(key, 0.0) < self.min_refresh
+            if not (fresh and len(ring) >= min(limit, self.capacity)):
+                await self._refresh(key, ring, limit)
+                self._fetched_at[key] = time.monotonic()
+        if not len(ring):
+            return None
+        return ring.frame(limit)
@@ -0,0 +1,182 @@
+"""Поток свечей Bybit v5 через публичный WebSocket.
+
+Подписывается на kline.<interval>.<symbol>, вливает обновления в KlineCache
+и сообщает о закрытии свечи (confirm=true). После каждого (пере)подключения
+пропущенные свечи догружаются через REST. URL настраивается, поэтому поток
+можно проверить на локальном фейковом WebSocket-сервере.
+"""
+import asyncio
+import json
+from typing import Awaitable, Callable
+
+import aiohttp
+import numpy as np
+
+from http_client import HttpClient
+from kline_cache import KlineCache
+
+BYBIT_WS_URL = "wss://stream.bybit.com/v5/public/linear"
+
+# callback(symbol, interval, candle_start_ms) — вызывается при закрытии свечи
+CloseListener = Callable[[str, str, int], Awaitable[None]]
+
+
+class BybitKlineStream:
+    """Подписка на свечи с переподключением и догрузкой пропусков"""
+
+    def __init__(
+        self,
+        http_client: HttpClient,
+        cache: KlineCache,
+        *,
+        url: str = BYBIT_WS_URL,
+        backfill_limit: int = 200,
+        ping_interval: float = 20.0,
+        max_backoff: float = 60.0,
+    ):
+        self.http_client = http_client
+        self.cache = cache
+        self.url = url
+        self.backfill_limit = backfill_limit
+        self.ping_interval = ping_interval
+        self.max_backoff = max_backoff
+        self.keys: set[tuple[str, str]] = set()
+        self.connected = False
+        self.reconnects = 0
+        self._listeners: list[CloseListener] = []
+        # Задачи слушателей держим до завершения: иначе их может собрать GC, а ошибки теряются
+        self._listener_tasks: set[asyncio.Task] = set()
+        self._close_events: dict[tuple[str, str], asyncio.Event] = {}
+        self._ws: aiohttp.ClientWebSocketResponse | None = None
+        self._task: asyncio.Task | None = None
+
+    # --- подписки и события ---
+
+    def add_listener(self, callback: CloseListener) -> None:
+        self._listeners.append(callback)
+
+    async def subscribe(self, symbol: str, interval: str) -> None:
+        key = (symbol, interval)
+        if key in self.keys:
+            return
+        self.keys.add(key)
+        if self._ws is not None and not self._ws.closed:
+            await self._ws.send_json({"op": "subscribe", "args": [f"kline.{interval}.{symbol}"]})
+            await self.cache.backfill(symbol, interval, self.backfill_limit)
+            self.cache.live.add(key)
+
+    async def unsubscribe(self, symbol: str, interval: str) -> None:
+        """Отписаться от пары, которую больше никто не слушает; кэш пары снова обновляется через REST"""
+        key = (symbol, interval)
+        if key not in self.keys:
+            return
+        self.keys.discard(key)
+        self.cache.live.discard(key)
+        if self._ws is not None and not self._ws.closed:
+            await self._ws.send_json({"op": "unsubscribe", "args": [f"kline.{interval}.{symbol}"]})
+
+    async def wait_closed(self, keys, timeout: float | None = None) -> tuple[str, str] | None:
+        """Дождаться закрытия свечи по любой из пар; None — по таймауту"""
+        waiters = {
+            asyncio.ensure_future(self._close_events.setdefault(key, asyncio.Event()).wait()): key
+            for key in keys
+        }
+        if not waiters:
+            await asyncio.sleep(timeout or 0)
+            return None
+        done, pending = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        return waiters[next(iter(done))] if done else None
+
+    def _emit_closed(self, symbol: str, interval: str, start_ms: int) -> None:
+        event = self._close_events.pop((symbol, interval), None)
+        if event is not None:
+            event.set()
+        for callback in self._listeners:
+            task = asyncio.create_task(callback(symbol, interval, start_ms))
+            self._listener_tasks.add(task)
+            task.add_done_callback(self._listener_done)
+
+    def _listener_done(self, task: asyncio.Task) -> None:
+        self._listener_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[feed] close listener failed: {task.exception()!r}")
+
+    # --- обработка сообщений ---
+
+    def _handle(self, message: dict) -> None:
+        topic = message.get("topic") or ""
+        if not topic.startswith("kline."):
+            return
+        _, interval, symbol = topic.split(".", 2)
+        for item in message.get("data") or []:
+            start_ms = int(item["start"])
+            row = np.array([[float(item[c]) for c in ("open", "high", "low", "close", "volume")]])
+            self.cache.push(symbol, interval, np.array([start_ms], dtype=np.int64), row)
+            if item.get("confirm"):
+                self._emit_closed(symbol, interval, start_ms)
+
+    async def _session(self) -> None:
+        async with self.http_client.ws_connect(self.url, heartbeat=None, receive_timeout=self.ping_interval * 3) as ws:
+            self._ws = ws
+            if self.keys:
+                await ws.send_json({"op": "subscribe", "args": [f"kline.{i}.{s}" for s, i in self.keys]})
+            # Догружаем через REST все, что пропустили, пока соединения не было
+            for symbol, interval in list(self.keys):
+                await self.cache.backfill(symbol, interval, self.backfill_limit)
+                self.cache.live.add((symbol, interval))
+            self.connected = True
+            print(f"[feed] connected to {self.url}, streams: {len(self.keys)}")
+
+            pinger = asyncio.create_task(self._ping(ws))
+            try:
+                async for msg in ws:
+                    if msg.type == aiohttp.WSMsgType.TEXT:
+                        try:
+                            self._handle(json.loads(msg.data))
+                        except (ValueError, KeyError, TypeError) as e:
+                            print(f"[feed] bad message: {e}")
+                    elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                        break
+            finally:
+                pinger.cancel()
+                self._ws = None
+                self.connected = False
+                # Пока потока нет, кэш снова обновляется через REST
+                self.cache.live.difference_update(self.keys)
+
+    async def _ping(self, ws: aiohttp.ClientWebSocketResponse) -> None:
+        while not ws.closed:
+            await asyncio.sleep(self.ping_interval)
+            await ws.send_json({"op": "ping"})
+
+    async def run(self) -> None:
+        """Держать соединение, переподключаясь с экспоненциальной паузой"""
+        backoff = 1.0
+        while True:
+            try:
+                await self._session()
+                backoff = 1.0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[feed] connection error: {e}")
+            self.reconnects += 1
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        for task in list(self._listener_tasks):
+            task.cancel()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
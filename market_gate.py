@@ -0,0 +1,83 @@
+"""Локальный фильтр перед автоанализом: стоит ли тратить запрос к модели.
+
+Текущая сводка индикаторов сравнивается со сводкой, по которой был получен
+последний сигнал пары. Анализ нужен, если цена ушла на заметную долю ATR,
+волатильность выросла, пробит уровень (свинг или зона S/R) или прошлый
+результат устарел. Иначе прошлый сигнал остается в силе, а квота Gemini
+не тратится.
+"""
+import math
+from dataclasses import dataclass, field
+
+from indicators import IndicatorSnapshot
+
+
+@dataclass
+class GateDecision:
+    analyze: bool
+    reason: str
+    move_atr: float = math.nan  # смещение цены от опорной свечи в ATR
+    atr_ratio: float = math.nan  # ATR сейчас / ATR на опорной свече
+
+    def describe(self) -> str:
+        return f"{self.reason}, сдвиг {self.move_atr:.2f} ATR, ATR x{self.atr_ratio:.2f}"
+
+
+@dataclass
+class GateStats:
+    checked: int = 0
+    skipped: int = 0
+    saved: int = 0  # пропуски на новой свече — без фильтра это был бы запрос к Gemini
+    reasons: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def skipped_ratio(self) -> float:
+        return self.skipped / self.checked if self.checked else 0.0
+
+
+class ChangeGate:
+    """Решение "анализировать / оставить прошлый результат" по смещению цены, росту ATR и пробою уровней"""
+
+    def __init__(self, *, min_move_atr: float = 0.5, atr_expansion: float = 1.25, max_age: float = 1800.0):
+        self.min_move_atr = min_move_atr
+        self.atr_expansion = atr_expansion
+        self.max_age = max_age
+        self.stats = GateStats()
+
+    @staticmethod
+    def _level_break(reference: IndicatorSnapshot, current: IndicatorSnapshot) -> bool:
+        """Цена закрылась по другую сторону уровня, который был у опорной свечи"""
+        up = [z.high for z in reference.resistance] + [reference.swing_high]
+        down = [z.low for z in reference.support] + [reference.swing_low]
+        return (
+            any(level is not None and reference.close <= level < current.close for level in up)
+            or any(level is not None and current.close < level <= reference.close for level in down)
+        )
+
+    def _decide(self, reference: IndicatorSnapshot | None, current: IndicatorSnapshot) -> GateDecision:
+        if reference is None:
+            return GateDecision(True, "no_reference")
+        atr = reference.state.atr
+        move = abs(current.close - reference.close) / atr if atr > 0 else math.inf
+        ratio = current.state.atr / atr if atr > 0 else math.inf
+        decision = lambda analyze, reason: GateDecision(analyze, reason, move, ratio)
+        if (current.ts - reference.ts) / 1000 >= self.max_age:
+            return decision(True, "stale")
+        if move >= self.min_move_atr:
+            return decision(True, "displacement")
+        if ratio >= self.atr_expansion:
+            return decision(True, "atr_expansion")
+        if self._level_break(reference, current):
+            return decision(True, "level_break")
+        return decision(False, "unchanged")
+
+    def check(self, reference: IndicatorSnapshot | None, current: IndicatorSnapshot) -> GateDecision:
+        """reference — сводка, по которой получен последний результат пары (None — его нет)"""
+        result = self._decide(reference, current)
+        self.stats.checked += 1
+        self.stats.reasons[result.reason] = self.stats.reasons.get(result.reason, 0) + 1
+        if not result.analyze:
+            self.stats.skipped += 1
+            if reference is not None and current.ts != reference.ts:
+                self.stats.saved += 1
+        return result
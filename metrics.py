@@ -0,0 +1,322 @@
+"""Метрики в формате Prometheus и трассировка горячих путей.
+
+Без внешних зависимостей: счетчики, гистограммы и гейджи (значение
+читается функцией в момент выдачи) складываются в общий реестр и
+отдаются текстом на /metrics. Трассировка — дерево спанов через
+contextvars: span() внутри span() становится дочерним, корневой спан
+по завершении попадает в последние трассы (свой буфер на каждое имя
+корневого спана) и печатается одной строкой.
+Длительность каждого спана также пишется в гистограмму trace_span_seconds.
+"""
+import asyncio
+import bisect
+import contextvars
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable
+
+from aiohttp import web
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = (4096, 16384, 32768, 65536, 131072, 262144, 524288, 1048576, 4194304)
+TOKEN_BUCKETS = (64, 256, 512, 1024, 2048, 4096, 8192, 16384, 65536)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels_text(self.labels, key)} {value:g}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Значение читается функцией в момент выдачи метрик"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable[[], float]):
+        super().__init__(name, help)
+        self.read = read
+
+    def render(self) -> list[str]:
+        try:
+            value = float(self.read())
+        except Exception:
+            value = math.nan
+        return super().render() + [f"{self.name} {value:g}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}  # key → [counts по корзинам + inf, sum, count]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return series[2] if series else 0
+
+    def quantile(self, q: float, **labels) -> float | None:
+        """Оценка квантиля по корзинам (линейно внутри корзины)"""
+        series = self._series.get(self._key(labels))
+        if not series or not series[2]:
+            return None
+        rank = q * series[2]
+        seen = 0
+        for i, n in enumerate(series[0]):
+            if seen + n >= rank and n:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                le = "+Inf" if bound == math.inf else f"{bound:g}"
+                extra = f'le="{le}"'
+                lines.append(f"{self.name}_bucket{_labels_text(self.labels, key, extra)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labels, key)} {total:g}")
+            lines.append(f"{self.name}_count{_labels_text(self.labels, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, _Metric] = {}
+
+    def _add(self, metric: _Metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, read: Callable[[], float]) -> Gauge:
+        return self._add(Gauge(name, help, read))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+span_seconds = registry.histogram("trace_span_seconds", "Длительность спанов трассировки", ("span",))
+loop_lag_seconds = registry.histogram(
+    "event_loop_lag_seconds", "Задержка event loop (опоздание таймера)",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+
+# --- трассировка ---
+
+class Span:
+    __slots__ = ("name", "attrs", "start", "end", "children")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end: float | None = None
+        self.children: list["Span"] = []
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "attrs": self.attrs,
+            "ms": round(self.duration * 1000, 1),
+            "children": [child.to_dict() for child in self.children],
+        }
+
+    def summary(self) -> str:
+        """'analyze 11.2 s (gemini 11.1 s)' — дерево одной строкой"""
+        seconds = self.duration
+        text = f"{self.name} {seconds:.1f} s" if seconds >= 1 else f"{self.name} {seconds * 1000:.0f} ms"
+        if self.children:
+            text += " (" + " | ".join(child.summary() for child in self.children) + ")"
+        return text
+
+
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar("current_span", default=None)
+TRACE_LIMIT = 50
+# Последние трассы — отдельно по имени корневого спана, чтобы разовые
+# запросы (анализ фото) не вытесняли проходы автоанализа
+trace_buffers: dict[str, deque[Span]] = {}
+
+
+def recent_traces(root: str) -> deque[Span]:
+    """Последние завершенные трассы с корневым спаном root"""
+    buffer = trace_buffers.get(root)
+    if buffer is None:
+        buffer = trace_buffers[root] = deque(maxlen=TRACE_LIMIT)
+    return buffer
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Спан трассировки; вложенные span() становятся дочерними"""
+    parent = _current_span.get()
+    current = Span(name, attrs)
+    if parent is not None:
+        parent.children.append(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _current_span.reset(token)
+        span_seconds.observe(current.duration, span=name)
+        if parent is None:
+            recent_traces(name).append(current)
+            label = " ".join(f"{k}={v}" for k, v in attrs.items())
+            print(f"[trace] {label} {current.summary()}")
+
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+
+# --- event loop lag ---
+
+async def monitor_loop_lag(interval: float = 0.5) -> None:
+    """Мерить, насколько позже запланированного просыпается таймер"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        loop_lag_seconds.observe(max(0.0, time.perf_counter() - started - interval))
+
+
+_lag_task: asyncio.Task | None = None
+
+
+def start_loop_lag_monitor(interval: float = 0.5) -> None:
+    """Запустить замер лага независимо от того, поднят ли HTTP /metrics"""
+    global _lag_task
+    if _lag_task is None or _lag_task.done():
+        _lag_task = asyncio.create_task(monitor_loop_lag(interval))
+
+
+async def stop_loop_lag_monitor() -> None:
+    global _lag_task
+    if _lag_task is not None:
+        _lag_task.cancel()
+        try:
+            await _lag_task
+        except asyncio.CancelledError:
+            pass
+        _lag_task = None
+
+
+# --- HTTP ---
+
+class MetricsServer:
+    """Локальный HTTP: /metrics (Prometheus) и /traces (последние трассы JSON)"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9100):
+        self.host = host
+        self.port = port
+        self._runner: web.AppRunner | None = None
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def _traces(self, request: web.Request) -> web.Response:
+        """Трассы по корневому спану; ?root=auto_analysis — только один буфер"""
+        root = request.query.get("root")
+        buffers = {root: trace_buffers.get(root, ())} if root else trace_buffers
+        return web.json_response({name: [trace.to_dict() for trace in buffer] for name, buffer in buffers.items()})
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        app.router.add_get("/traces", self._traces)
+        self._runner = web.AppRunner(app, handle_signals=False)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        print(f"[metrics] listening on {self.host}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,206 @@
+"""Очередь анализа фото от пользователей.
+
+Хендлер не ждет модель: фото становится задачей в очереди, пользователь
+сразу получает "в очереди #N", а результат потом подставляется в это же
+сообщение. Задачи выполняют несколько воркеров, у каждого пользователя
+свой лимит частоты и число задач в очереди; одно и то же фото, присланное
+повторно, пока идет анализ, не запускает второй вызов модели.
+"""
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+
+class PhotoRateLimited(Exception):
+    """Пользователь превысил лимит; retry_after — через сколько секунд можно снова"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"rate limited, retry after {retry_after:.0f} s")
+        self.retry_after = retry_after
+
+
+class PhotoQueueFull(Exception):
+    """Очередь заполнена"""
+
+
+@dataclass
+class PhotoJob:
+    key: str
+    user_id: int
+    file_id: str
+    seq: int
+    created_at: float = field(default_factory=time.monotonic)
+    started_at: float = 0.0
+    waiters: list[tuple[int, int]] = field(default_factory=list)  # (chat_id, message_id) сообщений-квитанций
+    result: str | None = None
+
+
+@dataclass
+class PhotoQueueStats:
+    submitted: int = 0
+    deduplicated: int = 0
+    rejected: int = 0
+    processed: int = 0
+    failed: int = 0
+    total_wait: float = 0.0
+    total_run: float = 0.0
+
+    @property
+    def finished(self) -> int:
+        return self.processed + self.failed
+
+    @property
+    def avg_wait(self) -> float:
+        return self.total_wait / self.finished if self.finished else 0.0
+
+    @property
+    def avg_run(self) -> float:
+        return self.total_run / self.finished if self.finished else 0.0
+
+
+class PhotoQueue:
+    """Ограниченная очередь с воркерами, лимитами на пользователя и дедупликацией"""
+
+    def __init__(
+        self,
+        process: Callable[[PhotoJob], Awaitable[str]],
+        deliver: Callable[[PhotoJob, tuple[int, int], str], Awaitable[None]],
+        *,
+        workers: int = 4,
+        max_pending: int = 100,
+        user_limit: int = 5,
+        user_window: float = 60.0,
+        user_pending: int = 2,
+    ):
+        self.process = process
+        self.deliver = deliver
+        self.workers = workers
+        self.max_pending = max_pending
+        self.user_limit = user_limit
+        self.user_window = user_window
+        self.user_pending = user_pending
+        self.stats = PhotoQueueStats()
+        self._queue: asyncio.Queue[PhotoJob] = asyncio.Queue()
+        self._active: dict[str, PhotoJob] = {}
+        self._user_history: dict[int, deque[float]] = {}
+        self._user_jobs: dict[int, int] = {}
+        self._seq = 0
+        self._taken = 0
+        self._busy = 0
+        self._tasks: list[asyncio.Task] = []
+
+    # --- постановка ---
+
+    def _check_user(self, user_id: int) -> None:
+        if self._user_jobs.get(user_id, 0) >= self.user_pending:
+            raise PhotoRateLimited(0)
+        history = self._user_history.setdefault(user_id, deque())
+        now = time.monotonic()
+        while history and history[0] <= now - self.user_window:
+            history.popleft()
+        if len(history) >= self.user_limit:
+            raise PhotoRateLimited(history[0] + self.user_window - now)
+
+    def submit(self, user_id: int, key: str, file_id: str) -> tuple[PhotoJob, int]:
+        """Поставить фото в очередь; вернуть задачу и номер в очереди (0 — уже в работе).
+        То же фото, пока его анализ не закончен, присоединяется к существующей задаче."""
+        job = self._active.get(key)
+        if job is not None:
+            self.stats.deduplicated += 1
+            return job, self.position(job)
+        try:
+            self._check_user(user_id)
+            if self._queue.qsize() >= self.max_pending:
+                raise PhotoQueueFull()
+        except (PhotoRateLimited, PhotoQueueFull):
+            self.stats.rejected += 1
+            raise
+
+        self._seq += 1
+        job = PhotoJob(key, user_id, file_id, self._seq)
+        self._active[key] = job
+        self._user_history[user_id].append(time.monotonic())
+        self._user_jobs[user_id] = self._user_jobs.get(user_id, 0) + 1
+        self.stats.submitted += 1
+        self._queue.put_nowait(job)
+        return job, self.position(job)
+
+    def position(self, job: PhotoJob) -> int:
+        """Сколько задач (включая эту) ждут впереди свободного воркера; 0 — задача уже выполняется"""
+        if job.started_at:
+            return 0
+        return max(0, job.seq - self._taken - (self.workers - self._busy))
+
+    async def attach(self, job: PhotoJob, chat_id: int, message_id: int) -> None:
+        """Привязать сообщение-квитанцию: в него придет результат"""
+        waiter = (chat_id, message_id)
+        if job.result is not None:
+            # Задача успела завершиться, пока отправлялась квитанция
+            await self._deliver(job, waiter)
+        else:
+            job.waiters.append(waiter)
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def busy(self) -> int:
+        return self._busy
+
+    # --- выполнение ---
+
+    async def _deliver(self, job: PhotoJob, waiter: tuple[int, int]) -> None:
+        try:
+            await self.deliver(job, waiter, job.result)
+        except Exception as e:
+            print(f"[photo-queue] failed to deliver result to {waiter[0]}: {e}")
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            self._taken += 1
+            self._busy += 1
+            job.started_at = time.monotonic()
+            try:
+                job.result = await self.process(job)
+                self.stats.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[photo-queue] job {job.key} failed: {e}")
+                job.result = f"❌ Ошибка анализа: {e}"
+                self.stats.failed += 1
+            finally:
+                self._busy -= 1
+                self._active.pop(job.key, None)
+                self._user_jobs[job.user_id] = self._user_jobs.get(job.user_id, 1) - 1
+                if not self._user_jobs[job.user_id]:
+                    del self._user_jobs[job.user_id]
+            try:
+                self.stats.total_wait += job.started_at - job.created_at
+                self.stats.total_run += time.monotonic() - job.started_at
+                await asyncio.gather(*(self._deliver(job, waiter) for waiter in job.waiters))
+            finally:
+                # join() в stop() ждет и доставку результата
+                self._queue.task_done()
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float | None = None) -> None:
+        """Дать воркерам доделать очередь (до timeout), затем остановить"""
+        if not self._tasks:
+            return
+        if timeout:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                print(f"[photo-queue] stopping with {self.pending} pending jobs")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
@@ -0,0 +1,151 @@
+"""Управление промптом analyze_chart: сборка один раз, версия, кэш контекста.
+
+Длинный системный промпт больше не нужно слать в каждом запросе:
+- inline  — как раньше, полный промпт текстом рядом с картинкой;
+- system  — промпт в systemInstruction (стабильный префикс для неявного
+  кэширования Gemini), в contents — картинка и короткая инструкция;
+- context — промпт регистрируется через cachedContents, запрос несет только
+  ссылку на кэш, картинку и короткую инструкцию. Если кэш создать не удалось
+  (модель не поддерживает, промпт короче минимума), временно работаем как system.
+По каждому запросу копится экономия токенов (usageMetadata) и байт.
+"""
+import asyncio
+import hashlib
+import time
+from dataclasses import dataclass
+
+from http_client import HttpClient
+
+PROMPT_MODES = ("inline", "system", "context")
+
+# Короткая инструкция, которая идет вместе с картинкой, когда промпт вынесен
+SHORT_INSTRUCTION = "Проанализируй этот график. Ответ — строго в формате из инструкции."
+
+
+@dataclass
+class PromptStats:
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    request_bytes: int = 0
+    saved_bytes: int = 0
+
+    @property
+    def cached_ratio(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+
+class PromptManager:
+    """Один собранный промпт + (опционально) его кэш на стороне Gemini"""
+
+    def __init__(
+        self,
+        http_client: HttpClient,
+        *,
+        api_base: str,
+        api_key: str,
+        model: str,
+        prompt: str,
+        version: str,
+        mode: str = "system",
+        ttl: int = 3600,
+        proxies: list[str | None] | None = None,
+        retry_after: float = 600.0,
+    ):
+        if mode not in PROMPT_MODES:
+            raise ValueError(f"prompt mode must be one of {PROMPT_MODES}")
+        self.http_client = http_client
+        self.api_base = api_base
+        self.api_key = api_key
+        self.model = model
+        self.prompt = prompt
+        self.prompt_bytes = len(prompt.encode("utf-8"))
+        # Версия = ручная версия + хэш текста: правка промпта сама меняет ключи кэша анализов
+        self.version = f"{version}-{hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8]}"
+        self.mode = mode
+        self.ttl = ttl
+        self.proxies = proxies or [None]
+        self.retry_after = retry_after
+        self.stats = PromptStats()
+        self._cache_name: str | None = None
+        self._cache_expires = 0.0
+        self._cache_failed_at = 0.0
+        self._lock = asyncio.Lock()
+
+    # --- кэш контекста ---
+
+    async def _create_cache(self) -> str | None:
+        url = f"{self.api_base}/v1beta/cachedContents?key={self.api_key}"
+        body = {
+            "model": f"models/{self.model}",
+            "systemInstruction": {"parts": [{"text": self.prompt}]},
+            "ttl": f"{self.ttl}s",
+            "displayName": f"analyze-chart-{self.version}",
+        }
+        for proxy in self.proxies:
+            try:
+                status, data = await self.http_client.post_json(url, json=body, proxy=proxy, connect_timeout=10, read_timeout=30)
+            except Exception as e:
+                print(f"[prompt] cachedContents error (proxy={bool(proxy)}): {e}")
+                continue
+            if status == 200 and isinstance(data, dict) and data.get("name"):
+                tokens = (data.get("usageMetadata") or {}).get("totalTokenCount")
+                print(f"[prompt] context cache {data['name']} created, tokens={tokens}, ttl={self.ttl}s")
+                return data["name"]
+            print(f"[prompt] cachedContents HTTP {status}: {str(data)[:200]}")
+        return None
+
+    async def _cache(self) -> str | None:
+        now = time.time()
+        # Пересоздаем заранее, чтобы кэш не истек посреди запроса
+        if self._cache_name and now < self._cache_expires - 60:
+            return self._cache_name
+        if now - self._cache_failed_at < self.retry_after:
+            return None
+        async with self._lock:
+            if self._cache_name and time.time() < self._cache_expires - 60:
+                return self._cache_name
+            name = await self._create_cache()
+            if name is None:
+                self._cache_failed_at = time.time()
+                self._cache_name = None
+                return None
+            self._cache_name = name
+            self._cache_expires = time.time() + self.ttl
+            return name
+
+    def invalidate(self) -> None:
+        """Кэш отвергнут API (истек/удален) — создать заново при следующем запросе"""
+        self._cache_name = None
+        self._cache_expires = 0.0
+
+    # --- запрос ---
+
+    async def request_fields(self) -> tuple[dict, str, int]:
+        """Поля тела generateContent: (доп. поля, текст рядом с картинкой, сэкономленные байты)"""
+        if self.mode == "context":
+            name = await self._cache()
+            if name is not None:
+                return {"cachedContent": name}, SHORT_INSTRUCTION, self.prompt_bytes
+        if self.mode in ("system", "context"):
+            return {"systemInstruction": {"parts": [{"text": self.prompt}]}}, SHORT_INSTRUCTION, 0
+        return {}, self.prompt, 0
+
+    def record(self, usage: dict | None, request_bytes: int, saved_bytes: int) -> None:
+        """Учесть usageMetadata ответа и размер запроса"""
+        usage = usage or {}
+        prompt_tokens = int(usage.get("promptTokenCount") or 0)
+        cached_tokens = int(usage.get("cachedContentTokenCount") or 0)
+        self.stats.requests += 1
+        self.stats.prompt_tokens += prompt_tokens
+        self.stats.cached_tokens += cached_tokens
+        self.stats.request_bytes += request_bytes
+        self.stats.saved_bytes += saved_bytes
+        print(
+            f"[prompt] mode={self.mode} tokens={prompt_tokens} cached={cached_tokens} "
+            f"request={request_bytes // 1024} KB saved={saved_bytes} B"
+        )
+
+    @property
+    def cache_active(self) -> bool:
+        return self._cache_name is not None and time.time() < self._cache_expires
@@ -0,0 +1,159 @@
+"""Учет квоты Google (дневной/месячный лимит) в памяти.
+
+Счетчики живут в памяти, момент следующей полуночи PT вычисляется один
+раз при сбросе, поэтому проверка квоты — несколько сравнений чисел.
+Состояние сохраняется в last_reset.json в фоне (asyncio.to_thread).
+"""
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, time as dtime, timedelta, tzinfo
+
+
+class QuotaExceeded(Exception):
+    """Квота исчерпана до следующего сброса"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"quota exhausted, resets in {int(retry_after)} s")
+        self.retry_after = retry_after
+
+
+class QuotaManager:
+    """Дневной и месячный лимиты со сбросом в полночь заданной таймзоны"""
+
+    def __init__(self, limits: dict, tz: tzinfo, state_path: str = "last_reset.json"):
+        self.daily_limit = int(limits.get("daily", 0))
+        self.monthly_limit = int(limits.get("monthly", 0))
+        self.tz = tz
+        self.state_path = state_path
+        self.used_today = 0
+        self.used_month = 0
+        self.last_reset: datetime | None = None
+        self._month = ""
+        self._next_reset_ts = 0.0
+        self._persist_task: asyncio.Task | None = None
+        self._persist_writing = False  # отложенная запись уже ушла в поток
+
+    # --- сброс ---
+
+    def _schedule_next_reset(self, now_local: datetime) -> None:
+        tomorrow = now_local.date() + timedelta(days=1)
+        self._next_reset_ts = datetime.combine(tomorrow, dtime.min, tzinfo=self.tz).timestamp()
+        self._month = now_local.strftime("%Y-%m")
+
+    def _roll(self) -> None:
+        if time.time() < self._next_reset_ts:
+            return
+        now_local = datetime.now(self.tz)
+        self.used_today = 0
+        if now_local.strftime("%Y-%m") != self._month:
+            self.used_month = 0
+        self.last_reset = now_local
+        self._schedule_next_reset(now_local)
+        self.schedule_persist()
+
+    @property
+    def next_reset_in(self) -> float:
+        return max(0.0, self._next_reset_ts - time.time())
+
+    # --- проверки ---
+
+    def load(self, used_today: int = 0, used_month: int = 0) -> None:
+        """Инициализировать счетчики (из журнала запросов и сохраненного состояния)"""
+        now_local = datetime.now(self.tz)
+        state = {}
+        try:
+            if os.path.exists(self.state_path):
+                with open(self.state_path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[quota] failed to read {self.state_path}: {e}")
+        if state.get("day") == now_local.strftime("%Y-%m-%d"):
+            used_today = max(used_today, int(state.get("used_today", 0)))
+        if state.get("month") == now_local.strftime("%Y-%m"):
+            used_month = max(used_month, int(state.get("used_month", 0)))
+        try:
+            self.last_reset = datetime.fromisoformat(state["last_reset"])
+        except (KeyError, ValueError, TypeError):
+            self.last_reset = now_local
+        self.used_today = used_today
+        self.used_month = used_month
+        self._schedule_next_reset(now_local)
+
+    def remaining(self) -> int:
+        self._roll()
+        return max(0, min(self.daily_limit - self.used_today, self.monthly_limit - self.used_month))
+
+    def try_acquire(self) -> bool:
+        """Занять один запрос из квоты; False — если лимит исчерпан"""
+        self._roll()
+        if self.used_today >= self.daily_limit or self.used_month >= self.monthly_limit:
+            return False
+        self.used_today += 1
+        self.used_month += 1
+        self.schedule_persist()
+        return True
+
+    async def acquire(self, *, wait: bool = False, max_wait: float | None = None) -> None:
+        """Занять запрос; при wait=True ждать сброса квоты, иначе QuotaExceeded"""
+        while not self.try_acquire():
+            retry_after = self.next_reset_in
+            # Месячный лимит ожиданием до полуночи не лечится
+            month_exhausted = self.used_month >= self.monthly_limit
+            if not wait or month_exhausted or (max_wait is not None and retry_after > max_wait):
+                raise QuotaExceeded(retry_after)
+            await asyncio.sleep(retry_after + 1)
+
+    # --- сохранение ---
+
+    def _state(self) -> dict:
+        now_local = datetime.now(self.tz)
+        return {
+            "last_reset": (self.last_reset or now_local).isoformat(),
+            "day": now_local.strftime("%Y-%m-%d"),
+            "month": self._month,
+            "used_today": self.used_today,
+            "used_month": self.used_month,
+        }
+
+    def _write_state(self, state: dict) -> None:
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    async def _persist(self) -> None:
+        try:
+            # Небольшая пауза склеивает серию изменений в одну запись
+            await asyncio.sleep(1)
+            self._persist_writing = True
+            await asyncio.to_thread(self._write_state, self._state())
+        except Exception as e:
+            print(f"[quota] failed to persist state: {e}")
+        finally:
+            self._persist_writing = False
+            self._persist_task = None
+
+    def schedule_persist(self) -> None:
+        if self._persist_task is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне event loop (старт/завершение) пишем синхронно
+            self._write_state(self._state())
+            return
+        self._persist_task = loop.create_task(self._persist())
+
+    async def flush(self) -> None:
+        """Дождаться отложенной записи и сохранить актуальное состояние"""
+        task = self._persist_task
+        if task is not None:
+            # cancel() не остановит запись, уже запущенную в потоке: ее дожидаемся,
+            # иначе два писателя столкнутся на одном .tmp
+            if not self._persist_writing:
+                task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            self._persist_task = None
+        await asyncio.to_thread(self._write_state, self._state())
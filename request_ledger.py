@@ -0,0 +1,165 @@
+"""Журнал запросов к AI-провайдерам в формате JSONL.
+
+Каждая запись дописывается в конец файла одной строкой, без перезаписи
+всего лога. Дневные и месячные счетчики по провайдеру/модели хранятся
+в памяти в виде индекса, поэтому запрос статистики — O(1). Старые записи
+периодически вычищаются (атомарная перезапись через временный файл).
+"""
+import json
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone, tzinfo
+
+
+class RequestLedger:
+    """Append-only журнал запросов с индексом счетчиков"""
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        tz: tzinfo,
+        legacy_path: str | None = None,
+        retain_days: int = 62,
+        compact_every: int = 5000,
+    ):
+        self.path = path
+        self.tz = tz
+        self.legacy_path = legacy_path
+        self.retain_days = retain_days
+        self.compact_every = compact_every
+        self.total = 0
+        self._daily: Counter = Counter()
+        self._monthly: Counter = Counter()
+        self._lines = 0
+        self._compact_at = compact_every
+        self._fh = None
+
+    # --- ключи индекса ---
+
+    def _local(self, timestamp: str) -> datetime:
+        # Наивные метки (старый формат) трактуем как локальное время машины
+        return datetime.fromisoformat(timestamp).astimezone(self.tz)
+
+    def _index(self, entry: dict) -> None:
+        local = self._local(entry["timestamp"])
+        day = local.strftime("%Y-%m-%d")
+        month = local.strftime("%Y-%m")
+        provider, model = entry.get("provider"), entry.get("model")
+        for key_model in (model, None):
+            self._daily[(provider, key_model, day)] += 1
+            self._monthly[(provider, key_model, month)] += 1
+        self.total = max(self.total, int(entry.get("count") or 0))
+
+    # --- загрузка и миграция ---
+
+    def load(self) -> None:
+        """Прочитать журнал, при необходимости мигрировав старый request_log.json"""
+        self._migrate_legacy()
+        self.total = 0
+        self._daily.clear()
+        self._monthly.clear()
+        self._lines = 0
+        if os.path.exists(self.path):
+            self._repair_tail()
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        self._index(json.loads(line))
+                        self._lines += 1
+                    except (ValueError, KeyError, TypeError) as e:
+                        print(f"[ledger] skip broken entry: {e}")
+        self._compact_at = self._lines + self.compact_every
+        self._open()
+
+    def _migrate_legacy(self) -> None:
+        if not self.legacy_path or not os.path.exists(self.legacy_path) or os.path.exists(self.path):
+            return
+        try:
+            with open(self.legacy_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[ledger] legacy log unreadable, starting fresh: {e}")
+            entries = []
+        self._rewrite(entries)
+        os.replace(self.legacy_path, self.legacy_path + ".migrated")
+        print(f"[ledger] migrated {len(entries)} entries from {self.legacy_path}")
+
+    def _repair_tail(self) -> None:
+        # Обрезаем недописанную последнюю строку после аварийного завершения
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def _open(self) -> None:
+        if self._fh is None or self._fh.closed:
+            self._fh = open(self.path, "a", encoding="utf-8")
+
+    def close(self) -> None:
+        if self._fh is not None and not self._fh.closed:
+            self._fh.close()
+
+    # --- запись ---
+
+    def append(self, provider: str, model: str, success: bool) -> dict:
+        """Дописать запись в журнал и обновить счетчики"""
+        self.total += 1
+        entry = {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "provider": provider,
+            "model": model,
+            "success": success,
+            "count": self.total,
+        }
+        self._open()
+        self._fh.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._fh.flush()
+        self._index(entry)
+        self._lines += 1
+        if self._lines >= self._compact_at:
+            self.compact()
+        return entry
+
+    # --- статистика ---
+
+    def daily_count(self, provider: str, model: str | None = None, day: datetime | None = None) -> int:
+        day = (day or datetime.now(self.tz)).astimezone(self.tz)
+        return self._daily[(provider, model, day.strftime("%Y-%m-%d"))]
+
+    def monthly_count(self, provider: str, model: str | None = None, month: datetime | None = None) -> int:
+        month = (month or datetime.now(self.tz)).astimezone(self.tz)
+        return self._monthly[(provider, model, month.strftime("%Y-%m"))]
+
+    # --- ротация ---
+
+    def compact(self) -> None:
+        """Удалить записи старше retain_days и перестроить индекс"""
+        cutoff = datetime.now(self.tz) - timedelta(days=self.retain_days)
+        kept = []
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        if self._local(entry["timestamp"]) >= cutoff:
+                            kept.append(entry)
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        self.close()
+        total = self.total
+        self._rewrite(kept)
+        self.load()
+        self.total = max(self.total, total)
+
+    def _rewrite(self, entries: list[dict]) -> None:
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,160 @@
+"""Выбор маршрута (прокси или напрямую) для запросов к API с хеджированием.
+
+По каждому маршруту копятся задержки и доля успехов. Запрос уходит сначала
+по лучшему маршруту; если он упал — сразу по следующему, а с хеджированием
+второй запрос стартует, когда первый дольше p95 своего маршрута. Берется
+первый успешный ответ, остальные попытки отменяются. Отказ в запросе
+(4xx, кроме 429) бывает и из-за маршрута (геоблок Gemini: "User location is
+not supported"), поэтому он тоже штрафует маршрут и не прерывает остальные
+попытки; вызывающему он возвращается, только когда других маршрутов не осталось.
+"""
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, TypeVar
+from urllib.parse import urlsplit
+
+T = TypeVar("T")
+
+
+class RouteError(Exception):
+    """Маршрут ответил, но ответ непригоден (не 200, пустой)"""
+
+
+class RequestRejected(RouteError):
+    """API отклонило запрос (4xx, кроме 429); итоговая ошибка, если так ответили все маршруты"""
+
+
+def is_route_failure(status: int) -> bool:
+    """HTTP-статус, который говорит о проблеме маршрута/сервиса, а не запроса"""
+    return status == 429 or status >= 500 or status < 400
+
+
+@dataclass
+class RouteStats:
+    name: str
+    success_rate: float = 1.0  # EWMA, оптимистично для нового маршрута
+    requests: int = 0
+    failures: int = 0
+    hedges_won: int = 0
+    latencies: deque = field(default_factory=lambda: deque(maxlen=100))
+
+    def percentile(self, q: float) -> float | None:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def record(self, latency: float, ok: bool, alpha: float = 0.2) -> None:
+        self.requests += 1
+        self.success_rate += alpha * ((1.0 if ok else 0.0) - self.success_rate)
+        if ok:
+            self.latencies.append(latency)
+        else:
+            self.failures += 1
+
+
+def route_name(proxy: str | None) -> str:
+    return "direct" if proxy is None else (urlsplit(proxy).hostname or proxy)
+
+
+class RouteManager:
+    """Маршруты упорядочены по ожидаемому времени до успешного ответа"""
+
+    def __init__(
+        self,
+        routes: list[str | None],
+        *,
+        hedge: bool = False,
+        hedge_default: float = 20.0,
+        hedge_min: float = 1.0,
+        hedge_max: float = 60.0,
+        min_samples: int = 5,
+    ):
+        self.routes = list(routes)
+        self.hedge = hedge
+        self.hedge_default = hedge_default
+        self.hedge_min = hedge_min
+        self.hedge_max = hedge_max
+        self.min_samples = min_samples
+        self.stats = {route: RouteStats(route_name(route)) for route in self.routes}
+        self.hedges = 0
+
+    def _expected(self, route: str | None) -> float:
+        stats = self.stats[route]
+        median = stats.percentile(0.5)
+        return (median if median is not None else self.hedge_default) / max(stats.success_rate, 0.05)
+
+    def order(self) -> list[str | None]:
+        """Маршруты от лучшего к худшему (при равенстве — в порядке конфигурации)"""
+        return sorted(self.routes, key=self._expected)
+
+    def hedge_delay(self, route: str | None) -> float:
+        stats = self.stats[route]
+        p95 = stats.percentile(0.95) if len(stats.latencies) >= self.min_samples else None
+        return min(self.hedge_max, max(self.hedge_min, p95 if p95 is not None else self.hedge_default))
+
+    async def _attempt(self, route, call: Callable[[str | None], Awaitable[T]]) -> T:
+        started = time.perf_counter()
+        try:
+            result = await call(route)
+        except asyncio.CancelledError:
+            raise  # проигравший хедж — не ошибка маршрута
+        except Exception:
+            self.stats[route].record(time.perf_counter() - started, False)
+            raise
+        self.stats[route].record(time.perf_counter() - started, True)
+        return result
+
+    async def run(self, call: Callable[[str | None], Awaitable[T]]) -> T:
+        """Выполнить call(route) по маршрутам; вернуть первый успешный результат"""
+        queue = self.order()
+        running: dict[asyncio.Task, str | None] = {}
+        last_error: Exception | None = None
+        rejected: RequestRejected | None = None
+
+        def launch():
+            route = queue.pop(0)
+            running[asyncio.create_task(self._attempt(route, call))] = route
+            return route
+
+        try:
+            primary = launch()
+            while running:
+                # Ждем до хеджа, только пока бежит одна попытка и есть запасной маршрут
+                timeout = self.hedge_delay(primary) if self.hedge and queue and len(running) == 1 else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedges += 1
+                    hedge_route = launch()
+                    print(f"[routes] {route_name(primary)} slower than {timeout:.1f} s, hedging via {route_name(hedge_route)}")
+                    continue
+                for task in done:
+                    route = running.pop(task)
+                    if task.exception() is None:
+                        if route != primary:
+                            self.stats[route].hedges_won += 1
+                        return task.result()
+                    last_error = task.exception()
+                    if isinstance(last_error, RequestRejected):
+                        rejected = last_error
+                    print(f"[routes] {route_name(route)} failed: {last_error}")
+                if not running and queue:
+                    primary = launch()
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+        # Отказ в запросе информативнее сетевой ошибки другого маршрута — отдаем его
+        raise rejected or last_error or RouteError("no routes")
+
+    def summary(self) -> str:
+        parts = []
+        for route in self.order():
+            stats = self.stats[route]
+            p50, p95 = stats.percentile(0.5), stats.percentile(0.95)
+            latency = f"p50 {p50:.1f}/p95 {p95:.1f} s" if p50 is not None else "нет данных"
+            parts.append(f"{stats.name}: {stats.success_rate:.0%} ок, {latency}")
+        return "; ".join(parts)
@@ -0,0 +1,143 @@
+"""Планировщик автоанализа по нескольким парам.
+
+Каждая задача (symbol, timeframe) живет по своему расписанию с джиттером,
+задачи выполняются параллельно с ограничением одновременных запусков.
+По каждой задаче копится статистика задержек и ошибок.
+"""
+import asyncio
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+
+@dataclass
+class JobStats:
+    runs: int = 0
+    failures: int = 0
+    last_latency: float = 0.0
+    total_latency: float = 0.0
+    max_latency: float = 0.0
+    last_error: str = ""
+    last_run_at: float = 0.0
+
+    @property
+    def avg_latency(self) -> float:
+        return self.total_latency / self.runs if self.runs else 0.0
+
+    def record(self, latency: float, error: Exception | None = None) -> None:
+        self.runs += 1
+        self.last_latency = latency
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.last_run_at = time.time()
+        if error is not None:
+            self.failures += 1
+            self.last_error = str(error)
+
+
+@dataclass
+class AnalysisJob:
+    symbol: str
+    timeframe: str
+    interval: float
+    next_run: float = 0.0
+    running: bool = False
+    stats: JobStats = field(default_factory=JobStats)
+
+    @property
+    def key(self) -> tuple[str, str]:
+        return (self.symbol, self.timeframe)
+
+
+class AnalysisScheduler:
+    """Запуск задач по расписанию с джиттером и ограничением параллелизма"""
+
+    def __init__(
+        self,
+        run_job: Callable[[AnalysisJob], Awaitable[None]],
+        *,
+        max_concurrency: int = 4,
+        jitter: float = 0.1,
+        initial_delay: float = 5.0,
+    ):
+        self.run_job = run_job
+        self.max_concurrency = max_concurrency
+        self.jitter = jitter
+        self.initial_delay = initial_delay
+        self.jobs: dict[tuple[str, str], AnalysisJob] = {}
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._wakeup = asyncio.Event()
+        self._running: set[asyncio.Task] = set()
+        self._stopped = False
+
+    def _jittered(self, interval: float) -> float:
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def add(self, symbol: str, timeframe: str, interval: float) -> AnalysisJob:
+        job = self.jobs.get((symbol, timeframe))
+        if job is None:
+            # Разносим первые запуски, чтобы задачи не стартовали пачкой
+            first = time.monotonic() + self.initial_delay + random.uniform(0, interval * self.jitter)
+            job = AnalysisJob(symbol, timeframe, interval, next_run=first)
+            self.jobs[job.key] = job
+        job.interval = interval
+        self._wakeup.set()
+        return job
+
+    def remove(self, symbol: str, timeframe: str) -> None:
+        self.jobs.pop((symbol, timeframe), None)
+        self._wakeup.set()
+
+    def trigger(self, symbol: str, timeframe: str) -> None:
+        """Запустить задачу вне расписания (например, по закрытию свечи)"""
+        job = self.jobs.get((symbol, timeframe))
+        if job is not None:
+            job.next_run = time.monotonic()
+            self._wakeup.set()
+
+    async def _execute(self, job: AnalysisJob) -> None:
+        async with self._slots:
+            started = time.perf_counter()
+            error = None
+            try:
+                await self.run_job(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = e
+                print(f"[scheduler] {job.symbol}/{job.timeframe} failed: {e}")
+            finally:
+                job.stats.record(time.perf_counter() - started, error)
+                job.running = False
+                job.next_run = time.monotonic() + self._jittered(job.interval)
+                self._wakeup.set()
+
+    async def run(self) -> None:
+        """Главный цикл: запускает созревшие задачи и спит до ближайшей"""
+        self._stopped = False
+        try:
+            while not self._stopped:
+                now = time.monotonic()
+                for job in list(self.jobs.values()):
+                    if not job.running and job.next_run <= now:
+                        job.running = True
+                        task = asyncio.create_task(self._execute(job))
+                        self._running.add(task)
+                        task.add_done_callback(self._running.discard)
+                pending = [j.next_run for j in self.jobs.values() if not j.running]
+                timeout = max(0.0, min(pending) - time.monotonic()) if pending else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in list(self._running):
+                task.cancel()
+            if self._running:
+                await asyncio.gather(*self._running, return_exceptions=True)
+
+    def stop(self) -> None:
+        self._stopped = True
+        self._wakeup.set()
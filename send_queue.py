@@ -0,0 +1,289 @@
+"""Очередь исходящих сообщений Telegram с учетом флуд-лимитов.
+
+Вместо слепых повторов с backoff все отправки идут через один диспетчер:
+- общий token bucket (~30 сообщений/с на бота) и свой bucket на чат
+  (~1/с в личке, ~20/мин в группах);
+- TelegramRetryAfter ставит чат на паузу ровно на retry_after, сообщение
+  остается на своем месте в очереди;
+- приоритеты: сигналы раньше результатов и статусов; сообщения с одинаковым
+  coalesce_key, еще не ушедшие, схлопываются в последнее;
+- в один чат одновременно идет одна отправка, порядок внутри чата сохраняется;
+- ошибки вроде "бот заблокирован"/"неверный запрос" не повторяются.
+"""
+import asyncio
+import bisect
+import itertools
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+    TelegramUnauthorizedError,
+)
+
+PRIORITY_SIGNAL = 0
+PRIORITY_RESULT = 1
+PRIORITY_STATUS = 2
+
+# Повторять бессмысленно: запрос неверен или чат недоступен
+_FATAL = (TelegramBadRequest, TelegramForbiddenError, TelegramNotFound, TelegramUnauthorizedError)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available_in(self, now: float | None = None) -> float:
+        """Через сколько секунд будет токен (0 — есть сейчас)"""
+        now = now or time.monotonic()
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self._refill(time.monotonic())
+        self.tokens -= 1
+
+
+@dataclass
+class _Chat:
+    bucket: TokenBucket
+    paused_until: float = 0.0
+    busy: bool = False
+
+
+@dataclass
+class _Item:
+    chat_id: int
+    factory: Callable[[], Awaitable[Any]]
+    priority: int
+    seq: int
+    coalesce_key: Any = None
+    futures: list = field(default_factory=list)
+    enqueued_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+
+@dataclass
+class SendStats:
+    sent: int = 0
+    failed: int = 0
+    retried: int = 0
+    retry_after: int = 0
+    coalesced: int = 0
+    latencies: deque = field(default_factory=lambda: deque(maxlen=500))
+
+    def latency(self, q: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class SendQueue:
+    """Диспетчер отправок с приоритетами и флуд-лимитами"""
+
+    def __init__(
+        self,
+        *,
+        global_rate: float = 25.0,
+        chat_rate: float = 1.0,
+        group_rate: float = 20 / 60,
+        chat_burst: float = 3.0,
+        max_attempts: int = 5,
+        base_delay: float = 1.0,
+        on_finish: Callable[[float, bool], None] | None = None,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.on_finish = on_finish  # (задержка от постановки до результата, успех) — для метрик
+        self.stats = SendStats()
+        self._pending: list[tuple[int, int, _Item]] = []
+        self._by_key: dict[Any, _Item] = {}
+        self._chats: dict[int, _Chat] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._in_flight: set[asyncio.Task] = set()
+
+    # --- постановка ---
+
+    def _chat(self, chat_id: int) -> _Chat:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            # Отрицательный id — группа/канал: лимит строже
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            chat = self._chats[chat_id] = _Chat(TokenBucket(rate, self.chat_burst))
+        return chat
+
+    def _push(self, item: _Item) -> None:
+        bisect.insort(self._pending, (item.priority, item.seq, item))
+        self._wakeup.set()
+
+    async def send(
+        self,
+        chat_id: int,
+        factory: Callable[[], Awaitable[Any]],
+        *,
+        priority: int = PRIORITY_STATUS,
+        coalesce_key: Any = None,
+    ):
+        """Поставить отправку в очередь и дождаться ее результата.
+        factory — функция без аргументов, возвращает корутину отправки."""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        if coalesce_key is not None and coalesce_key in self._by_key:
+            # Еще не ушедшее сообщение с тем же ключом заменяем новым
+            item = self._by_key[coalesce_key]
+            item.factory = factory
+            item.futures.append(future)
+            self.stats.coalesced += 1
+        else:
+            item = _Item(chat_id, factory, priority, next(self._seq), coalesce_key, [future])
+            if coalesce_key is not None:
+                self._by_key[coalesce_key] = item
+            self._push(item)
+        return await future
+
+    # --- диспетчер ---
+
+    def _next_ready(self, now: float) -> tuple[_Item | None, float | None]:
+        """Первый по приоритету элемент, чей чат свободен; иначе — когда проверить снова"""
+        wake = None
+        for entry in self._pending:
+            item = entry[2]
+            chat = self._chat(item.chat_id)
+            if chat.busy:
+                continue
+            wait = max(chat.paused_until - now, chat.bucket.available_in(now))
+            if wait <= 0:
+                self._pending.remove(entry)
+                return item, None
+            wake = wait if wake is None else min(wake, wait)
+        return None, wake
+
+    async def _run(self) -> None:
+        while True:
+            item, wake = self._next_ready(time.monotonic())
+            if item is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wake)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            wait = self.global_bucket.available_in()
+            if wait > 0:
+                # Общий лимит: ставим элемент обратно и ждем токен
+                self._push(item)
+                await asyncio.sleep(wait)
+                continue
+            self.global_bucket.take()
+            chat = self._chat(item.chat_id)
+            chat.bucket.take()
+            chat.busy = True
+            if item.coalesce_key is not None:
+                self._by_key.pop(item.coalesce_key, None)
+            task = asyncio.create_task(self._deliver(item, chat))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _deliver(self, item: _Item, chat: _Chat) -> None:
+        item.attempts += 1
+        try:
+            result = await item.factory()
+        except TelegramRetryAfter as e:
+            self.stats.retry_after += 1
+            chat.paused_until = time.monotonic() + e.retry_after
+            print(f"[send-queue] chat {item.chat_id}: retry after {e.retry_after} s")
+            self._requeue_or_fail(item, e)
+        except _FATAL as e:
+            self._finish(item, error=e)
+        except Exception as e:
+            # Сеть/5xx: повторяем с экспоненциальной паузой для этого чата
+            chat.paused_until = time.monotonic() + self.base_delay * 2 ** (item.attempts - 1)
+            self._requeue_or_fail(item, e)
+        else:
+            self._finish(item, result=result)
+        finally:
+            chat.busy = False
+            self._wakeup.set()
+
+    def _requeue_or_fail(self, item: _Item, error: Exception) -> None:
+        if item.attempts >= self.max_attempts:
+            self._finish(item, error=error)
+            return
+        self.stats.retried += 1
+        if item.coalesce_key is not None:
+            newer = self._by_key.get(item.coalesce_key)
+            if newer is not None:
+                # Пока ждали, пришла более свежая версия — отдаем ей ожидающих
+                newer.futures.extend(item.futures)
+                return
+            self._by_key[item.coalesce_key] = item
+        self._push(item)
+
+    def _finish(self, item: _Item, *, result=None, error: Exception | None = None) -> None:
+        if error is None:
+            self.stats.sent += 1
+        else:
+            self.stats.failed += 1
+        latency = time.monotonic() - item.enqueued_at
+        self.stats.latencies.append(latency)
+        if self.on_finish is not None:
+            self.on_finish(latency, error is None)
+        for future in item.futures:
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    # --- жизненный цикл и метрики ---
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float | None = None) -> None:
+        """Дождаться опустошения очереди (до timeout) и остановить диспетчер"""
+        deadline = time.monotonic() + (timeout or 0)
+        while (self._pending or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for _, _, item in self._pending:
+            for future in item.futures:
+                if not future.done():
+                    future.cancel()
+        self._pending.clear()
+        self._by_key.clear()
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
@@ -0,0 +1,60 @@
+"""Подписки чатов на автоанализ.
+
+Чат подписывается на пары (symbol, timeframe); каждая пара анализируется
+один раз за цикл, а результат рассылается всем ее подписчикам.
+"""
+
+
+class SessionRegistry:
+    """Двусторонний индекс: чат → пары и пара → чаты"""
+
+    def __init__(self):
+        self._by_chat: dict[int, set[tuple[str, str]]] = {}
+        self._by_key: dict[tuple[str, str], set[int]] = {}
+
+    def subscribe(self, chat_id: int, symbol: str, timeframe: str) -> bool:
+        """Подписать чат на пару; True — если у пары это первый подписчик"""
+        key = (symbol, timeframe)
+        self._by_chat.setdefault(chat_id, set()).add(key)
+        chats = self._by_key.setdefault(key, set())
+        is_new = not chats
+        chats.add(chat_id)
+        return is_new
+
+    def unsubscribe(self, chat_id: int, symbol: str | None = None, timeframe: str | None = None) -> list[tuple[str, str]]:
+        """Отписать чат от пары (или от всех); вернуть пары, оставшиеся без подписчиков"""
+        keys = self._by_chat.get(chat_id, set())
+        if symbol is not None:
+            keys = {k for k in keys if k[0] == symbol and (timeframe is None or k[1] == timeframe)}
+        orphaned = []
+        for key in list(keys):
+            self._by_chat[chat_id].discard(key)
+            chats = self._by_key.get(key)
+            if chats is not None:
+                chats.discard(chat_id)
+                if not chats:
+                    del self._by_key[key]
+                    orphaned.append(key)
+        if not self._by_chat.get(chat_id):
+            self._by_chat.pop(chat_id, None)
+        return orphaned
+
+    def subscribers(self, symbol: str, timeframe: str) -> list[int]:
+        return list(self._by_key.get((symbol, timeframe), ()))
+
+    def subscriptions(self, chat_id: int) -> list[tuple[str, str]]:
+        return sorted(self._by_chat.get(chat_id, ()))
+
+    def is_active(self, chat_id: int) -> bool:
+        return bool(self._by_chat.get(chat_id))
+
+    @property
+    def keys(self) -> list[tuple[str, str]]:
+        return list(self._by_key)
+
+    @property
+    def chats(self) -> list[int]:
+        return list(self._by_chat)
+
+    def __bool__(self) -> bool:
+        return bool(self._by_key)
@@ -0,0 +1,255 @@
+"""Исходы отправленных сигналов по последующим свечам.
+
+Каждый BUY/SELL с ценами SL/TP записывается в журнал (JSONL, дописывание
+в конец). Исход — тейк, стоп или истечение срока — для всех ожидающих
+сигналов пары определяется одним векторным проходом по свечам после
+свечи сигнала: матрица (сигналы × горизонт) high/low, первое касание
+уровня — argmax по строке. Итоговые записи тоже дописываются в журнал,
+поэтому повторно считать закрытые сигналы не нужно.
+
+Статистика — по последним N закрытым сигналам в каждой группе
+(символ, таймфрейм, корзина силы): доля прибыльных и R-мультипликатор
+(результат в единицах риска |вход − стоп|).
+"""
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from indicators import CLOSE, HIGH, LOW
+from kline_cache import INTERVAL_MS
+
+PENDING, TAKE_PROFIT, STOP_LOSS, EXPIRED = 0, 1, 2, 3
+OUTCOME_NAMES = {PENDING: "pending", TAKE_PROFIT: "tp", STOP_LOSS: "sl", EXPIRED: "expired"}
+STRENGTH_BUCKETS = ((1, 4, "1-4"), (5, 7, "5-7"), (8, 10, "8-10"))
+
+
+def strength_bucket(strength: int | None) -> str:
+    for low, high, label in STRENGTH_BUCKETS:
+        if strength is not None and low <= strength <= high:
+            return label
+    return "—"
+
+
+def resolve_outcomes(
+    entry_ts: np.ndarray,
+    side: np.ndarray,
+    entry: np.ndarray,
+    stop: np.ndarray,
+    take: np.ndarray,
+    candle_ts: np.ndarray,
+    high: np.ndarray,
+    low: np.ndarray,
+    close: np.ndarray,
+    horizon: int,
+    first_block: int = 8,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Исходы сигналов одной серии свечей: (outcome, индекс свечи выхода, R).
+
+    side: +1 BUY, -1 SELL. Смотрим horizon свечей после свечи сигнала
+    (сама она незакрыта в момент сигнала и не учитывается). Если в одной
+    свече задеты и стоп, и тейк, считаем стоп: порядок внутри свечи неизвестен.
+    Сигналы, для которых свечей пока меньше horizon и уровни не задеты, — PENDING.
+
+    Горизонт просматривается блоками растущей ширины (8, 16, 32, ...), и в
+    следующий блок идут только еще не закрытые сигналы: большинство задевает
+    уровень в первых свечах, полная матрица на весь горизонт не нужна.
+    """
+    count, n = len(entry_ts), len(candle_ts)
+    outcome = np.zeros(count, dtype=np.int8)
+    exit_index = np.full(count, -1, dtype=np.int64)
+    r = np.full(count, np.nan)
+    if not count or not n:
+        return outcome, exit_index, r
+    start = np.searchsorted(candle_ts, entry_ts, side="right")
+    long = side > 0
+    active = np.flatnonzero(start < n)
+    offset, width = 0, first_block
+    while len(active) and offset < horizon:
+        width = min(width, horizon - offset)
+        index = start[active, None] + np.arange(offset, offset + width)
+        valid = index < n
+        index = np.minimum(index, n - 1)
+        highs, lows = high[index], low[index]
+        is_long = long[active, None]
+        hit_take = np.where(is_long, highs >= take[active, None], lows <= take[active, None]) & valid
+        hit_stop = np.where(is_long, lows <= stop[active, None], highs >= stop[active, None]) & valid
+        first_take = np.where(hit_take.any(axis=1), hit_take.argmax(axis=1), width)
+        first_stop = np.where(hit_stop.any(axis=1), hit_stop.argmax(axis=1), width)
+
+        stopped = (first_stop <= first_take) & (first_stop < width)
+        took = first_take < first_stop
+        outcome[active[took]] = TAKE_PROFIT
+        outcome[active[stopped]] = STOP_LOSS
+        exit_index[active[took]] = start[active[took]] + offset + first_take[took]
+        exit_index[active[stopped]] = start[active[stopped]] + offset + first_stop[stopped]
+        # Дальше — только открытые, у которых еще есть свечи
+        active = active[~took & ~stopped & (start[active] + offset + width < n)]
+        offset += width
+        width *= 2
+
+    expired = (outcome == PENDING) & (start + horizon <= n)
+    outcome[expired] = EXPIRED
+    exit_index[expired] = start[expired] + horizon - 1
+    risk = np.abs(entry - stop)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r_take = np.abs(take - entry) / risk
+        r_close = side * (close[np.clip(exit_index, 0, n - 1)] - entry) / risk
+    r = np.select([outcome == TAKE_PROFIT, outcome == STOP_LOSS, expired], [r_take, -1.0, r_close], np.nan)
+    return outcome, exit_index, r
+
+
+class SignalJournal:
+    """Журнал сигналов и их исходов с векторной проверкой ожидающих"""
+
+    def __init__(self, path: str, *, expiry_candles: int = 48):
+        self.path = path
+        self.expiry_candles = expiry_candles
+        self.signals: list[dict] = []
+        self._by_id: dict[str, dict] = {}
+        self._pending: dict[tuple[str, str], list[dict]] = {}
+        self._fh = None
+
+    # --- хранение ---
+
+    def load(self) -> None:
+        self.signals.clear()
+        self._by_id.clear()
+        self._pending.clear()
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except (ValueError, KeyError, TypeError) as e:
+                        print(f"[signals] skip broken entry: {e}")
+        for signal in self.signals:
+            if signal.get("outcome", PENDING) == PENDING:
+                self._pending.setdefault((signal["symbol"], signal["timeframe"]), []).append(signal)
+
+    def _apply(self, entry: dict) -> None:
+        if entry.get("kind") == "outcome":
+            signal = self._by_id.get(entry["id"])
+            if signal is not None:
+                signal.update(outcome=entry["outcome"], exit_ts=entry["exit_ts"], r=entry["r"])
+            return
+        signal = dict(entry, outcome=PENDING)
+        self.signals.append(signal)
+        self._by_id[signal["id"]] = signal
+
+    def _write(self, entries: list[dict]) -> None:
+        if self._fh is None or self._fh.closed:
+            self._fh = open(self.path, "a", encoding="utf-8")
+        self._fh.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+        self._fh.flush()
+
+    def close(self) -> None:
+        if self._fh is not None and not self._fh.closed:
+            self._fh.close()
+
+    # --- запись сигналов ---
+
+    def record(self, symbol: str, timeframe: str, ts: int, signal: str, entry: float,
+               stop: float | None, take: float | None, strength: int | None) -> dict | None:
+        """Записать сигнал; None — если уровни не по сторонам от входа (проверять нечего)"""
+        side = 1 if signal == "BUY" else -1 if signal == "SELL" else 0
+        if not side or stop is None or take is None or not (side * (take - entry) > 0 > side * (stop - entry)):
+            return None
+        item = {
+            "kind": "signal",
+            "id": f"{symbol}:{timeframe}:{ts}",
+            "symbol": symbol,
+            "timeframe": timeframe,
+            "ts": int(ts),
+            "side": side,
+            "entry": float(entry),
+            "stop": float(stop),
+            "take": float(take),
+            "strength": strength,
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        }
+        if item["id"] in self._by_id:
+            return None  # тот же сигнал с той же свечи (повтор из кэша анализов)
+        self._write([item])
+        self._apply(item)
+        self._pending.setdefault((symbol, timeframe), []).append(self._by_id[item["id"]])
+        return item
+
+    # --- исходы ---
+
+    def pending_pairs(self) -> dict[tuple[str, str], int]:
+        """Пары с ожидающими сигналами → метка времени самого раннего"""
+        return {key: min(s["ts"] for s in items) for key, items in self._pending.items() if items}
+
+    def resolve(self, symbol: str, timeframe: str, candle_ts: np.ndarray, ohlcv: np.ndarray) -> int:
+        """Проверить ожидающие сигналы пары по свечам (ts, ohlcv); вернуть число закрытых.
+        Учитываются только закрытые свечи: последняя от Bybit обычно еще формируется."""
+        items = self._pending.get((symbol, timeframe))
+        if not items or not len(candle_ts):
+            return 0
+        step = INTERVAL_MS.get(timeframe)
+        if step:
+            closed = int(np.searchsorted(candle_ts, time.time() * 1000 - step, side="right"))
+            candle_ts, ohlcv = candle_ts[:closed], ohlcv[:closed]
+            if not closed:
+                return 0
+        # Свечи должны покрывать начало: сигналы раньше первой свечи ждут другой загрузки
+        covered = [s for s in items if s["ts"] >= candle_ts[0]]
+        if not covered:
+            return 0
+        columns = {name: np.array([s[name] for s in covered], dtype=np.float64)
+                   for name in ("side", "entry", "stop", "take")}
+        outcome, exit_index, r = resolve_outcomes(
+            np.array([s["ts"] for s in covered], dtype=np.int64), columns["side"], columns["entry"],
+            columns["stop"], columns["take"], candle_ts, ohlcv[:, HIGH], ohlcv[:, LOW], ohlcv[:, CLOSE],
+            self.expiry_candles,
+        )
+        done = np.flatnonzero(outcome != PENDING)
+        if not len(done):
+            return 0
+        entries = [
+            {"kind": "outcome", "id": covered[i]["id"], "outcome": int(outcome[i]),
+             "exit_ts": int(candle_ts[exit_index[i]]), "r": round(float(r[i]), 4)}
+            for i in done
+        ]
+        self._write(entries)
+        for entry in entries:
+            self._apply(entry)
+        closed = {entry["id"] for entry in entries}
+        self._pending[(symbol, timeframe)] = [s for s in items if s["id"] not in closed]
+        return len(entries)
+
+    # --- статистика ---
+
+    def frame(self) -> pd.DataFrame:
+        columns = ["symbol", "timeframe", "ts", "side", "entry", "stop", "take", "strength", "outcome", "exit_ts", "r"]
+        return pd.DataFrame([{name: s.get(name) for name in columns} for s in self.signals], columns=columns)
+
+    def stats(self, window: int = 50) -> pd.DataFrame:
+        return outcome_stats(self.frame(), window)
+
+
+def outcome_stats(df: pd.DataFrame, window: int = 50) -> pd.DataFrame:
+    """По последним window закрытым сигналам в группе (символ, таймфрейм, сила):
+    число, доля прибыльных (R > 0), средний и суммарный R, сколько еще ждут исхода"""
+    keys = ["symbol", "timeframe", "bucket"]
+    df = df.assign(bucket=[strength_bucket(s if pd.notna(s) else None) for s in df["strength"]])
+    pending = df[df["outcome"] == PENDING].groupby(keys).size().rename("pending")
+    closed = df[df["outcome"] != PENDING].sort_values("exit_ts")
+    recent = closed.groupby(keys, sort=False).tail(window)
+    grouped = recent.assign(
+        win=recent["r"] > 0, tp=recent["outcome"] == TAKE_PROFIT, sl=recent["outcome"] == STOP_LOSS,
+    ).groupby(keys)
+    stats = pd.DataFrame({
+        "signals": grouped.size(),
+        "win_rate": grouped["win"].mean(),
+        "avg_r": grouped["r"].mean(),
+        "total_r": grouped["r"].sum(),
+        "tp": grouped["tp"].sum(),
+        "sl": grouped["sl"].sum(),
+    })
+    stats = stats.join(pending, how="outer").fillna({"signals": 0, "pending": 0, "tp": 0, "sl": 0, "total_r": 0.0})
+    return stats.astype({"signals": int, "pending": int, "tp": int, "sl": int})
@@ -0,0 +1,278 @@
+"""Однопроходный разбор ответа модели в торговый сигнал.
+
+Ответ просматривается один раз построчно: заранее скомпилированное
+выражение, привязанное к началу строки, узнает метку поля (Сигнал,
+Причина, Stop Loss, Take Profit, Комментарий), значение — остаток строки.
+Метки внутри строки ищутся только если ответ не в ожидаемом формате.
+SL/TP дополнительно разбираются в числа.
+
+Ответ в JSON-режиме (responseSchema) разбирается строгим декодером
+decode_signal_json: типы и значения полей проверяются, а не угадываются.
+"""
+import json
+import math
+import re
+from dataclasses import dataclass
+from decimal import Decimal
+
+_FIELDS = ("signal", "reason", "stop_loss", "take_profit", "comment")
+
+# Метки полей: (поле, приоритет) — полная форма важнее краткой (SL/TP)
+_LABELS = {
+    "сигнал": ("signal", 0),
+    "причина": ("reason", 0),
+    "stop loss (sl)": ("stop_loss", 0),
+    "stop loss": ("stop_loss", 1),
+    "sl": ("stop_loss", 2),
+    "take profit (tp)": ("take_profit", 0),
+    "take profit": ("take_profit", 1),
+    "tp": ("take_profit", 2),
+    "комментарий": ("comment", 0),
+}
+_LABEL = r"(?P<label>Сигнал|Причина|Stop Loss \(SL\)|Stop Loss|Take Profit \(TP\)|Take Profit|SL|TP|Комментарий)"
+_COLON = r"(?::\*\*|\*\*:|:)"
+
+# Метка в начале строки: "3. Stop Loss (SL): ...", "**Причина:** ...", "TP: ..."
+_LINE_RE = re.compile(r"[ \t]*(?P<num>\d\.[ \t]*)?(?:\*\*)?" + _LABEL + _COLON + r"\s*", re.IGNORECASE)
+# Запасной вариант для ответов без переносов строк: метка где угодно
+_INLINE_RE = re.compile(r"(?:\*\*)?(?<!\w)" + _LABEL + _COLON + r"\s*", re.IGNORECASE)
+_STRENGTH_RE = re.compile(r"(?:Сила|Strength)\s*([0-9]{1,2})\s*/\s*10", re.IGNORECASE)
+_SIGNAL_RE = re.compile(r"(Buy|Sell|No Trade)\b", re.IGNORECASE)
+_FALLBACK_SKIP_RE = re.compile(r"^\s*\*\*.*\*\*:\s*")
+# Числа в поле цены; формат записи — по группе: 1.234,5 / 1 234,5 / 1,234.5 / 142.5 или 142,5
+_PRICE_RE = re.compile(
+    r"(?<![\w.,])(?:"
+    r"(?P<dot_thousands>\d{1,3}(?:\.\d{3})+,\d+)"
+    r"|(?P<space_thousands>\d{1,3}(?: \d{3})+(?:[.,]\d+)?)"
+    r"|(?P<comma_thousands>\d{1,3}(?:,\d{3})+(?:\.\d+)?)"
+    r"|(?P<plain>\d+(?:[.,]\d+)?)"
+    r")(?!\d|[.,]\d)"
+)
+# Число с единицей после него — не цена: 3 свечи, 2%, 9/10, 1:3, 2 касания
+_NOT_PRICE_AFTER_RE = re.compile(
+    r"\s*(?:%|/\s*\d|:\s*\d|[xх]\b|r\b|свеч|бар|касан|раз\b|балл|час|ч\b|мин|сек|дн|ден|недел|atr)",
+    re.IGNORECASE,
+)
+_NOT_PRICE_BEFORE_RE = re.compile(r"(?:\d\s*[:/]|сила)\s*$", re.IGNORECASE)
+# Метка цены рядом с числом: $142.5, 142.5 USDT, "цена 142.5", "уровень 142.5"
+_PRICE_MARK_BEFORE_RE = re.compile(r"(?:\$|цен\w*|уров\w*|level|price|@)\s*:?\s*$", re.IGNORECASE)
+_PRICE_MARK_AFTER_RE = re.compile(r"\s*(?:\$|usdt?\b|долл)", re.IGNORECASE)
+
+SIGNAL_VALUES = ("BUY", "SELL", "NO_TRADE")
+
+# Схема ответа для generationConfig.responseSchema (подмножество OpenAPI)
+SIGNAL_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "signal": {"type": "STRING", "enum": list(SIGNAL_VALUES)},
+        "reason": {"type": "STRING"},
+        "stop_loss": {"type": "NUMBER", "nullable": True},
+        "take_profit": {"type": "NUMBER", "nullable": True},
+        "strength": {"type": "INTEGER", "minimum": 1, "maximum": 10},
+        "comment": {"type": "STRING"},
+    },
+    "required": ["signal", "reason", "stop_loss", "take_profit", "strength", "comment"],
+    "propertyOrdering": ["signal", "reason", "stop_loss", "take_profit", "strength", "comment"],
+}
+
+
+class SignalDecodeError(ValueError):
+    """Ответ в JSON-режиме не соответствует схеме сигнала"""
+
+
+@dataclass
+class ParsedSignal:
+    signal: str = "NO_TRADE"
+    reason: str = ""
+    stop_loss: str = "-"
+    take_profit: str = "-"
+    comment: str = ""
+    strength: int | None = None
+    sl_price: float | None = None
+    tp_price: float | None = None
+
+    @property
+    def full_reason(self) -> str:
+        """Причина и комментарий одной строкой (как в parse_trading_signal)"""
+        if self.comment and self.comment != self.reason and self.comment not in self.reason:
+            return f"{self.reason} | {self.comment}"
+        return self.reason
+
+    @property
+    def strength_text(self) -> str | None:
+        return f"{self.strength}/10" if self.strength is not None else None
+
+
+def _price_number(m: re.Match) -> float:
+    number = m.group(0)
+    if m.group("dot_thousands"):
+        number = number.replace(".", "").replace(",", ".")
+    elif m.group("space_thousands"):
+        number = number.replace(" ", "").replace(",", ".")
+    elif m.group("comma_thousands"):
+        number = number.replace(",", "")
+    else:
+        number = number.replace(",", ".")
+    return float(number)
+
+
+def parse_price(value: str) -> float | None:
+    """Цена из поля SL/TP: '$142.5 (под минимумом)' → 142.5.
+
+    Числа с единицами (3 свечи, 2%, 1:3, EMA200) ценой не считаются. Число
+    у валюты или слова "цена"/"уровень" важнее остальных. Если без такой
+    метки остались числа разного порядка (например, 3 и 142.1), цена
+    неоднозначна — None; близкие по величине — берется первое.
+    """
+    if not value:
+        return None
+    marked, plain = [], []
+    for m in _PRICE_RE.finditer(value):
+        before, after = value[:m.start()], value[m.end():]
+        if _NOT_PRICE_AFTER_RE.match(after) or _NOT_PRICE_BEFORE_RE.search(before):
+            continue
+        number = _price_number(m)
+        if _PRICE_MARK_BEFORE_RE.search(before) or _PRICE_MARK_AFTER_RE.match(after):
+            marked.append(number)
+        else:
+            plain.append(number)
+    if marked:
+        return marked[0]
+    if not plain:
+        return None
+    low, high = min(plain), max(plain)
+    if low <= 0 < high or (low > 0 and high / low > 10):
+        return None
+    return plain[0]
+
+
+def _json_price(data: dict, field: str) -> float | None:
+    value = data.get(field)
+    if value is None:
+        return None
+    if isinstance(value, str):
+        # Модель иногда кладет цену строкой вопреки схеме
+        value = parse_price(value)
+        if value is None:
+            raise SignalDecodeError(f"{field}: not a number")
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value <= 0:
+        raise SignalDecodeError(f"{field}: invalid price {value!r}")
+    return float(value)
+
+
+def _format_price(value: float | None) -> str:
+    # Кратчайшая точная запись без экспоненты: 65432.1, 0.000012345
+    return "-" if value is None else format(Decimal(repr(value)).normalize(), "f")
+
+
+def decode_signal_json(text: str) -> ParsedSignal:
+    """Разобрать и проверить ответ JSON-режима; SignalDecodeError — если не по схеме"""
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        raise SignalDecodeError(f"invalid JSON: {e}") from None
+    if not isinstance(data, dict):
+        raise SignalDecodeError("expected JSON object")
+
+    signal = data.get("signal")
+    if not isinstance(signal, str) or signal.upper().replace(" ", "_") not in SIGNAL_VALUES:
+        raise SignalDecodeError(f"signal: unexpected value {signal!r}")
+    signal = signal.upper().replace(" ", "_")
+
+    reason = data.get("reason")
+    comment = data.get("comment", "")
+    if not isinstance(reason, str) or not reason.strip():
+        raise SignalDecodeError("reason: missing")
+    if not isinstance(comment, str):
+        raise SignalDecodeError("comment: expected string")
+
+    strength = data.get("strength")
+    if strength is not None:
+        if isinstance(strength, float) and strength.is_integer():
+            strength = int(strength)
+        if isinstance(strength, bool) or not isinstance(strength, int) or not 1 <= strength <= 10:
+            raise SignalDecodeError(f"strength: expected 1..10, got {strength!r}")
+
+    sl_price = _json_price(data, "stop_loss")
+    tp_price = _json_price(data, "take_profit")
+    if signal != "NO_TRADE" and (sl_price is None or tp_price is None):
+        raise SignalDecodeError(f"{signal} without stop_loss/take_profit")
+
+    return ParsedSignal(
+        signal=signal,
+        reason=reason.strip(),
+        stop_loss=_format_price(sl_price),
+        take_profit=_format_price(tp_price),
+        comment=comment.strip(),
+        strength=strength,
+        sl_price=sl_price,
+        tp_price=tp_price,
+    )
+
+
+def _line_value(text: str, start: int) -> str:
+    end = text.find("\n", start)
+    return text[start:end if end != -1 else len(text)].strip().strip("*").strip()
+
+
+def parse_signal(text: str) -> ParsedSignal:
+    """Разобрать ответ модели за один проход по строкам"""
+    result = ParsedSignal()
+    if not text:
+        return result
+    if text.lstrip().startswith("{"):
+        # Ответ JSON-режима; если он битый — разбираем как обычный текст
+        try:
+            return decode_signal_json(text)
+        except SignalDecodeError:
+            pass
+
+    best: dict[str, tuple[int, str]] = {}
+    label_lines = set()
+    pos = 0
+    for line in text.split("\n"):
+        line_start, pos = pos, pos + len(line) + 1
+        m = _LINE_RE.match(text, line_start, pos)
+        if m is None:
+            continue
+        label_lines.add(line_start)
+        field, priority = _LABELS[m.group("label").lower()]
+        if m.group("num"):
+            priority -= 1  # Нумерованная строка "3. Stop Loss (SL):" — лучший кандидат
+        if field not in best or best[field][0] > priority:
+            best[field] = (priority, _line_value(text, m.end()))
+
+    if len(best) < len(_FIELDS):
+        # Ответ не по формату — добираем недостающие поля из меток внутри строк
+        for m in _INLINE_RE.finditer(text):
+            field, priority = _LABELS[m.group("label").lower()]
+            if field not in best:
+                best[field] = (priority + 10, _line_value(text, m.end()))
+
+    if "signal" in best:
+        m = _SIGNAL_RE.match(best["signal"][1])
+        if m:
+            result.signal = m.group(1).upper().replace(" ", "_")
+    result.reason = best.get("reason", (0, ""))[1]
+    result.stop_loss = best.get("stop_loss", (0, "-"))[1] or "-"
+    result.take_profit = best.get("take_profit", (0, "-"))[1] or "-"
+    result.comment = best.get("comment", (0, ""))[1]
+    m = _STRENGTH_RE.search(text)
+    if m:
+        result.strength = int(m.group(1))
+
+    # Если причина пустая — первая строка без метки, иначе весь текст
+    if not result.reason:
+        pos = 0
+        for line in text.split("\n"):
+            line_start, pos = pos, pos + len(line) + 1
+            line = line.strip()
+            if line and line_start not in label_lines and not _FALLBACK_SKIP_RE.match(line):
+                result.reason = line
+                break
+    if not result.reason:
+        result.reason = text.strip()
+
+    result.sl_price = parse_price(result.stop_loss)
+    result.tp_price = parse_price(result.take_profit)
+    return result
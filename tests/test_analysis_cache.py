@@ -0,0 +1,39 @@
+import asyncio
+import json
+import threading
+import time
+
+from analysis_cache import AnalysisCache
+
+
+def test_flush_waits_for_write_in_progress(tmp_path):
+    path = str(tmp_path / "analysis_cache.json")
+    cache = AnalysisCache(path)
+    sizes, overlaps = [], []
+    lock = threading.Lock()
+    write = cache._write
+
+    def slow_write(snapshot):
+        if not lock.acquire(blocking=False):
+            overlaps.append(snapshot)
+            return
+        try:
+            time.sleep(0.3)
+            write(snapshot)
+            sizes.append(len(snapshot))
+        finally:
+            lock.release()
+
+    cache._write = slow_write
+
+    async def run():
+        cache.put("a", "first")
+        await asyncio.sleep(1.1)
+        cache.put("b", "second")
+        await cache.flush()
+
+    asyncio.run(run())
+    assert overlaps == []
+    assert sizes == [1, 2]
+    with open(path, encoding="utf-8") as f:
+        assert [key for key, _, _ in json.load(f)] == ["a", "b"]
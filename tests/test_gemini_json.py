@@ -0,0 +1,89 @@
+import asyncio
+import json
+import os
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+os.environ.setdefault("METRICS_PORT", "0")
+os.environ.pop("GOOGLE_THINKING_BUDGET", None)
+
+import bot  # noqa: E402  (модуль читает окружение при импорте; файлы трогает только init_runtime)
+from signal_parser import SIGNAL_SCHEMA, decode_signal_json  # noqa: E402
+
+ANSWER = {
+    "signal": "BUY", "reason": "Пробой на объеме", "stop_loss": 142.1,
+    "take_profit": 150.5, "strength": 7, "comment": "",
+}
+
+
+def call_google_json(tmp_path, monkeypatch, model: str):
+    """_call_google в JSON-режиме против локальной заглушки generateContent"""
+    monkeypatch.chdir(tmp_path)  # журнал запросов — во временный каталог
+    requests = []
+
+    async def generate(request):
+        requests.append((request.match_info["model"], await request.json()))
+        return web.json_response({
+            "candidates": [{"content": {"parts": [{"text": json.dumps(ANSWER, ensure_ascii=False)}]}}],
+            "usageMetadata": {"promptTokenCount": 1200, "candidatesTokenCount": 60},
+        })
+
+    async def run():
+        app = web.Application()
+        app.router.add_post("/v1beta/models/{model}:generateContent", generate)
+        server = TestServer(app)
+        await server.start_server()
+        monkeypatch.setattr(bot, "GOOGLE_API_BASE", str(server.make_url("")).rstrip("/"))
+        try:
+            return await bot._call_google(
+                b"\x89PNG fake", bot.prompt_manager, model, bot.google_generation_config("json", model),
+                mime_type="image/png",
+            )
+        finally:
+            await bot.http_client.close()
+            await server.close()
+
+    raw = asyncio.run(run())
+    bot.request_ledger.close()
+    return raw, requests
+
+
+def test_call_google_json_mode_flash(tmp_path, monkeypatch):
+    raw, requests = call_google_json(tmp_path, monkeypatch, "gemini-2.5-flash")
+    assert decode_signal_json(raw).strength == 7
+
+    model, body = requests[0]
+    config = body["generationConfig"]
+    assert model == "gemini-2.5-flash"
+    assert config["responseMimeType"] == "application/json"
+    assert config["responseSchema"] == SIGNAL_SCHEMA
+    assert config["responseSchema"]["properties"]["strength"] == {"type": "INTEGER", "minimum": 1, "maximum": 10}
+    # flash: размышления выключены, весь лимит — на JSON
+    assert config["thinkingConfig"] == {"thinkingBudget": 0}
+    assert config["maxOutputTokens"] == bot.JSON_MAX_OUTPUT_TOKENS
+    assert body["contents"][0]["parts"][-1]["inline_data"]["mime_type"] == "image/png"
+
+
+def test_call_google_json_mode_pro_omits_zero_budget(tmp_path, monkeypatch):
+    raw, requests = call_google_json(tmp_path, monkeypatch, "gemini-2.5-pro")
+    assert decode_signal_json(raw).signal == "BUY"
+    config = requests[0][1]["generationConfig"]
+    # gemini-2.5-pro отклоняет thinkingBudget 0 — без явного бюджета параметр не передаем
+    assert "thinkingConfig" not in config
+    assert "maxOutputTokens" not in config
+
+
+@pytest.mark.parametrize("model, budget, expected", [
+    ("gemini-2.5-flash", 0, 0),
+    ("gemini-2.5-pro", 0, 128),
+    ("gemini-2.5-pro", 512, 512),
+    ("gemini-2.5-pro", -1, -1),
+    ("gemini-2.0-flash", 256, None),
+])
+def test_thinking_budget_per_model(monkeypatch, model, budget, expected):
+    monkeypatch.setattr(bot, "GOOGLE_THINKING_BUDGET", budget)
+    assert bot.thinking_budget(model) == expected
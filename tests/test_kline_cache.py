@@ -0,0 +1,74 @@
+import asyncio
+
+import numpy as np
+
+from kline_cache import KlineCache, KlineRing, parse_bybit_klines
+
+STEP = 60_000
+
+
+def candles(start: int, count: int, price: float = 0.0):
+    ts = np.arange(start, start + count, dtype=np.int64) * STEP
+    close = price + np.arange(start, start + count, dtype=np.float64)
+    return ts, np.column_stack([close, close + 1, close - 1, close, np.ones(count)])
+
+
+def test_frame_survives_compaction():
+    ring = KlineRing(capacity=4)
+    ring.merge(*candles(20, 4))
+    held = ring.frame()
+    before = held.copy()
+    # Запись за концом буфера переносит окно в начало — поверх выданных строк
+    for i in range(24, 30):
+        ring.merge(*candles(i, 1, price=100.0))
+    assert held.equals(before)
+    assert ring.frame()["close"].iloc[-1] == 129.0
+
+
+def test_frame_survives_current_candle_update():
+    ring = KlineRing(capacity=8)
+    ring.merge(*candles(0, 3))
+    held = ring.frame()
+    ts, data = candles(2, 1, price=50.0)
+    ring.merge(ts, data)
+    assert held["close"].iloc[-1] == 2.0
+    assert ring.frame()["close"].iloc[-1] == 52.0
+
+
+def test_frame_survives_full_refetch():
+    calls = []
+
+    async def fetch(symbol, interval, limit, start):
+        calls.append((limit, start))
+        # Полная загрузка отдает другую историю (например, после долгого простоя)
+        return candles(1000 - limit, limit, price=1000.0 * len(calls))
+
+    async def run():
+        cache = KlineCache(fetch, capacity=500)
+        small = await cache.get("BTCUSDT", "1", 120)
+        before = small.copy()
+        cache._fetched_at.clear()
+        await cache.get("BTCUSDT", "1", 400)  # длиннее кэша — ring.clear() + merge
+        return small, before
+
+    small, before = asyncio.run(run())
+    assert len(calls) == 2
+    assert small.equals(before)
+
+
+def test_parse_bybit_klines_selects_columns():
+    rows = [
+        ["1700000120000", "3", "4", "2", "3.5", "30", "105", "extra"],
+        ["1700000060000", "2", "3", "1", "2.5", "20", "50"],
+        ["1700000000000", "1", "2", "0.5", "1.5", "10"],
+        ["1699999940000", "1", "2"],  # обрезанная строка пропускается
+    ]
+    ts, ohlcv = parse_bybit_klines(rows)
+    assert ts.tolist() == [1700000000000, 1700000060000, 1700000120000]
+    assert ts.dtype == np.int64
+    assert ohlcv.tolist() == [[1, 2, 0.5, 1.5, 10], [2, 3, 1, 2.5, 20], [3, 4, 2, 3.5, 30]]
+
+
+def test_parse_bybit_klines_empty():
+    ts, ohlcv = parse_bybit_klines([["1", "2"]])
+    assert len(ts) == 0 and ohlcv.shape == (0, 5)
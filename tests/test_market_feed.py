@@ -0,0 +1,106 @@
+import asyncio
+import json
+
+import numpy as np
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from http_client import HttpClient
+from kline_cache import KlineCache
+from market_feed import BybitKlineStream
+
+STEP = 60_000
+START = 1_700_000_000_000 // STEP * STEP
+
+
+def kline(start_ms: int, close: float, confirm: bool) -> dict:
+    return {
+        "start": start_ms, "open": "10", "high": "12", "low": "9",
+        "close": str(close), "volume": "5", "confirm": confirm,
+    }
+
+
+async def fake_bybit_ws(ops: list):
+    """WS-сервер: на подписку отвечает обновлением текущей свечи и ее закрытием"""
+
+    async def handler(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for msg in ws:
+            message = json.loads(msg.data)
+            ops.append(message)
+            if message.get("op") == "subscribe":
+                for arg in message["args"]:
+                    await ws.send_json({"topic": arg, "data": [kline(START, 10.5, False)]})
+                    await ws.send_json({"topic": arg, "data": [kline(START, 11.0, True)]})
+        return ws
+
+    app = web.Application()
+    app.router.add_get("/ws", handler)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+async def backfill(symbol, interval, limit, start):
+    # История до текущей свечи: 5 закрытых минут
+    ts = START - STEP * np.arange(5, 0, -1, dtype=np.int64)
+    return ts, np.full((5, 5), 10.0)
+
+
+def test_subscribe_merges_stream_candles():
+    async def run():
+        ops = []
+        server = await fake_bybit_ws(ops)
+        http = HttpClient()
+        cache = KlineCache(backfill)
+        stream = BybitKlineStream(http, cache, url=str(server.make_url("/ws")))
+        closed = asyncio.Queue()
+
+        async def on_close(symbol, interval, start_ms):
+            await closed.put((symbol, interval, start_ms))
+
+        stream.add_listener(on_close)
+        try:
+            await stream.subscribe("BTCUSDT", "1")
+            stream.start()
+            event = await asyncio.wait_for(closed.get(), timeout=5)
+            frame = cache.ring("BTCUSDT", "1").frame()
+            live = set(cache.live)
+            await stream.unsubscribe("BTCUSDT", "1")
+            await asyncio.sleep(0.1)
+            return ops, event, frame, live, set(cache.live)
+        finally:
+            await stream.stop()
+            await http.close()
+            await server.close()
+
+    ops, event, frame, live, live_after = asyncio.run(run())
+    assert ops[0] == {"op": "subscribe", "args": ["kline.1.BTCUSDT"]}
+    assert event == ("BTCUSDT", "1", START)
+    # 5 свечей из REST + текущая из потока, обновленная на месте
+    assert len(frame) == 6
+    assert frame.index[-1].value // 1_000_000 == START
+    assert frame["close"].iloc[-1] == 11.0
+    assert live == {("BTCUSDT", "1")}
+    assert {"op": "unsubscribe", "args": ["kline.1.BTCUSDT"]} in ops
+    assert live_after == set()
+
+
+def test_listener_errors_are_reported(capsys):
+    async def run():
+        stream = BybitKlineStream(HttpClient(), KlineCache(backfill))
+
+        async def broken(symbol, interval, start_ms):
+            raise RuntimeError("boom")
+
+        stream.add_listener(broken)
+        stream._emit_closed("BTCUSDT", "1", START)
+        assert len(stream._listener_tasks) == 1
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        return stream
+
+    stream = asyncio.run(run())
+    assert not stream._listener_tasks
+    assert "close listener failed: RuntimeError('boom')" in capsys.readouterr().out
@@ -0,0 +1,60 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import metrics
+from metrics import MetricsServer, loop_lag_seconds, recent_traces, span, start_loop_lag_monitor, stop_loop_lag_monitor
+
+
+def test_root_spans_go_to_their_own_buffer():
+    auto = recent_traces("auto_analysis")
+    auto.clear()
+    gemini_roots = len(metrics.trace_buffers.get("gemini", ()))
+    with span("auto_analysis", symbol="BTCUSDT"):
+        with span("gemini"):
+            pass
+    # Поток анализов фото не вытесняет проходы автоанализа
+    for _ in range(metrics.TRACE_LIMIT + 5):
+        with span("photo_analysis"):
+            with span("gemini"):
+                pass
+
+    assert [trace.name for trace in auto] == ["auto_analysis"]
+    assert auto[0].children[0].name == "gemini"
+    assert len(recent_traces("photo_analysis")) == metrics.TRACE_LIMIT
+    # Вложенные спаны в буферы не попадают
+    assert len(metrics.trace_buffers.get("gemini", ())) == gemini_roots
+
+
+def test_traces_endpoint_filters_by_root():
+    async def run():
+        recent_traces("auto_analysis").clear()
+        with span("auto_analysis"):
+            pass
+        app = web.Application()
+        app.router.add_get("/traces", MetricsServer()._traces)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        try:
+            resp = await client.get("/traces", params={"root": "auto_analysis"})
+            return await resp.json()
+        finally:
+            await client.close()
+
+    data = asyncio.run(run())
+    assert list(data) == ["auto_analysis"]
+    assert data["auto_analysis"][0]["name"] == "auto_analysis"
+
+
+def test_loop_lag_sampled_without_metrics_server():
+    async def run():
+        before = loop_lag_seconds.count()
+        start_loop_lag_monitor(interval=0.01)
+        await asyncio.sleep(0.1)
+        await stop_loop_lag_monitor()
+        return before, loop_lag_seconds.count()
+
+    before, after = asyncio.run(run())
+    assert after > before
+    assert metrics._lag_task is None
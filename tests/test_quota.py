@@ -0,0 +1,58 @@
+import asyncio
+import json
+import threading
+import time
+from zoneinfo import ZoneInfo
+
+from quota import QuotaManager
+
+
+def test_flush_waits_for_write_in_progress(tmp_path):
+    path = str(tmp_path / "last_reset.json")
+    quota = QuotaManager({"daily": 10, "monthly": 100}, ZoneInfo("America/Los_Angeles"), state_path=path)
+    writers, overlaps = [], []
+    lock = threading.Lock()
+    write_state = quota._write_state
+
+    def slow_write(state):
+        # Отложенная запись застревает в потоке, пока flush пытается писать свою
+        if not lock.acquire(blocking=False):
+            overlaps.append(state)
+            return
+        try:
+            time.sleep(0.3)
+            write_state(state)
+            writers.append(state["used_today"])
+        finally:
+            lock.release()
+
+    quota._write_state = slow_write
+
+    async def run():
+        quota.try_acquire()
+        await asyncio.sleep(1.1)  # отложенная запись уже в потоке
+        quota.try_acquire()
+        await quota.flush()
+
+    asyncio.run(run())
+    assert overlaps == []
+    assert writers == [1, 2]
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f)["used_today"] == 2
+    assert quota._persist_task is None
+
+
+def test_flush_cancels_pending_write(tmp_path):
+    path = str(tmp_path / "last_reset.json")
+    quota = QuotaManager({"daily": 10, "monthly": 100}, ZoneInfo("America/Los_Angeles"), state_path=path)
+    writes = []
+    write_state = quota._write_state
+    quota._write_state = lambda state: (writes.append(state["used_today"]), write_state(state))
+
+    async def run():
+        quota.try_acquire()
+        await quota.flush()  # пауза перед записью еще идет — пишет только flush
+
+    asyncio.run(run())
+    assert writes == [1]
+    assert quota._persist_task is None
@@ -0,0 +1,123 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from route_manager import RequestRejected, RouteError, RouteManager, is_route_failure
+
+
+async def fake_api(status: int, delay: float = 0.0):
+    """Локальный "маршрут": отвечает status через delay секунд и считает запросы"""
+    hits = []
+
+    async def handler(request):
+        hits.append(request.path)
+        await asyncio.sleep(delay)
+        return web.json_response({"status": status}, status=status)
+
+    app = web.Application()
+    app.router.add_post("/generate", handler)
+    server = TestServer(app)
+    await server.start_server()
+    return server, hits
+
+
+async def call_routes(manager: RouteManager, urls: dict):
+    async with aiohttp.ClientSession() as session:
+        async def attempt(route):
+            async with session.post(urls[route]) as resp:
+                if resp.status != 200 and not is_route_failure(resp.status):
+                    raise RequestRejected(f"HTTP {resp.status}")
+                if resp.status != 200:
+                    raise RouteError(f"HTTP {resp.status}")
+                return route
+        return await manager.run(attempt)
+
+
+def run_with_servers(specs: dict, scenario):
+    async def run():
+        servers = {name: await fake_api(*spec) for name, spec in specs.items()}
+        try:
+            urls = {name: str(server.make_url("/generate")) for name, (server, _) in servers.items()}
+            hits = {name: found for name, (_, found) in servers.items()}
+            return await scenario(urls, hits)
+        finally:
+            for server, _ in servers.values():
+                await server.close()
+
+    return asyncio.run(run())
+
+
+def test_failover_to_next_route():
+    async def scenario(urls, hits):
+        manager = RouteManager(["proxy", "direct"])
+        result = await call_routes(manager, urls)
+        return result, manager, hits
+
+    result, manager, hits = run_with_servers({"proxy": (503,), "direct": (200,)}, scenario)
+    assert result == "direct"
+    assert manager.stats["proxy"].failures == 1
+    assert manager.stats["direct"].failures == 0
+    # Упавший маршрут уходит в конец очереди
+    assert manager.order() == ["direct", "proxy"]
+
+
+def test_hedge_wins_over_slow_route():
+    async def scenario(urls, hits):
+        manager = RouteManager(["proxy", "direct"], hedge=True, hedge_default=0.1, hedge_min=0.05)
+        result = await call_routes(manager, urls)
+        return result, manager, hits
+
+    result, manager, hits = run_with_servers({"proxy": (200, 2.0), "direct": (200,)}, scenario)
+    assert result == "direct"
+    assert manager.hedges == 1
+    assert manager.stats["direct"].hedges_won == 1
+    # Проигравшая попытка отменена и не считается отказом маршрута
+    assert manager.stats["proxy"].failures == 0
+    assert hits["proxy"] and hits["direct"]
+
+
+def test_rejection_fails_over_and_penalises_route():
+    # Геоблок: один маршрут отвечает 400, другой — 200
+    async def scenario(urls, hits):
+        manager = RouteManager(["direct", "proxy"])
+        result = await call_routes(manager, urls)
+        return result, manager, hits
+
+    result, manager, hits = run_with_servers({"direct": (400,), "proxy": (200,)}, scenario)
+    assert result == "proxy"
+    assert hits["direct"] and hits["proxy"]
+    assert manager.stats["direct"].failures == 1
+    assert manager.order() == ["proxy", "direct"]
+
+
+def test_hedge_rejection_does_not_cancel_primary():
+    async def scenario(urls, hits):
+        manager = RouteManager(["proxy", "direct"], hedge=True, hedge_default=0.1, hedge_min=0.05)
+        result = await call_routes(manager, urls)
+        return result, manager, hits
+
+    result, manager, hits = run_with_servers({"proxy": (200, 0.5), "direct": (400,)}, scenario)
+    assert result == "proxy"
+    assert manager.hedges == 1
+    assert manager.stats["direct"].failures == 1
+    assert manager.stats["proxy"].failures == 0
+
+
+def test_rejection_returned_when_all_routes_fail():
+    async def scenario(urls, hits):
+        manager = RouteManager(["proxy", "direct"])
+        with pytest.raises(RequestRejected, match="HTTP 400"):
+            await call_routes(manager, urls)
+        return manager, hits
+
+    manager, hits = run_with_servers({"proxy": (400,), "direct": (503,)}, scenario)
+    assert hits["proxy"] and hits["direct"]
+    assert manager.stats["proxy"].failures == 1 and manager.stats["direct"].failures == 1
+
+
+@pytest.mark.parametrize("status, failure", [(429, True), (500, True), (503, True), (400, False), (403, False), (404, False)])
+def test_is_route_failure(status, failure):
+    assert is_route_failure(status) is failure
@@ -0,0 +1,62 @@
+import time
+
+import numpy as np
+
+from signal_outcomes import EXPIRED, PENDING, STOP_LOSS, TAKE_PROFIT, SignalJournal, resolve_outcomes
+
+STEP = 60_000
+
+
+def ohlcv(highs, lows, closes):
+    highs, lows, closes = map(np.asarray, (highs, lows, closes))
+    return np.column_stack([closes, highs, lows, closes, np.ones(len(closes))]).astype(np.float64)
+
+
+def test_resolve_outcomes_first_touch():
+    ts = np.arange(6, dtype=np.int64) * STEP
+    high = np.array([100, 101, 103, 101, 100, 100.0])
+    low = np.array([100, 99.5, 100, 97, 100, 100.0])
+    close = np.array([100, 100, 102, 98, 100, 100.0])
+    # BUY: тейк 102 на свече 2; SELL: стоп 102 там же; BUY со стопом и тейком в одной свече — стоп
+    outcome, exit_index, r = resolve_outcomes(
+        np.array([0, 0, 2 * STEP]), np.array([1.0, -1.0, 1.0]), np.array([100.0, 100.0, 102.0]),
+        np.array([99.0, 102.0, 97.5]), np.array([102.0, 96.0, 103.0]),
+        ts, high, low, close, horizon=3,
+    )
+    assert outcome.tolist() == [TAKE_PROFIT, STOP_LOSS, STOP_LOSS]
+    assert exit_index.tolist() == [2, 2, 3]
+    assert r.tolist() == [2.0, -1.0, -1.0]
+
+
+def test_resolve_outcomes_expiry_and_pending():
+    ts = np.arange(5, dtype=np.int64) * STEP
+    flat = np.full(5, 100.0)
+    outcome, exit_index, r = resolve_outcomes(
+        np.array([0, 3 * STEP]), np.array([1.0, 1.0]), np.array([99.0, 100.0]),
+        np.array([90.0, 90.0]), np.array([120.0, 120.0]),
+        ts, flat + 1, flat - 1, flat, horizon=3,
+    )
+    assert outcome.tolist() == [EXPIRED, PENDING]
+    assert exit_index.tolist() == [3, -1]
+    assert r[0] == 1 / 9 and np.isnan(r[1])
+
+
+def test_journal_ignores_open_candle(tmp_path):
+    journal = SignalJournal(str(tmp_path / "signals.jsonl"), expiry_candles=10)
+    # Последняя свеча началась 30 с назад — она еще формируется
+    last = int(time.time() * 1000 // STEP * STEP)
+    ts = last - STEP * np.arange(3, -1, -1, dtype=np.int64)
+    journal.record("BTCUSDT", "1", int(ts[0]), "BUY", 100.0, 95.0, 110.0, 7)
+
+    candles = ohlcv([100, 101, 102, 111], [99, 99, 100, 100], [100, 100, 101, 110])
+    assert journal.resolve("BTCUSDT", "1", ts, candles) == 0
+    assert journal.pending_pairs() == {("BTCUSDT", "1"): int(ts[0])}
+
+    # Та же свеча закрылась (следующая уже открыта) — тейк засчитывается
+    assert journal.resolve("BTCUSDT", "1", ts - STEP, candles) == 1
+    journal.close()
+
+    reloaded = SignalJournal(str(tmp_path / "signals.jsonl"))
+    reloaded.load()
+    assert reloaded.signals[0]["outcome"] == TAKE_PROFIT
+    assert reloaded.pending_pairs() == {}
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from signal_parser import SignalDecodeError, decode_signal_json, parse_price, parse_signal
+
+
+def signal_json(**overrides) -> str:
+    data = {
+        "signal": "BUY", "reason": "Пробой сопротивления на объеме", "stop_loss": 64850.5,
+        "take_profit": 66900, "strength": 7, "comment": "Риск $1, прибыль $2",
+    }
+    data.update(overrides)
+    return json.dumps(data, ensure_ascii=False)
+
+
+def test_decode_signal_json():
+    parsed = decode_signal_json(signal_json())
+    assert parsed.signal == "BUY"
+    assert parsed.sl_price == 64850.5 and parsed.tp_price == 66900.0
+    assert parsed.stop_loss == "64850.5" and parsed.take_profit == "66900"
+    assert parsed.strength == 7
+    assert parsed.full_reason == "Пробой сопротивления на объеме | Риск $1, прибыль $2"
+
+
+def test_decode_no_trade_without_levels():
+    parsed = decode_signal_json(signal_json(signal="No Trade", stop_loss=None, take_profit=None, strength=2))
+    assert parsed.signal == "NO_TRADE"
+    assert parsed.stop_loss == "-" and parsed.sl_price is None
+
+
+def test_decode_price_as_string():
+    assert decode_signal_json(signal_json(stop_loss="$64,850.5")).sl_price == 64850.5
+
+
+@pytest.mark.parametrize("text, message", [
+    ('{"signal": "BUY", "reason": "x"', "invalid JSON"),
+    ("[1, 2]", "expected JSON object"),
+    (signal_json(signal="HOLD"), "signal"),
+    (signal_json(reason=" "), "reason"),
+    (signal_json(strength=11), "strength"),
+    (signal_json(strength=0), "strength"),
+    (signal_json(stop_loss=-5), "stop_loss"),
+    (signal_json(take_profit=None), "without stop_loss/take_profit"),
+])
+def test_decode_rejects_off_schema(text, message):
+    with pytest.raises(SignalDecodeError, match=message):
+        decode_signal_json(text)
+
+
+def test_malformed_json_falls_back_to_text_parser():
+    # Ответ обрезан посередине объекта, но поля построчно читаются как текст
+    text = '{\n"Сигнал: Sell\nПричина: Отбой от сопротивления\nStop Loss: 2510\nTake Profit: 2440\n'
+    parsed = parse_signal(text)
+    assert parsed.signal == "SELL"
+    assert parsed.reason == "Отбой от сопротивления"
+    assert parsed.sl_price == 2510.0 and parsed.tp_price == 2440.0
+
+
+def test_valid_json_goes_through_strict_decoder():
+    parsed = parse_signal(signal_json(signal="SELL", stop_loss=1.25, take_profit=1.1))
+    assert parsed.signal == "SELL" and parsed.sl_price == 1.25 and parsed.strength == 7
+
+
+@pytest.mark.parametrize("text, price", [
+    ("$142.5 (под минимумом)", 142.5),
+    ("ниже 3 свечей 142.1", 142.1),
+    ("142.1 (R:R 1:3, 2% риска)", 142.1),
+    ("EMA200 142.3", 142.3),
+    ("на уровне 2510 (ниже 2 свечей)", 2510.0),
+    ("1.234,5", 1234.5),
+    ("1,234.5", 1234.5),
+    ("65 432,10 USDT", 65432.1),
+    ("142,5", 142.5),
+    ("0.00012345", 0.00012345),
+    ("142 или 145", 142.0),
+])
+def test_parse_price(text, price):
+    assert parse_price(text) == price
+
+
+@pytest.mark.parametrize("text", ["-", "", "3 и 142.1", "нет уровня"])
+def test_parse_price_ambiguous_or_missing(text):
+    assert parse_price(text) is None
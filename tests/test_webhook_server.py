@@ -0,0 +1,77 @@
+import asyncio
+
+from aiogram import Bot, Dispatcher
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook_server import SECRET_HEADER, WebhookServer
+
+SECRET = "s3cret-token"
+UPDATE = {
+    "update_id": 1001,
+    "message": {
+        "message_id": 7,
+        "date": 1_700_000_000,
+        "chat": {"id": 42, "type": "private"},
+        "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+        "text": "hello",
+    },
+}
+
+
+def run_webhook(scenario):
+    async def run():
+        dp = Dispatcher()
+        seen = []
+
+        @dp.message()
+        async def on_message(message):
+            seen.append((message.chat.id, message.text))
+
+        bot = Bot("123456:TEST")
+        server = WebhookServer(dp, bot, path="/hook", secret_token=SECRET)
+        client = TestClient(TestServer(server.app))
+        await client.start_server()
+        try:
+            result = await scenario(client, server)
+            await server.stop(drain_timeout=5)
+            return result, seen, server
+        finally:
+            await client.close()
+            await bot.session.close()
+
+    return asyncio.run(run())
+
+
+def test_update_with_secret_is_processed():
+    async def scenario(client, server):
+        resp = await client.post("/hook", json=UPDATE, headers={SECRET_HEADER: SECRET})
+        return resp.status
+
+    status, seen, server = run_webhook(scenario)
+    assert status == 200
+    assert seen == [(42, "hello")]
+    assert server.received == 1 and server.failed == 0
+
+
+def test_update_without_secret_is_rejected():
+    async def scenario(client, server):
+        missing = await client.post("/hook", json=UPDATE)
+        wrong = await client.post("/hook", json=UPDATE, headers={SECRET_HEADER: "guess"})
+        return missing.status, wrong.status
+
+    statuses, seen, server = run_webhook(scenario)
+    assert statuses == (401, 401)
+    assert seen == []
+    assert server.received == 0
+
+
+def test_draining_server_answers_503():
+    async def scenario(client, server):
+        server._draining = True
+        resp = await client.post("/hook", json=UPDATE, headers={SECRET_HEADER: SECRET})
+        health = await client.get("/healthz")
+        return resp.status, health.status
+
+    statuses, seen, server = run_webhook(scenario)
+    assert statuses == (503, 503)
+    assert seen == [] and server.rejected == 1
@@ -0,0 +1,106 @@
+"""Прием апдейтов Telegram через вебхук на встроенном aiohttp-сервере.
+
+Telegram присылает апдейт POST-запросом; запрос проверяется по секретному
+токену (X-Telegram-Bot-Api-Secret-Token), отвечаем сразу, а апдейт
+обрабатывается в фоне с ограничением одновременных обработок. Если фоновых
+задач слишком много или идет остановка — отвечаем 503, и Telegram
+повторит доставку позже (в том числе на другую реплику).
+"""
+import asyncio
+import hmac
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """aiohttp-сервер вебхука с ограничением параллелизма и мягкой остановкой"""
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        *,
+        path: str = "/telegram/webhook",
+        secret_token: str | None = None,
+        host: str = "0.0.0.0",
+        port: int = 8080,
+        max_concurrency: int = 32,
+        max_pending: int = 1000,
+    ):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.host = host
+        self.port = port
+        self.max_pending = max_pending
+        self.received = 0
+        self.rejected = 0
+        self.failed = 0
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks: set[asyncio.Task] = set()
+        self._draining = False
+        self._runner: web.AppRunner | None = None
+        self.app = web.Application()
+        self.app.router.add_post(path, self._handle)
+        self.app.router.add_get("/healthz", self._healthz)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def _healthz(self, request: web.Request) -> web.Response:
+        # Балансировщик перестает слать трафик на реплику, которая останавливается
+        return web.Response(status=503 if self._draining else 200, text="draining" if self._draining else "ok")
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        if self.secret_token is not None:
+            token = request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(token, self.secret_token):
+                return web.Response(status=401)
+        if self._draining or len(self._tasks) >= self.max_pending:
+            self.rejected += 1
+            return web.Response(status=503)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            print(f"[webhook] bad update: {e}")
+            return web.Response(status=400)
+        self.received += 1
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response(status=200)
+
+    async def _process(self, update: Update) -> None:
+        async with self._slots:
+            try:
+                await self.dispatcher.feed_update(self.bot, update)
+            except Exception as e:
+                self.failed += 1
+                print(f"[webhook] update {update.update_id} failed: {e}")
+
+    async def start(self) -> None:
+        self._draining = False
+        self._runner = web.AppRunner(self.app, handle_signals=False)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        print(f"[webhook] listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self, drain_timeout: float = 30.0) -> None:
+        """Перестать принимать апдейты и дождаться (до drain_timeout) уже принятых"""
+        self._draining = True
+        if self._tasks:
+            print(f"[webhook] draining {len(self._tasks)} updates")
+            _, pending = await asyncio.wait(set(self._tasks), timeout=drain_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None